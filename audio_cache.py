@@ -0,0 +1,221 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+
+CACHE_DIR = "./cache/tts"
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """统一全半角与空白；标点保留（影响语气停顿）"""
+    text = unicodedata.normalize("NFKC", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(character: str, text: str, voice_hash: str = "") -> str:
+    """角色 + 规范化文本 + 参考音频内容哈希 -> 缓存键
+
+    参考音频内容变化（换了音色文件）时键随之变化，旧音频自然失效。
+    """
+    raw = "\x1f".join((character, normalize_text(text), voice_hash))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """合成音频的两级缓存
+
+    - 内存LRU：按字节数限额，命中即可直接播放
+    - 磁盘层：按内容键存放WAV文件，总大小超限时淘汰最久未用的文件，进程重启后仍然有效
+    重复的台词（问候、应答）只合成一次，之后不再请求TTS服务。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = CACHE_DIR, memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            cache_dir: 磁盘缓存目录，None表示只用内存
+            memory_bytes: 内存层容量（字节）
+            disk_bytes: 磁盘层容量（字节）
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # 键 -> WAV字节，按最近使用排序
+        self._memory_size = 0
+        self._disk = OrderedDict()  # 键 -> 文件大小，按最近使用排序
+        self._disk_size = 0
+        self._disk_loaded = False
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def _load_disk_index(self):
+        """首次访问时扫描磁盘层，按修改时间恢复LRU顺序（需持有锁）"""
+        if self._disk_loaded or not self.cache_dir:
+            return
+        self._disk_loaded = True
+        entries = []
+        try:
+            for sub in os.scandir(self.cache_dir):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith(".wav"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        except FileNotFoundError:
+            return
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def get(self, character: str, text: str, voice_hash: str = "") -> Optional[bytes]:
+        """查找缓存的音频，未命中返回None"""
+        key = cache_key(character, text, voice_hash)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+
+            self._load_disk_index()
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)  # 刷新修改时间，重启后LRU顺序不丢
+        except OSError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def contains(self, character: str, text: str, voice_hash: str = "") -> bool:
+        """是否已缓存（不计入命中统计）"""
+        key = cache_key(character, text, voice_hash)
+        with self._lock:
+            if key in self._memory:
+                return True
+            self._load_disk_index()
+            return key in self._disk
+
+    def put(self, character: str, text: str, audio: bytes, voice_hash: str = ""):
+        """存入合成好的音频（内存与磁盘两层）"""
+        key = cache_key(character, text, voice_hash)
+        with self._lock:
+            self.stores += 1
+            self._remember(key, audio)
+            if not self.cache_dir or len(audio) > self.disk_bytes:
+                return
+            self._load_disk_index()
+            known = key in self._disk
+
+        if not known:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(audio)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ 音频缓存写入失败: {e}")
+                return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_size += len(audio)
+            self._disk.move_to_end(key)
+            evicted = self._evict_disk()
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _remember(self, key: str, audio: bytes):
+        """放入内存层并按容量淘汰（需持有锁）"""
+        if len(audio) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.evictions += 1
+
+    def _evict_disk(self) -> list:
+        """磁盘层超限时淘汰最久未用的条目，返回待删除的键（需持有锁）"""
+        evicted = []
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.evictions += 1
+            evicted.append(key)
+        return evicted
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+    def stats(self) -> dict:
+        """命中统计与容量占用"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache:
+    """获取共享的音频缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AudioCache()
+    return _cache
@@ -0,0 +1,329 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+
+class _PlaybackClock:
+    """播放计时线程
+
+    按截止时间触发回调（播放结束、续排下一段），在两次事件之间阻塞等待，
+    不做固定间隔的轮询。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._thread = None
+
+    def call_at(self, deadline: float, callback: Callable[[], None]):
+        """在 time.monotonic() 达到 deadline 时执行回调"""
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._seq), callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="playback_clock", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, callback = heapq.heappop(self._heap)
+
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 播放回调异常: {e}")
+
+
+_clock = _PlaybackClock()
+
+
+class SoundStream:
+    """在单个通道上按顺序无缝播放一组 pygame Sound
+
+    当前段播放时，下一段通过 Channel.queue 预先交给混音器，由SDL在样本级衔接，
+    段间没有空隙。结束时间由各段时长推算，在截止时刻触发续排与完成回调，
+    无需轮询 get_busy。
+    """
+
+    # 截止时刻通道仍未切换到排队的声音时，稍后再检查
+    _RECHECK_DELAY = 0.01
+
+    def __init__(self, channel=None, volume: float = 0.9,
+                 on_finished: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            channel: 使用的混音通道，None则首次播放时自动分配
+            volume: 通道音量（0.0-1.0）
+            on_finished: 全部片段播放完毕（或被停止）后的回调
+        """
+        self.channel = channel
+        self.volume = volume
+        self.on_finished = on_finished
+
+        self._lock = threading.RLock()
+        self._pending = deque()
+        self._queued_length = None  # 已交给 Channel.queue 的声音时长
+        self._current_end = None  # 当前声音的预计结束时间
+        self._closed = False
+        self._stopped = False
+        self._finished = threading.Event()
+        self._sounds = []  # 持有引用，防止播放中被回收
+
+    def enqueue(self, sound):
+        """追加一段声音"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._sounds.append(sound)
+            self._pending.append(sound)
+            self._feed()
+
+    def close(self):
+        """声明不再追加声音，剩余片段播完后触发完成回调"""
+        with self._lock:
+            self._closed = True
+            if self._current_end is None and not self._pending:
+                self._finish()
+
+    def stop(self):
+        """立即停止播放并丢弃未播放的片段"""
+        with self._lock:
+            self._stopped = True
+            self._pending.clear()
+            if self.channel is not None:
+                try:
+                    self.channel.stop()
+                except Exception:
+                    pass
+            self._finish()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待播放完成"""
+        return self._finished.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def _feed(self):
+        """空闲时立即播放，播放中则预排下一段（需持有锁）"""
+        if not self._pending or self._stopped:
+            return
+
+        if self._current_end is None:
+            sound = self._pending.popleft()
+            if self.channel is None:
+                import pygame
+                self.channel = pygame.mixer.find_channel(True)
+            self.channel.set_volume(self.volume)
+            self.channel.play(sound)
+            self._current_end = time.monotonic() + sound.get_length()
+            _clock.call_at(self._current_end, self._on_deadline)
+        elif self._queued_length is None:
+            sound = self._pending.popleft()
+            self.channel.queue(sound)
+            self._queued_length = sound.get_length()
+
+    def _on_deadline(self):
+        """当前段到达预计结束时间"""
+        with self._lock:
+            if self._stopped or self._current_end is None:
+                return
+
+            if self._queued_length is not None:
+                # 排队的声音尚未开始（混音器略有延迟），稍后再确认，避免覆盖队列
+                if self.channel.get_queue() is not None and self.channel.get_busy():
+                    _clock.call_at(time.monotonic() + self._RECHECK_DELAY, self._on_deadline)
+                    return
+                self._current_end += self._queued_length
+                self._queued_length = None
+                _clock.call_at(self._current_end, self._on_deadline)
+                self._feed()
+                return
+
+            self._current_end = None
+            if self._pending:
+                self._feed()
+            elif self._closed:
+                self._finish()
+
+    def _finish(self):
+        """标记完成并触发回调（需持有锁）"""
+        if self._finished.is_set():
+            return
+        self._finished.set()
+        self._sounds.clear()
+        if self.on_finished:
+            try:
+                self.on_finished()
+            except Exception as e:
+                print(f"⚠️ 播放完成回调异常: {e}")
+
+
+class AudioOutputService:
+    """进程内唯一的音频输出服务
+
+    混音器只按固定格式初始化一次，之后音乐与各角色语音都从这里获取通道，
+    任何工具都不需要 quit()/init() 重建设备，也不会打断正在播放的声音。
+    """
+
+    def __init__(self, frequency: int = 22050, size: int = -16, channels: int = 2,
+                 buffer: int = 512, num_channels: int = 16):
+        """
+        Args:
+            frequency: 采样率
+            size: 采样位数（负数表示有符号）
+            channels: 声道数
+            buffer: 混音缓冲区大小，越小延迟越低
+            num_channels: 初始混音通道数，不够时自动扩充
+        """
+        self.frequency = frequency
+        self.size = size
+        self.channels = channels
+        self.buffer = buffer
+        self.num_channels = num_channels
+
+        self._lock = threading.RLock()
+        self._initialized = False
+        self._free_channels = []
+        self._leased = {}  # id(Channel对象) -> 通道编号
+        self._voices = {}  # 声音名称 -> 正在播放的 SoundStream 列表
+
+    def ensure_init(self):
+        """按固定格式初始化混音器（只执行一次）"""
+        with self._lock:
+            if self._initialized:
+                return
+            import pygame
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(frequency=self.frequency, size=self.size,
+                                  channels=self.channels, buffer=self.buffer)
+            pygame.mixer.set_num_channels(self.num_channels)
+            self._free_channels = list(range(self.num_channels))
+            self._initialized = True
+
+    def acquire_channel(self):
+        """独占一个混音通道，用完需 release_channel 归还"""
+        import pygame
+
+        with self._lock:
+            self.ensure_init()
+            if not self._free_channels:
+                # 通道耗尽时扩充，而不是抢占其他声音
+                self._free_channels.append(self.num_channels)
+                self.num_channels += 1
+                pygame.mixer.set_num_channels(self.num_channels)
+            channel_id = self._free_channels.pop(0)
+            channel = pygame.mixer.Channel(channel_id)
+            self._leased[id(channel)] = channel_id
+            return channel
+
+    def release_channel(self, channel):
+        """归还通道"""
+        with self._lock:
+            channel_id = self._leased.pop(id(channel), None)
+            if channel_id is not None:
+                self._free_channels.append(channel_id)
+
+    def open_stream(self, voice: str, volume: float = 1.0,
+                    on_finished: Optional[Callable[[], None]] = None) -> SoundStream:
+        """为指定声音（角色名等）打开一个独占通道的声音流，播放结束自动归还通道"""
+        channel = self.acquire_channel()
+        stream = None
+
+        def finished():
+            with self._lock:
+                streams = self._voices.get(voice, [])
+                if stream in streams:
+                    streams.remove(stream)
+                if not streams:
+                    self._voices.pop(voice, None)
+            self.release_channel(channel)
+            if on_finished:
+                on_finished()
+
+        stream = SoundStream(channel=channel, volume=volume, on_finished=finished)
+        with self._lock:
+            self._voices.setdefault(voice, []).append(stream)
+        return stream
+
+    def set_voice_volume(self, voice: str, volume: float) -> int:
+        """调整某个声音所有正在播放的通道音量，返回受影响的流数量"""
+        volume = max(0.0, min(1.0, volume))
+        with self._lock:
+            streams = list(self._voices.get(voice, []))
+        for stream in streams:
+            stream.volume = volume
+            if stream.channel is not None:
+                stream.channel.set_volume(volume)
+        return len(streams)
+
+    def stop_voice(self, voice: str) -> int:
+        """停止某个声音的全部播放，返回停止的流数量"""
+        with self._lock:
+            streams = list(self._voices.get(voice, []))
+        for stream in streams:
+            stream.stop()
+        return len(streams)
+
+    def stop_all_voices(self) -> int:
+        """停止全部语音（不影响音乐）"""
+        with self._lock:
+            streams = [stream for streams in self._voices.values() for stream in streams]
+        for stream in streams:
+            stream.stop()
+        return len(streams)
+
+    def active_voices(self):
+        """正在播放的声音名称列表"""
+        with self._lock:
+            return list(self._voices)
+
+    def play_music(self, path: str, volume: float = 1.0):
+        """播放背景音乐（独立的音乐通道，不影响语音）"""
+        import pygame
+
+        self.ensure_init()
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play()
+        return pygame.mixer.music.get_busy()
+
+    def stop_music(self) -> bool:
+        """停止背景音乐，返回之前是否在播放"""
+        import pygame
+
+        if not pygame.mixer.get_init():
+            return False
+        was_playing = pygame.mixer.music.get_busy()
+        pygame.mixer.music.stop()
+        return was_playing
+
+    def set_music_volume(self, volume: float):
+        """设置背景音乐音量（0.0-1.0）"""
+        import pygame
+
+        self.ensure_init()
+        pygame.mixer.music.set_volume(max(0.0, min(1.0, volume)))
+
+
+_audio_service = None
+_audio_service_lock = threading.Lock()
+
+
+def get_audio_service() -> AudioOutputService:
+    """获取共享的音频输出服务"""
+    global _audio_service
+    if _audio_service is None:
+        with _audio_service_lock:
+            if _audio_service is None:
+                _audio_service = AudioOutputService()
+    return _audio_service
@@ -0,0 +1,359 @@
+import time
+import argparse
+
+
+def _time_per_call(func, iterations):
+    """返回单次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_validate_params(iterations=20000):
+    """对比参数校验：线性扫描+jsonschema.validate vs 预编译校验器索引"""
+    from jsonschema import validate, ValidationError
+    from tool_manager import ToolManager
+
+    tm = ToolManager()
+    tools = tm.get_tools()
+    if not tools:
+        print("无可用工具定义，跳过")
+        return {}
+
+    # 取最后一个带参数的工具，线性扫描的最坏情况
+    target = next(
+        (t for t in reversed(tools) if t["function"].get("parameters", {}).get("properties")),
+        tools[-1]
+    )
+    name = target["function"]["name"]
+    params = {key: "测试" if spec.get("type") == "string" else 100.0
+              for key, spec in target["function"]["parameters"].get("properties", {}).items()}
+
+    def legacy():
+        # 原 main_ollama.validate_params 的实现
+        for tool in tools:
+            if tool.get("function", {}).get("name") == name:
+                try:
+                    validate(instance=params, schema=tool["function"]["parameters"])
+                except ValidationError:
+                    pass
+                return
+
+    def indexed():
+        tm.validate_params(name, params)
+
+    legacy_us = _time_per_call(legacy, iterations)
+    indexed_us = _time_per_call(indexed, iterations)
+
+    print(f"=== validate_params: {name} ({len(tools)} 个工具, {iterations} 次) ===")
+    print(f"线性扫描+validate: {legacy_us:.2f} µs/次")
+    print(f"预编译校验器索引: {indexed_us:.2f} µs/次")
+    print(f"加速比: {legacy_us / indexed_us:.1f}x")
+
+    return {"legacy_us": legacy_us, "indexed_us": indexed_us}
+
+
+def _synthetic_tracks(track_count, queries, seed=0):
+    """生成中英文混合的合成曲库与查询（含错字查询）"""
+    import random
+
+    rng = random.Random(seed)
+    chars = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研质"
+    # 英文词表：少量高频词 + 随机生成的长尾词，接近真实曲库的分布
+    latin = ["love", "story", "night", "dream", "summer", "piano", "remix", "live", "version", "moon"]
+    latin += ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 8)))
+              for _ in range(3000)]
+    names = []
+    for i in range(track_count):
+        if rng.random() < 0.8:
+            name = "".join(rng.choice(chars) for _ in range(rng.randint(2, 8)))
+        else:
+            name = " ".join(rng.choice(latin[:10] if rng.random() < 0.1 else latin) for _ in range(rng.randint(1, 3)))
+        names.append(f"{name}{i}")
+
+    # 查询：一半截取曲名片段，一半再替换一个字模拟错字/同音字（子串扫描落空，走difflib）
+    queries_list = []
+    for i in range(queries):
+        core = rng.choice(names).rstrip("0123456789")
+        start = rng.randint(0, max(0, len(core) - 3))
+        query = core[start:start + rng.randint(3, 5)]
+        if i % 2 and len(query) > 2:
+            pos = rng.randrange(len(query))
+            query = query[:pos] + rng.choice(chars) + query[pos + 1:]
+        queries_list.append(query)
+
+    return names, queries_list
+
+
+def bench_music_match(track_count=50000, queries=200, seed=0):
+    """对比曲名匹配：原子串扫描+difflib vs n-gram倒排索引"""
+    import difflib
+    from music_matcher import TrackMatcher
+
+    names, queries_list = _synthetic_tracks(track_count, queries, seed)
+
+    def legacy(query):
+        # 原 play_specific_music 的匹配逻辑
+        lowered = query.lower()
+        for name in names:
+            if lowered in name.lower():
+                return name
+        matches = difflib.get_close_matches(query, names, n=1, cutoff=0.3)
+        return matches[0] if matches else None
+
+    start = time.perf_counter()
+    matcher = TrackMatcher(names)
+    build_s = time.perf_counter() - start
+
+    legacy_sample = queries_list[:20]  # difflib 路径太慢，只取部分查询
+    legacy_us = sum(_time_per_call(lambda q=q: legacy(q), 1) for q in legacy_sample) / len(legacy_sample)
+    indexed_times = sorted(_time_per_call(lambda q=q: matcher.search(q, top_k=5), 5) for q in queries_list)
+    indexed_us = sum(indexed_times) / len(indexed_times)
+    p50_us = indexed_times[len(indexed_times) // 2]
+    p99_us = indexed_times[min(len(indexed_times) - 1, int(len(indexed_times) * 0.99))]
+
+    print(f"=== 曲名匹配: {track_count} 首曲目 ===")
+    print(f"索引构建: {build_s:.2f}s")
+    print(f"子串扫描+difflib: {legacy_us / 1000:.2f} ms/次 (抽样 {len(legacy_sample)} 次)")
+    print(f"n-gram倒排索引 top5: 平均 {indexed_us / 1000:.3f} ms, p50 {p50_us / 1000:.3f} ms, "
+          f"p99 {p99_us / 1000:.3f} ms ({len(queries_list)} 次)")
+    print(f"加速比: {legacy_us / indexed_us:.0f}x")
+
+    return {"build_s": build_s, "legacy_us": legacy_us, "indexed_us": indexed_us,
+            "indexed_p50_us": p50_us, "indexed_p99_us": p99_us}
+
+
+def _legacy_segmentation(text, max_len=80, min_len=25):
+    """原 smart_text_segmentation 的固定规则"""
+    import re
+
+    separators = r'[。！？；：,.!?;:]'
+    result = []
+    current = ""
+    for part in re.split(f'({separators})', text):
+        if part.strip():
+            current += part
+            if re.match(separators, part) or len(current) > max_len:
+                if current.strip():
+                    result.append(current.strip())
+                    current = ""
+    if current.strip():
+        result.append(current.strip())
+
+    final_result = []
+    temp = ""
+    for segment in result:
+        temp += segment
+        if len(temp) >= min_len or segment == result[-1]:
+            final_result.append(temp)
+            temp = ""
+    return final_result or [text]
+
+
+def _simulate_playback(segments, overhead, per_unit, audio_per_unit, concurrency=3, streaming=False):
+    """模拟共享调度器下的合成与顺序播放，返回 (首音延迟, 断流总时长)
+
+    首段优先、其余按顺序占用 concurrency 个合成槽；流式时首块在固定开销后即可播放。
+    """
+    import heapq
+    from text_segmenter import speech_units
+
+    slots = [0.0] * concurrency
+    ready = []  # (首块可播时刻, 全部到达时刻, 音频时长)
+    for segment in segments:
+        units = speech_units(segment)
+        start = heapq.heappop(slots)
+        finish = start + overhead + per_unit * units
+        heapq.heappush(slots, finish)
+        first = start + overhead if streaming else finish
+        ready.append((first, finish, audio_per_unit * units))
+
+    clock = ready[0][0]
+    first_audio = clock
+    gaps = 0.0
+    for first, finish, duration in ready:
+        if first > clock:
+            gaps += first - clock
+            clock = first
+        # 流式时音频按合成速度到达，播放不能超过到达进度
+        clock = max(clock + duration, finish) if streaming else clock + duration
+    return first_audio, gaps
+
+
+def bench_segmentation(seed=0):
+    """对比分段策略：固定规则 vs 自适应分段（按模拟的服务延迟计算首音延迟与断流）"""
+    import random
+    from text_segmenter import AdaptiveSegmenter, speech_units
+
+    rng = random.Random(seed)
+    clauses = ["好的，舰长！", "今天天气真不错，", "我们一起出去走走吧，", "顺便去图书馆看看有没有新书到了。",
+               "知识就像一棵大树，根扎得越深，枝叶就越茂盛。", "Hello traveler, nice to meet you! ",
+               "外面在下雨，记得带伞哦。", "这个问题有点难，让我想一想再回答你。", "The price is 3.14 dollars. ",
+               "姐姐说今天要一起去看星星，舰长也一起来吧？", "博士，今天的任务已经整理好了，请过目。"]
+    texts = ["".join(rng.choice(clauses) for _ in range(rng.randint(1, 8))) for _ in range(200)]
+
+    # 服务模型：(固定开销, 每字合成耗时, 每字音频时长, 是否流式)
+    servers = {
+        "整段返回": (0.3, 0.03, 0.22, False),
+        "整段返回(慢)": (0.5, 0.12, 0.22, False),
+        "流式返回": (0.3, 0.03, 0.22, True),
+    }
+
+    results = {}
+    print(f"=== 文本分段: {len(texts)} 段回复 ===")
+    print(f"{'服务':<10} {'策略':<6} {'首音均值(s)':>10} {'首音p95(s)':>10} {'断流均值(s)':>10} {'段数均值':>8}")
+    for server, (overhead, per_unit, audio_per_unit, streaming) in servers.items():
+        segmenter = AdaptiveSegmenter()
+        # 先用少量合成结果让分段器学习服务特性
+        for text in texts[:20]:
+            for segment in segmenter.segment(text):
+                units = speech_units(segment)
+                total = overhead + per_unit * units
+                segmenter.observe(segment, overhead if streaming else total, total, audio_per_unit * units)
+
+        for name, split in (("固定规则", _legacy_segmentation), ("自适应", segmenter.segment)):
+            firsts, gaps, counts = [], [], []
+            for text in texts[20:]:
+                segments = split(text)
+                first, gap = _simulate_playback(segments, overhead, per_unit, audio_per_unit, streaming=streaming)
+                firsts.append(first)
+                gaps.append(gap)
+                counts.append(len(segments))
+            firsts.sort()
+            row = {
+                "first_audio_mean_s": sum(firsts) / len(firsts),
+                "first_audio_p95_s": firsts[int(len(firsts) * 0.95)],
+                "gap_mean_s": sum(gaps) / len(gaps),
+                "segments_mean": sum(counts) / len(counts),
+            }
+            results[f"{server}/{name}"] = row
+            print(f"{server:<10} {name:<6} {row['first_audio_mean_s']:>10.3f} {row['first_audio_p95_s']:>10.3f} "
+                  f"{row['gap_mean_s']:>10.3f} {row['segments_mean']:>8.1f}")
+
+    return results
+
+
+def bench_orchestration(turns=200, sessions=16):
+    """对话编排开销：零延迟的确定性模拟模型下，每轮在参数校验/工具执行、日志与语音派发上的耗时"""
+    import asyncio
+    import contextlib
+    import os
+    import tempfile
+
+    import audio_cache
+    from llm_backend import ScriptedBackend
+    from main_ollama import ConversationSession, UniversalLLMLogger, build_system_message, build_tool_router
+    from mock_tts_server import MockTTSServer
+    from tool_manager import ToolManager
+    from tts_async import close_async_tts_client
+    from tts_client import configure_tts_client
+    from voice_registry import get_voice_registry
+
+    tm = ToolManager()
+    tools = tm.get_tools()
+    voices = get_voice_registry()
+    voices.refresh()
+    system_message = build_system_message(voices)
+
+    music_call = [{"name": "list_available_music", "arguments": {}}]
+    # 路由器按输入挑选工具，输入需与脚本中的工具相关；每轮文本不同，语音不命中缓存
+    scenarios = [
+        ("仅回复", [], False, "local", "第{i}句：今天过得怎么样"),
+        ("工具调用", music_call, False, "local", "第{i}次：看看有哪些音乐"),
+        ("工具调用+日志", music_call, True, "local", "第{i}次：看看有哪些音乐"),
+    ]
+    if voices.names():
+        character = voices.names()[0]
+        speech_call = [{"name": "advanced_character_tts", "arguments": {"text": "{user}", "character": character}}]
+        scenarios.append(("语音派发+日志", speech_call, True, "events", f"第{{i}}句：{character}说句话"))
+
+    async def run_session(tool_calls, log_dir, speech, template, count, label):
+        backend = ScriptedBackend(first_token_delay=0, token_delay=0, tool_calls=tool_calls, chunk_chars=4)
+        logger = UniversalLLMLogger(log_dir, session_id=f"session_bench_{label}") if log_dir else None
+        session = ConversationSession(system_message, tools, tool_manager=tm, logger=logger, client=backend,
+                                      router=build_tool_router(tools, voices), speech=speech)
+        latencies = []
+        for i in range(count):
+            start = time.perf_counter()
+            await session.turn(template.format(i=i))
+            await session.wait_speech()
+            latencies.append(time.perf_counter() - start)
+        await session.close()
+        return latencies, backend.tool_calls_emitted
+
+    async def run_all(log_dir):
+        # 预热：工具索引、线程池、路由器等的首次开销不计入
+        await run_session(music_call, log_dir, "local", "第{i}次：看看有哪些音乐", 20, "warmup")
+        rows = []
+        for index, (name, tool_calls, logging, speech, template) in enumerate(scenarios):
+            latencies, emitted = await run_session(tool_calls, log_dir if logging else None, speech, template,
+                                                   turns, index)
+            rows.append((name, latencies, emitted))
+
+        # 多会话并发：工具调用+日志
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(music_call, log_dir, "local", "第{i}次：看看有哪些音乐",
+                                           max(1, turns // sessions), f"concurrent_{n}")
+                               for n in range(sessions)))
+        elapsed = time.perf_counter() - start
+        await close_async_tts_client()
+        return rows, elapsed
+
+    stub = MockTTSServer(base_latency=0.0, stream=True).start()
+    configure_tts_client(url=stub.url)
+    # 只用内存缓存，不写入 cache/tts/
+    previous_cache, audio_cache._cache = audio_cache._cache, audio_cache.AudioCache(cache_dir=None)
+    try:
+        with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, "w") as devnull:
+            # 工具与日志的控制台输出计入耗时，但不显示
+            with contextlib.redirect_stdout(devnull):
+                rows, concurrent_s = asyncio.run(run_all(log_dir))
+    finally:
+        audio_cache._cache = previous_cache
+        stub.stop()
+
+    results = {}
+    print(f"=== 对话编排开销: 每场景 {turns} 轮（模拟模型零延迟，模拟TTS零延迟） ===")
+    print(f"{'场景':<12} {'均值(ms)':>9} {'p95(ms)':>9} {'较上行(ms)':>10} {'工具调用':>8}")
+    previous = None
+    for name, latencies, emitted in rows:
+        latencies.sort()
+        mean_ms = sum(latencies) / len(latencies) * 1000
+        p95_ms = latencies[int(len(latencies) * 0.95)] * 1000
+        delta = f"{mean_ms - previous:+.3f}" if previous is not None else "-"
+        print(f"{name:<12} {mean_ms:>9.3f} {p95_ms:>9.3f} {delta:>10} {emitted:>8}")
+        results[name] = {"mean_ms": mean_ms, "p95_ms": p95_ms, "tool_calls": emitted}
+        previous = mean_ms
+
+    concurrent_turns = sessions * max(1, turns // sessions)
+    print(f"{sessions} 个会话并发（工具调用+日志）: {concurrent_turns} 轮 {concurrent_s:.2f}s, "
+          f"{concurrent_turns / concurrent_s:.0f} 轮/s")
+    results["concurrent_turns_per_s"] = concurrent_turns / concurrent_s
+    return results
+
+
+BENCHMARKS = {
+    "validate": bench_validate_params,
+    "music": bench_music_match,
+    "segment": bench_segmentation,
+    "orchestration": bench_orchestration,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地微基准测试")
+    parser.add_argument("names", nargs="*", help=f"要运行的基准（默认全部）: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知基准: {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
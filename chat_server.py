@@ -0,0 +1,636 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import signal
+import struct
+import time
+import uuid
+from datetime import datetime
+from http import HTTPStatus
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from main_ollama import (LLM_BACKEND, LLM_BASE_URL, MODEL_NAME, WARM_UP_VOICES, ConversationSession,
+                         UniversalLLMLogger, build_system_message, build_tool_router)
+from llm_backend import BACKENDS, create_backend
+from mock_tts_server import add_server_arguments, server_from_args
+from tool_manager import ToolManager
+from tts_async import close_async_tts_client
+from tts_client import configure_tts_client
+from voice_registry import get_voice_registry
+
+
+MAX_BODY_BYTES = 1024 * 1024
+HEADER_TIMEOUT = 30.0  # 读取请求头的超时（秒）
+CLOSE_TIMEOUT = 2.0  # 发出关闭帧后等待对方回应的时间（秒），超时直接断开连接
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_SESSION_PATH_RE = re.compile(r'^/sessions/([\w-]+)(/messages|/cancel)?/?$')
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or HTTPStatus(status).phrase
+
+
+async def read_request(reader: asyncio.StreamReader):
+    """读取一个HTTP请求，返回 (方法, 路径, 头部, 请求体)，连接已关闭时返回None"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "请求行格式错误")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Content-Length 无效")
+    if length < 0:
+        raise HttpError(400, "Content-Length 无效")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), urlsplit(target).path, headers, body
+
+
+def _response_head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data: dict):
+    body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+    writer.write(_response_head(status, {
+        "Content-Type": "application/json; charset=utf-8",
+        "Content-Length": len(body),
+        "Connection": "close",
+    }) + body)
+    await writer.drain()
+
+
+class ChunkedResponse:
+    """分块传输的流式响应（NDJSON 事件流）"""
+
+    def __init__(self, writer: asyncio.StreamWriter, content_type: str = "application/x-ndjson"):
+        self.writer = writer
+        writer.write(_response_head(200, {
+            "Content-Type": content_type,
+            "Transfer-Encoding": "chunked",
+            "Cache-Control": "no-cache",
+            "Connection": "close",
+        }))
+
+    async def write(self, data: bytes):
+        if data:
+            self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    if not payload:
+        return payload
+    key = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(len(payload), "big")
+
+
+class WebSocket:
+    """服务端 WebSocket（RFC 6455，握手之后的帧收发）"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self._abort_handle = None
+
+    @staticmethod
+    def accept_key(key: str) -> str:
+        return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("latin-1")).digest()).decode("latin-1")
+
+    async def _send_frame(self, opcode: int, payload: bytes):
+        if self.closed:
+            raise ConnectionError("WebSocket已关闭")
+        length = len(payload)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        # 每帧一次写入，多个协程交替发送时帧不会交错
+        self.writer.write(head + payload)
+        await self.writer.drain()
+
+    async def send_text(self, text: str):
+        await self._send_frame(0x1, text.encode("utf-8"))
+
+    async def send_bytes(self, data: bytes):
+        await self._send_frame(0x2, data)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self._send_frame(0x8, struct.pack("!H", code) + reason.encode("utf-8")[:120]),
+                                   CLOSE_TIMEOUT)
+        except (ConnectionError, RuntimeError, asyncio.TimeoutError):
+            pass
+        self.closed = True
+        # 对方不回应关闭帧时到时断开连接，阻塞在 recv() 的处理协程随之返回
+        self._abort_handle = asyncio.get_running_loop().call_later(CLOSE_TIMEOUT, self.abort)
+
+    def abort(self):
+        """断开底层连接（不再等待关闭握手）"""
+        if self._abort_handle is not None:
+            self._abort_handle.cancel()
+        if not self.writer.is_closing():
+            self.writer.close()
+
+    async def recv(self):
+        """接收一条完整消息（文本返回str，二进制返回bytes），连接关闭时返回None"""
+        message = bytearray()
+        message_opcode = None
+        while True:
+            try:
+                first, second = await self.reader.readexactly(2)
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+                if length + len(message) > MAX_BODY_BYTES:
+                    await self.close(1009, "message too big")
+                    return None
+                mask = await self.reader.readexactly(4) if second & 0x80 else None
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.closed = True
+                return None
+            if mask:
+                payload = _unmask(payload, mask)
+
+            opcode = first & 0x0F
+            if opcode == 0x8:  # 关闭
+                await self.close()
+                return None
+            if opcode == 0x9:  # ping
+                await self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:  # pong
+                continue
+            if opcode in (0x1, 0x2):
+                message_opcode = opcode
+                message = bytearray(payload)
+            else:  # 分片的后续帧
+                message.extend(payload)
+            if first & 0x80:
+                return message.decode("utf-8") if message_opcode == 0x1 else bytes(message)
+
+
+def _event_payload(event: dict, inline_audio: bool) -> dict:
+    """事件转为可JSON序列化的形式（音频内联为base64或只给出长度）"""
+    if event["type"] != "audio":
+        return event
+    payload = {key: value for key, value in event.items() if key != "data"}
+    if inline_audio:
+        payload["data"] = base64.b64encode(event["data"]).decode("ascii")
+    else:
+        payload["bytes"] = len(event["data"])
+    return payload
+
+
+class _ServedSession:
+    """服务端持有的一个会话：对话状态、日志与当前的事件接收方"""
+
+    def __init__(self, session_id: str, logger: UniversalLLMLogger):
+        self.id = session_id
+        self.logger = logger
+        self.session: Optional[ConversationSession] = None
+        self.listener = None  # 当前接收事件的连接（HTTP响应或WebSocket）
+        self.websocket: Optional[WebSocket] = None
+        self.busy = False
+        self.last_active = time.monotonic()
+
+    async def on_event(self, event: dict):
+        if self.listener is not None:
+            await self.listener(event)
+
+
+class ChatServer:
+    """多会话对话服务（HTTP + WebSocket，基于 asyncio，无第三方Web框架）
+
+    HTTP：
+      GET    /health                   状态与会话数
+      POST   /sessions                 创建会话 → {"session_id"}
+      POST   /sessions/{id}/messages   {"text"} → NDJSON 事件流（分块传输，音频为base64，说完才结束）
+      POST   /sessions/{id}/cancel     取消进行中的回复
+      DELETE /sessions/{id}            结束会话
+    WebSocket /ws：每个连接一个会话。客户端发送 {"type": "message", "text"} 或 {"type": "cancel"}；
+      服务端发送 JSON 事件（见 ConversationSession），audio 事件之后紧跟一个二进制帧（WAV）。
+
+    每个会话有独立的 UniversalLLMLogger；会话数达到上限或正在关闭时拒绝新会话（503）。
+    drain() 停止接收新会话与新消息，等进行中的回复结束后关闭全部会话并落盘日志。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, max_sessions: int = 32,
+                 idle_timeout: float = 600.0, log_dir: Optional[str] = "./Log", client=None, model: str = MODEL_NAME,
+                 stream: bool = True):
+        """
+        Args:
+            host / port: 监听地址（port=0 时自动分配）
+            max_sessions: 同时存在的会话数上限
+            idle_timeout: HTTP会话空闲多久（秒）后自动关闭
+            log_dir: 会话日志目录，None表示不写日志
+            client: 模型后端（见 llm_backend，各会话共享），默认按 LLM_BACKEND 创建
+            model: 模型名
+            stream: 流式调用模型
+        """
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.log_dir = log_dir
+        self.client = client or create_backend(LLM_BACKEND, LLM_BASE_URL)
+        self.model = model
+        self.stream = stream
+
+        self.sessions: Dict[str, _ServedSession] = {}
+        self.draining = False
+        self.sessions_created = 0
+        self.sessions_rejected = 0
+        self._server = None
+        self._reaper = None
+        self._active_turns = 0
+        self._turns_idle = asyncio.Event()
+        self._turns_idle.set()
+        self._connections = set()  # 正在处理的连接（协程任务）
+
+        self.tm = None
+        self.tools = None
+        self.voices = None
+        self.system_message = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """加载工具与音色表并开始监听"""
+        self.tm = ToolManager()
+        self.tools = self.tm.get_tools()
+        self.voices = get_voice_registry()
+        self.voices.refresh()
+        self.system_message = build_system_message(self.voices)
+
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.ensure_future(self._reap_idle())
+        return self
+
+    # 会话管理
+
+    def create_session(self) -> _ServedSession:
+        if self.draining:
+            self.sessions_rejected += 1
+            raise HttpError(503, "服务正在关闭")
+        if len(self.sessions) >= self.max_sessions:
+            self.sessions_rejected += 1
+            raise HttpError(503, "会话数已达上限")
+
+        session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        logger = UniversalLLMLogger(self.log_dir, session_id=session_id)
+        entry = _ServedSession(session_id, logger)
+        entry.session = ConversationSession(
+            self.system_message, self.tools, tool_manager=self.tm, logger=logger, client=self.client,
+            model=self.model, stream=self.stream, router=build_tool_router(self.tools, self.voices), speech="events",
+            on_event=entry.on_event)
+        self.sessions[session_id] = entry
+        self.sessions_created += 1
+        return entry
+
+    def get_session(self, session_id: str) -> _ServedSession:
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            raise HttpError(404, "会话不存在")
+        return entry
+
+    async def close_session(self, entry: _ServedSession):
+        """结束会话并落盘日志（可重复调用）"""
+        if self.sessions.pop(entry.id, None) is None:
+            return
+        entry.session.cancel()
+        await entry.session.close()
+        if entry.websocket is not None:
+            await entry.websocket.close(1001, "session closed")
+
+    async def run_turn(self, entry: _ServedSession, text: str, listener=None, wait_speech: bool = True) -> dict:
+        """在会话上进行一轮对话（同一会话同时只处理一条消息）"""
+        if self.draining:
+            raise HttpError(503, "服务正在关闭")
+        if entry.busy:
+            raise HttpError(409, "会话正在处理上一条消息")
+
+        entry.busy = True
+        self._active_turns += 1
+        self._turns_idle.clear()
+        previous_listener = entry.listener
+        if listener is not None:
+            entry.listener = listener
+        try:
+            result = await entry.session.turn(text)
+            if wait_speech:
+                await entry.session.wait_speech()
+            return result
+        finally:
+            entry.listener = previous_listener
+            entry.busy = False
+            entry.last_active = time.monotonic()
+            self._active_turns -= 1
+            if self._active_turns == 0:
+                self._turns_idle.set()
+
+    async def _reap_idle(self):
+        """定期关闭空闲过久的HTTP会话（WebSocket会话随连接结束）"""
+        interval = max(1.0, min(30.0, self.idle_timeout / 4))
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for entry in list(self.sessions.values()):
+                if entry.websocket is None and not entry.busy and now - entry.last_active > self.idle_timeout:
+                    await self.close_session(entry)
+
+    async def drain(self, timeout: float = 30.0):
+        """优雅关闭：拒绝新会话与新消息，等进行中的回复结束（超时则取消），关闭全部会话"""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._turns_idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self._active_turns} 个回复未在 {timeout:.0f}s 内结束，已取消")
+        await asyncio.gather(*(self.close_session(entry) for entry in list(self.sessions.values())),
+                             return_exceptions=True)
+        # 等连接处理结束：WebSocket 客户端不回应关闭帧时由 close() 到时断开
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=CLOSE_TIMEOUT * 2)
+
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.client.aclose()
+        await close_async_tts_client()
+
+    def stats(self) -> dict:
+        return {
+            "status": "draining" if self.draining else "ok",
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "active_turns": self._active_turns,
+            "sessions_created": self.sessions_created,
+            "sessions_rejected": self.sessions_rejected,
+        }
+
+    # 连接处理
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            request = await asyncio.wait_for(read_request(reader), HEADER_TIMEOUT)
+            if request is None:
+                return
+            method, path, headers, body = request
+            if path == "/ws":
+                if headers.get("upgrade", "").lower() != "websocket":
+                    raise HttpError(426, "需要 WebSocket 升级")
+                await self._handle_websocket(reader, writer, headers)
+            else:
+                await self._route(method, path, body, writer)
+        except HttpError as e:
+            try:
+                await send_json(writer, e.status, {"error": e.message})
+            except ConnectionError:
+                pass
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"❌ 请求处理异常: {e}")
+            try:
+                await send_json(writer, 500, {"error": str(e)[:200]})
+            except Exception:
+                pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if path == "/health" and method == "GET":
+            await send_json(writer, 200, self.stats())
+            return
+        if path in ("/sessions", "/sessions/") and method == "POST":
+            entry = self.create_session()
+            await send_json(writer, 201, {"session_id": entry.id})
+            return
+
+        match = _SESSION_PATH_RE.match(path)
+        if not match:
+            raise HttpError(404)
+        entry = self.get_session(match.group(1))
+        action = match.group(2)
+
+        if action is None and method == "DELETE":
+            await self.close_session(entry)
+            await send_json(writer, 200, {"session_id": entry.id, "closed": True})
+        elif action == "/cancel" and method == "POST":
+            await send_json(writer, 200, {"session_id": entry.id, "cancelled": entry.session.cancel()})
+        elif action == "/messages" and method == "POST":
+            await self._handle_message(entry, body, writer)
+        else:
+            raise HttpError(405)
+
+    async def _handle_message(self, entry: _ServedSession, body: bytes, writer: asyncio.StreamWriter):
+        try:
+            text = (json.loads(body or b"{}").get("text") or "").strip()
+        except (ValueError, AttributeError):
+            raise HttpError(400, "请求体应为 JSON：{\"text\": ...}")
+        if not text:
+            raise HttpError(400, "text 不能为空")
+        if self.draining:
+            raise HttpError(503, "服务正在关闭")
+        if entry.busy:
+            raise HttpError(409, "会话正在处理上一条消息")
+
+        response = ChunkedResponse(writer)
+        disconnected = False
+
+        async def listener(event):
+            nonlocal disconnected
+            if disconnected:
+                return
+            line = json.dumps(_event_payload(event, inline_audio=True), ensure_ascii=False, default=str) + "\n"
+            try:
+                await response.write(line.encode("utf-8"))
+            except ConnectionError:
+                # 客户端断开：取消本轮，不再发送
+                disconnected = True
+                entry.session.cancel()
+
+        try:
+            await self.run_turn(entry, text, listener=listener, wait_speech=True)
+        except HttpError as e:
+            await listener({"type": "error", "status": e.status, "message": e.message})
+        except Exception as e:
+            await listener({"type": "error", "status": 500, "message": f"LLM调用失败: {str(e)[:200]}"})
+        if not disconnected:
+            await response.end()
+
+    async def _handle_websocket(self, reader, writer, headers: dict):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise HttpError(400, "缺少 Sec-WebSocket-Key")
+        entry = self.create_session()  # 超出上限时在握手前返回503
+
+        writer.write(_response_head(101, {
+            "Upgrade": "websocket",
+            "Connection": "Upgrade",
+            "Sec-WebSocket-Accept": WebSocket.accept_key(key),
+        }))
+        await writer.drain()
+        ws = WebSocket(reader, writer)
+        entry.websocket = ws
+
+        async def listener(event):
+            if ws.closed:
+                return
+            try:
+                await ws.send_text(json.dumps(_event_payload(event, inline_audio=False), ensure_ascii=False,
+                                              default=str))
+                if event["type"] == "audio":
+                    await ws.send_bytes(event["data"])
+            except ConnectionError:
+                entry.session.cancel()
+
+        async def ws_turn(text):
+            try:
+                # 语音在后台继续合成，期间可以发下一条消息
+                await self.run_turn(entry, text, wait_speech=False)
+            except HttpError as e:
+                await listener({"type": "error", "status": e.status, "message": e.message})
+            except Exception as e:
+                await listener({"type": "error", "status": 500, "message": f"LLM调用失败: {str(e)[:200]}"})
+
+        entry.listener = listener
+        turn_task = None
+        try:
+            await listener({"type": "session", "session_id": entry.id})
+            while True:
+                message = await ws.recv()
+                if message is None:
+                    break
+                try:
+                    data = json.loads(message)
+                except (ValueError, TypeError):
+                    data = None
+                if not isinstance(data, dict):
+                    await listener({"type": "error", "status": 400, "message": "消息应为 JSON 对象"})
+                    continue
+                text = data.get("text")
+                text = text.strip() if isinstance(text, str) else ""
+                if data.get("type") == "cancel":
+                    entry.session.cancel()
+                elif data.get("type") == "message" and text:
+                    if turn_task is not None and not turn_task.done():
+                        await listener({"type": "error", "status": 409, "message": "会话正在处理上一条消息"})
+                        continue
+                    turn_task = asyncio.ensure_future(ws_turn(text))
+                else:
+                    await listener({"type": "error", "status": 400, "message": "未知消息类型"})
+        finally:
+            if turn_task is not None and not turn_task.done():
+                entry.session.cancel()
+                await asyncio.gather(turn_task, return_exceptions=True)
+            await self.close_session(entry)
+            await ws.close()
+
+
+async def serve(args):
+    stub_tts = None
+    if args.stub_tts:
+        stub_tts = server_from_args(args, prefix="tts-").start()
+        configure_tts_client(url=stub_tts.url)
+        print(f"🔈 模拟TTS服务: {stub_tts.url}")
+
+    client = create_backend("stub" if args.stub_llm else args.backend, args.base_url)
+    server = ChatServer(args.host, args.port, max_sessions=args.max_sessions, idle_timeout=args.idle_timeout,
+                        log_dir=None if args.log_dir == "none" else args.log_dir, client=client, model=args.model)
+    await server.start()
+    if WARM_UP_VOICES and not args.stub_tts and server.voices.names():
+        server.voices.warm_up()
+    print(f"🌐 对话服务已启动: {server.url} (WebSocket: ws://{server.host}:{server.port}/ws, "
+          f"最多 {server.max_sessions} 个会话)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        print(f"\n⏳ 正在关闭（等待进行中的回复，最多 {args.drain_timeout:.0f}s）...")
+        await server.drain(args.drain_timeout)
+        if stub_tts is not None:
+            stub_tts.stop()
+        print(f"👋 已关闭，共服务 {server.sessions_created} 个会话")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多会话对话服务（HTTP/WebSocket）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-sessions", type=int, default=32, help="同时存在的会话数上限")
+    parser.add_argument("--idle-timeout", type=float, default=600.0, help="HTTP会话空闲多久后关闭（秒）")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="关闭时等待进行中回复的最长时间（秒）")
+    parser.add_argument("--log-dir", default="./Log", help="会话日志目录，none 表示不写日志")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=LLM_BACKEND, help="模型后端")
+    parser.add_argument("--base-url", default=LLM_BASE_URL, help="模型后端地址（默认见 llm_backend）")
+    parser.add_argument("--model", default=MODEL_NAME, help="模型名")
+    parser.add_argument("--stub-llm", action="store_true", help="使用确定性的模拟模型（同 --backend stub）")
+    parser.add_argument("--stub-tts", action="store_true", help="在进程内启动模拟TTS服务")
+    add_server_arguments(parser.add_argument_group("模拟TTS服务（--stub-tts）"), prefix="tts-")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import json
+import re
+from typing import Callable, List, Optional
+
+
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿぀-ヿ가-힯　-〿＀-￯]')
+# 每条消息的角色标记等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符（含全角标点）每字约1个，其余约4个字符1个
+
+    只用于预算控制，无需与模型分词器完全一致。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    """单条消息的token估算（内容 + 工具调用参数 + 固定开销）"""
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+    for call in message.get("tool_calls") or []:
+        function = call.get("function", {}) if isinstance(call, dict) else getattr(call, "function", None)
+        if isinstance(function, dict):
+            name, arguments = function.get("name", ""), function.get("arguments", {})
+        else:
+            name, arguments = getattr(function, "name", ""), getattr(function, "arguments", {})
+        tokens += estimate_tokens(name) + estimate_tokens(json.dumps(arguments, ensure_ascii=False, default=str))
+    return tokens
+
+
+def _call_summary(call) -> str:
+    """工具调用的简短描述：语音工具保留台词开头，其余只保留工具名"""
+    function = call.get("function", {}) if isinstance(call, dict) else getattr(call, "function", None)
+    if isinstance(function, dict):
+        name, arguments = function.get("name", "unknown"), function.get("arguments") or {}
+    else:
+        name, arguments = getattr(function, "name", "unknown"), getattr(function, "arguments", None) or {}
+    if isinstance(arguments, dict) and arguments.get("text"):
+        speaker = arguments.get("character", "")
+        return f"{name}({speaker}: {_clip(str(arguments['text']), 40)})"
+    return name
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def extractive_summary(previous: str, turns: List[List[dict]]) -> str:
+    """默认摘要：每轮一行（用户输入、助手回复与工具调用的开头），追加到已有摘要后
+
+    不调用模型，零延迟且结果确定；过长时由 ContextWindow 按行裁掉最早的内容。
+    """
+    lines = [previous] if previous else []
+    for turn in turns:
+        parts = []
+        for message in turn:
+            role = message.get("role")
+            if role == "user":
+                parts.append(f"用户: {_clip(message.get('content') or '', 40)}")
+            elif role == "assistant":
+                if message.get("content"):
+                    parts.append(f"助手: {_clip(message['content'], 60)}")
+                calls = [_call_summary(call) for call in message.get("tool_calls") or []]
+                if calls:
+                    parts.append("调用 " + ", ".join(calls))
+        if parts:
+            lines.append("- " + "；".join(parts))
+    return "\n".join(lines)
+
+
+def make_llm_summarizer(model: str, max_chars: int = 400) -> Callable[[str, List[List[dict]]], str]:
+    """用本地模型生成滚动摘要（每次折叠多一次模型调用，适合长会话）"""
+    import ollama
+
+    def summarize(previous: str, turns: List[List[dict]]) -> str:
+        transcript = extractive_summary("", turns)
+        prompt = (f"已有摘要：\n{previous or '（无）'}\n\n新增对话：\n{transcript}\n\n"
+                  f"请把以上内容合并成不超过{max_chars}字的对话摘要，保留用户偏好、已做的事和未完成的请求。/no_think")
+        try:
+            response = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
+            text = (response.get("message") or {}).get("content", "").strip()
+            text = re.sub(r"<think>.*?</think>", "", text, flags=re.S).strip()
+            if text:
+                return text
+        except Exception as e:
+            print(f"⚠️ 摘要生成失败，改用摘录: {e}")
+        return extractive_summary(previous, turns)
+
+    return summarize
+
+
+class ContextWindow:
+    """对话上下文窗口：固定系统提示词 + 滚动摘要 + 最近若干轮
+
+    - 系统提示词始终位于首位，不参与裁剪
+    - 超出 token 预算时压缩：先裁掉最近 keep_tool_turns 轮之前的工具执行结果
+      （更早的结果对后续决策几乎无用），仍超出则把最早的轮次折叠进摘要；
+      一次压缩到 low_water 比例以下
+    两次压缩之间消息列表只追加、不改动已发送的部分，模型端可以复用前缀缓存；
+    每轮送入模型的消息量有上限，不随会话长度增长。
+    """
+
+    def __init__(self, system_message: dict, budget_tokens: int = 3000, low_water: float = 0.7,
+                 min_recent_turns: int = 2, keep_tool_turns: int = 1, summary_tokens: int = 600,
+                 summarizer: Optional[Callable[[str, List[List[dict]]], str]] = None):
+        """
+        Args:
+            system_message: 固定的系统提示词消息
+            budget_tokens: 送入模型的消息总 token 预算（含系统提示词与摘要）
+            low_water: 超预算时折叠到预算的该比例以下
+            min_recent_turns: 至少保留的最近轮数（即使超预算）
+            keep_tool_turns: 压缩时保留工具结果的最近轮数
+            summary_tokens: 摘要的 token 上限
+            summarizer: (已有摘要, 待折叠轮次) -> 新摘要，默认为摘录式摘要
+        """
+        self.system_message = system_message
+        self.budget_tokens = budget_tokens
+        self.low_water = low_water
+        self.min_recent_turns = min_recent_turns
+        self.keep_tool_turns = keep_tool_turns
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer or extractive_summary
+
+        self.turns: List[List[dict]] = []
+        self.summary = ""
+        self.folded_turns = 0
+        self.pruned_tool_messages = 0
+        self.last_prompt_tokens = 0
+
+    def add_user(self, content: str):
+        """开始新的一轮"""
+        self.turns.append([{"role": "user", "content": content}])
+
+    def add(self, message: dict):
+        """向当前轮追加消息（助手回复、工具结果）"""
+        if not self.turns:
+            self.turns.append([])
+        self.turns[-1].append(message)
+
+    @staticmethod
+    def _is_tool_result(message: dict) -> bool:
+        # 轮内的 tool 消息与注入的 system 消息都是工具执行结果
+        return message.get("role") in ("tool", "system")
+
+    def _summary_message(self) -> Optional[dict]:
+        if not self.summary:
+            return None
+        return {"role": "system", "content": "此前对话摘要：\n" + self.summary}
+
+    def _total_tokens(self) -> int:
+        tokens = message_tokens(self.system_message)
+        summary = self._summary_message()
+        if summary:
+            tokens += message_tokens(summary)
+        for turn in self.turns:
+            tokens += sum(message_tokens(m) for m in turn)
+        return tokens
+
+    def _trim_summary(self):
+        """摘要超限时按行丢弃最早的内容"""
+        lines = self.summary.split("\n")
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+
+    def _compact(self):
+        """超预算时压缩：裁剪较早轮次的工具结果，再把最早的轮次折叠进摘要"""
+        if self._total_tokens() <= self.budget_tokens:
+            return
+        target = self.budget_tokens * self.low_water
+
+        for i in range(max(0, len(self.turns) - self.keep_tool_turns)):
+            kept = [message for message in self.turns[i] if not self._is_tool_result(message)]
+            self.pruned_tool_messages += len(self.turns[i]) - len(kept)
+            self.turns[i] = kept
+
+        folded = []
+        while len(self.turns) > self.min_recent_turns and self._total_tokens() > target:
+            folded.append(self.turns.pop(0))
+        if not folded:
+            return
+        self.summary = self.summarizer(self.summary, folded)
+        self._trim_summary()
+        self.folded_turns += len(folded)
+        print(f"🗜️ 上下文已压缩: {len(folded)} 轮对话并入摘要")
+
+    def messages(self) -> List[dict]:
+        """本轮送入模型的消息列表"""
+        self._compact()
+        messages = [self.system_message]
+        summary = self._summary_message()
+        if summary:
+            messages.append(summary)
+        for turn in self.turns:
+            messages.extend(turn)
+        self.last_prompt_tokens = sum(message_tokens(m) for m in messages)
+        return messages
+
+    def stats(self) -> dict:
+        return {
+            "turns_in_window": len(self.turns),
+            "folded_turns": self.folded_turns,
+            "pruned_tool_messages": self.pruned_tool_messages,
+            "summary_tokens": estimate_tokens(self.summary),
+            "prompt_tokens": self.last_prompt_tokens,
+            "budget_tokens": self.budget_tokens,
+        }
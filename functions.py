@@ -4,27 +4,19 @@ from typing import Any
 
 def list_available_music() -> str:
     """查看音乐目录"""
-    import os
-    import glob
+    from music_library import get_music_library
 
-    music_dir = "./musics"
-    if not os.path.exists(music_dir):
+    # 共享索引：目录未变化时不重新扫描
+    library = get_music_library()
+    filenames = library.filenames()
+    if not filenames:
         return ""
 
-    all_files = []
-    for ext in ['mp3', 'wav', 'flac', 'aac', 'ogg', 'm4a', 'mp4', 'wma']:
-        all_files.extend(glob.glob(os.path.join(music_dir, f"*.{ext}")))
-        all_files.extend(glob.glob(os.path.join(music_dir, f"*.{ext.upper()}")))
-
-    if not all_files:
-        return ""
-
-    filenames = [os.path.basename(f) for f in sorted(set(all_files))]
     print(f"找到 {len(filenames)} 首音乐:")
     for i, name in enumerate(filenames, 1):
         print(f"{i}. {name}")
 
-    return ",".join([os.path.splitext(f)[0] for f in filenames])
+    return ",".join(library.names())
 
 
 
@@ -34,9 +26,8 @@ def list_available_music() -> str:
 def stop_current_music() -> str:
     """停止pygame音乐播放"""
     try:
-        import pygame
-        if pygame.mixer.get_init():
-            pygame.mixer.music.stop()
+        from audio_service import get_audio_service
+        if get_audio_service().stop_music():
             return "已停止"
         return "无播放中音乐"
     except ImportError:
@@ -47,84 +38,35 @@ def stop_current_music() -> str:
 def play_specific_music(music_name: str) -> str:
     """修复时序问题的pygame播放"""
     import os
-    import glob
-    import difflib
-    import threading
-    import time
+    from music_library import get_music_library
 
-    music_dir = "./musics"
-    if not os.path.exists(music_dir):
+    library = get_music_library()
+    if not library.refresh():
         return "目录不存在"
 
-    all_files = []
-    for ext in ['mp3', 'wav', 'ogg']:
-        all_files.extend(glob.glob(os.path.join(music_dir, f"*.{ext}")))
-        all_files.extend(glob.glob(os.path.join(music_dir, f"*.{ext.upper()}")))
-
-    if not all_files:
+    if not library.filenames(playable_only=True):
         return "无音乐文件"
 
-    target_file = None
-    basenames = [os.path.splitext(os.path.basename(f))[0] for f in all_files]
-
-    for i, name in enumerate(basenames):
-        if music_name.lower() in name.lower():
-            target_file = all_files[i]
-            break
-
-    if not target_file:
-        matches = difflib.get_close_matches(music_name, basenames, n=1, cutoff=0.3)
-        if matches:
-            idx = basenames.index(matches[0])
-            target_file = all_files[idx]
-
+    target_file = library.find(music_name, playable_only=True)
     if not target_file:
         return "未找到匹配"
 
     filename = os.path.basename(target_file)
 
-    def play_with_timing_fix():
-        try:
-            import pygame
-
-            # 确保pygame完全重置
-            pygame.mixer.quit()
-            time.sleep(0.1)  # 给系统时间释放音频设备
-
-            # 初始化pygame
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=2048)
-            time.sleep(0.1)  # 给初始化时间
-
-            # 加载和播放
-            pygame.mixer.music.load(target_file)
-            pygame.mixer.music.set_volume(1.0)
-            pygame.mixer.music.play()
-
-            print(f"pygame播放: {filename}")
-
-            # **关键修复：等待播放真正开始**
-            max_wait = 20  # 最多等待2秒
-            wait_count = 0
-            while not pygame.mixer.music.get_busy() and wait_count < max_wait:
-                time.sleep(0.1)
-                wait_count += 1
-
-            if pygame.mixer.music.get_busy():
-                print(f"✅ 播放已开始: {filename}")
-            else:
-                print(f"⚠️ 播放可能未成功启动: {filename}")
-
-        except ImportError:
-            print("pygame未安装")
-        except Exception as e:
-            print(f"播放失败: {e}")
+    try:
+        from audio_service import get_audio_service
 
-    # **关键修复：使用非daemon线程，并立即开始执行**
-    play_thread = threading.Thread(target=play_with_timing_fix, daemon=False)
-    play_thread.start()
+        # 共享混音器只初始化一次，切歌不再重建音频设备，也不会打断正在说话的角色
+        if get_audio_service().play_music(target_file, volume=1.0):
+            print(f"✅ 播放已开始: {filename}")
+        else:
+            print(f"⚠️ 播放可能未成功启动: {filename}")
 
-    # **立即给线程执行时间**
-    time.sleep(0.2)
+    except ImportError:
+        return "pygame未安装"
+    except Exception as e:
+        print(f"播放失败: {e}")
+        return f"播放失败: {str(e)[:50]}"
 
     return f"播放 {filename}"
 
@@ -279,10 +221,12 @@ def pipeline_tts_speak(text: str) -> str:
     """高性能流水线TTS语音合成
 
     特性：
-    - 文本智能分片（按标点符号）
-    - 第一片段零延迟合成（并发数=0）
-    - 其他片段高并发合成（并发数=3）
+    - 自适应分片（首段短、后续几何增长，按实测延迟调整）
+    - 第一片段优先合成（共享调度器中插队）
+    - 其他片段并发合成（共享调度器，全局并发受限）
     - 一边播放一边合成（流水线处理）
+    - 流式接收音频（片段边下载边播放，不必等整段传输完成）
+    - 合成结果按（角色, 文本, 参考音频）缓存，重复的台词直接播放
     - 严格保证播放顺序
 
     Args:
@@ -291,99 +235,86 @@ def pipeline_tts_speak(text: str) -> str:
     Returns:
         str: 执行结果描述
     """
-    import requests
-    import os
-    import tempfile
+    import io
     import threading
     import time
-    import queue
-    import re
-    from concurrent.futures import ThreadPoolExecutor, as_completed
     import pygame
+    from tts_client import get_tts_client
+    from tts_scheduler import get_tts_scheduler
+    from audio_service import get_audio_service
+    from voice_registry import get_voice_registry
+    from tts_stream import (iter_wav_blocks, wav_duration, join_wav_blocks, SegmentSequencer,
+                            open_decoder, audio_complete)
+    from text_segmenter import get_text_segmenter
+    from audio_cache import get_audio_cache
 
     # 全局状态管理
     class TTSPipelineManager:
         def __init__(self):
             self.segments = []
-            self.audio_queue = queue.Queue()  # 音频文件队列
-            self.synthesis_status = {}  # 合成状态跟踪
+            self.futures = []  # 已提交到调度器的合成任务
+            self.stream = None  # 顺序无缝播放的声音流
+            self.sequencer = None  # 按片段顺序把音频块送入声音流
             self.playing = False
-            self.stop_flag = False
-            self.temp_files = []  # 临时文件列表
 
         def cleanup(self):
-            """清理所有临时文件"""
-            for temp_file in self.temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.unlink(temp_file)
-                except:
-                    pass
+            """取消未开始的合成并停止播放"""
+            for future in self.futures:
+                future.cancel()
+            if self.stream is not None:
+                self.stream.stop()
 
     manager = TTSPipelineManager()
 
-    def segment_text(text: str) -> list:
-        """智能文本分片"""
-        # 中英文标点符号分割
-        separators = r'[。！？；：,.!?;:]'
-        segments = re.split(f'({separators})', text)
-
-        # 重新组合（保留标点）
-        result = []
-        current_segment = ""
-
-        for i, part in enumerate(segments):
-            if part.strip():
-                current_segment += part
-                # 如果是标点符号或者到达合理长度
-                if re.match(separators, part) or len(current_segment) > 100:
-                    if current_segment.strip():
-                        result.append(current_segment.strip())
-                        current_segment = ""
-
-        # 处理最后一段
-        if current_segment.strip():
-            result.append(current_segment.strip())
-
-        # 如果分片太短，合并相邻片段
-        final_result = []
-        temp_segment = ""
-
-        for segment in result:
-            temp_segment += segment
-            if len(temp_segment) >= 30 or segment == result[-1]:
-                final_result.append(temp_segment)
-                temp_segment = ""
-
-        return final_result if final_result else [text]
+    # 流水线固定使用纳西妲音色
+    voice = get_voice_registry().resolve("纳西妲")
+    voice_path = voice.path if voice else "./wavs/纳西妲.wav"
+    voice_name = voice.name if voice else "纳西妲"
+    voice_hash = voice.content_hash if voice else ""
 
     def synthesize_audio(segment_text: str, segment_id: int, priority: int = 1) -> dict:
-        """合成单个音频片段"""
+        """流式合成单个音频片段：边下载边把音频块交给排序器"""
         try:
-            url = "http://127.0.0.1:11996/tts_url"
-            data = {
-                "text": segment_text,
-                "audio_paths": ["./wavs/纳西妲.wav"],
-            }
-
             start_time = time.time()
-            response = requests.post(url, json=data, timeout=30)
+            response = get_tts_client().post(segment_text, [voice_path], timeout=30, stream=True)
 
             if response.status_code != 200:
+                response.close()
                 return {"success": False, "error": f"HTTP {response.status_code}"}
 
-            # 保存到临时文件
-            with tempfile.NamedTemporaryFile(suffix=f'_seg_{segment_id}.wav', delete=False) as f:
-                f.write(response.content)
-                temp_file = f.name
-                manager.temp_files.append(temp_file)
+            first_audio_time = None
+            audio_seconds = 0.0
+            blocks = []
+            decoder = open_decoder(response)
+            try:
+                for wav_block in iter_wav_blocks(response, decoder=decoder):
+                    if manager.stream.finished:
+                        # 播放已被停止，不再占用TTS连接
+                        return {"success": False, "error": "播放已停止"}
+                    if first_audio_time is None:
+                        first_audio_time = time.time() - start_time
+                    audio_seconds += wav_duration(wav_block)
+                    blocks.append(wav_block)
+                    manager.sequencer.add_block(segment_id, wav_block)
+            finally:
+                # 解析出错、读取超时或中途停止时都要归还连接，否则连接池名额永久丢失
+                response.close()
 
             synthesis_time = time.time() - start_time
+            audio_bytes = join_wav_blocks(blocks) if blocks else None
+            # 被截断的响应照常播放，但不写入缓存，也不作为分段器的测量
+            complete = audio_complete(decoder, segment_text)
+            if complete:
+                # 实测耗时反馈给分段器，调整后续的首段长度与增长上限
+                get_text_segmenter().observe(segment_text, first_audio_time, synthesis_time, audio_seconds)
+                get_audio_cache().put(voice_name, segment_text, audio_bytes, voice_hash)
 
             return {
                 "success": True,
                 "segment_id": segment_id,
-                "file_path": temp_file,
+                "audio_bytes": audio_bytes,
+                "complete": complete,
+                "first_audio_time": first_audio_time or synthesis_time,
                 "synthesis_time": synthesis_time,
                 "text": segment_text[:30] + "..." if len(segment_text) > 30 else segment_text
             }
@@ -391,170 +322,95 @@ def pipeline_tts_speak(text: str) -> str:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def priority_synthesis_worker():
-        """优先级合成工作线程"""
-        try:
-            segments = manager.segments
-            if not segments:
-                return
-
-            print(f"📄 文本分片完成，共{len(segments)}段")
-
-            # 第一段：零延迟合成（串行处理）
-            print("🎯 开始优先合成首段...")
-            first_result = synthesize_audio(segments[0], 0, priority=0)
-
-            if first_result["success"]:
-                manager.audio_queue.put((0, first_result))
-                print(f"⚡ 首段合成完成: {first_result['synthesis_time']:.2f}s")
+    def on_playback_finished():
+        """最后一段播放结束时由播放计时线程回调"""
+        manager.playing = False
+        print("🏁 播放完成")
+
+    def schedule_synthesis():
+        """将全部片段提交到共享调度器（首段优先），音频块由排序器按顺序送入声音流"""
+        segments = manager.segments
+        if not segments:
+            return
+
+        print(f"📄 文本分片完成，共{len(segments)}段")
+        scheduler = get_tts_scheduler()
+        audio_lock = threading.Lock()
+        manager.sequencer = SegmentSequencer(
+            manager.stream, len(segments),
+            make_sound=lambda wav_bytes: pygame.mixer.Sound(file=io.BytesIO(wav_bytes)),
+            on_played=lambda segment_id: print(f"🔊 开始播放段{segment_id}: {segments[segment_id][:30]}")
+        )
+
+        def on_done(segment_id, future):
+            if future.cancelled():
+                result = {"success": False, "error": "已取消"}
             else:
-                print(f"❌ 首段合成失败: {first_result['error']}")
-                return
-
-            # 其他段：并发合成（并发数=3）
-            if len(segments) > 1:
-                print(f"🚄 开始并发合成剩余{len(segments)-1}段...")
-
-                with ThreadPoolExecutor(max_workers=3) as executor:
-                    # 提交其他段的合成任务
-                    future_to_id = {
-                        executor.submit(synthesize_audio, segments[i], i): i
-                        for i in range(1, len(segments))
-                    }
-
-                    # 收集结果
-                    for future in as_completed(future_to_id):
-                        if manager.stop_flag:
-                            break
-
-                        segment_id = future_to_id[future]
-                        result = future.result()
-
-                        if result["success"]:
-                            manager.audio_queue.put((segment_id, result))
-                            print(f"✅ 段{segment_id}合成完成: {result['synthesis_time']:.2f}s")
-                        else:
-                            print(f"❌ 段{segment_id}合成失败: {result['error']}")
-
-            # 标记合成完成
-            manager.audio_queue.put((999999, {"success": False, "finished": True}))
-
-        except Exception as e:
-            print(f"❌ 合成工作线程异常: {e}")
-
-    def sequential_player():
-        """顺序播放工作线程"""
-        try:
-            # 初始化pygame（修复回车问题）
-            pygame.mixer.quit()
-            time.sleep(0.1)
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=1024)
-            time.sleep(0.1)
-
-            manager.playing = True
-            next_segment_id = 0
-            ready_segments = {}  # 缓存乱序到达的片段
-
-            while manager.playing and not manager.stop_flag:
                 try:
-                    # 获取合成完成的音频（超时3秒）
-                    segment_id, result = manager.audio_queue.get(timeout=3)
-
-                    # 检查是否结束标记
-                    if result.get("finished"):
-                        break
-
-                    if not result["success"]:
-                        continue
-
-                    # 暂存乱序到达的片段
-                    ready_segments[segment_id] = result
-
-                    # 按顺序播放
-                    while next_segment_id in ready_segments:
-                        segment_result = ready_segments.pop(next_segment_id)
-
-                        try:
-                            # 播放音频
-                            pygame.mixer.music.load(segment_result["file_path"])
-                            pygame.mixer.music.set_volume(0.9)
-                            pygame.mixer.music.play()
-
-                            print(f"🔊 播放段{next_segment_id}: {segment_result['text']}")
-
-                            # 等待播放开始
-                            wait_count = 0
-                            while not pygame.mixer.music.get_busy() and wait_count < 10:
-                                time.sleep(0.05)
-                                wait_count += 1
-
-                            # 等待播放完成
-                            while pygame.mixer.music.get_busy() and not manager.stop_flag:
-                                time.sleep(0.1)
-
-                            next_segment_id += 1
-
-                        except Exception as e:
-                            print(f"❌ 播放段{next_segment_id}失败: {e}")
-                            next_segment_id += 1
-                            continue
-
-                except queue.Empty:
-                    # 超时，检查是否还有待播放内容
-                    if not ready_segments and next_segment_id >= len(manager.segments):
-                        break
-                    continue
+                    result = future.result()
                 except Exception as e:
-                    print(f"❌ 播放线程异常: {e}")
-                    break
-
-            manager.playing = False
-            print("🏁 播放完成")
-
-        except Exception as e:
-            print(f"❌ 播放器异常: {e}")
-            manager.playing = False
-
-    def cleanup_worker():
-        """延迟清理工作线程"""
-        time.sleep(5)  # 等待播放完成后再清理
-        while manager.playing:
-            time.sleep(1)
+                    result = {"success": False, "error": str(e)}
 
-        time.sleep(2)  # 额外等待时间
-        manager.cleanup()
-        print("🗑️ 临时文件已清理")
+            if result["success"]:
+                label = "首段" if segment_id == 0 else f"段{segment_id}"
+                print(f"✅ {label}合成完成: 首块{result['first_audio_time']:.2f}s / 全部{result['synthesis_time']:.2f}s")
+            else:
+                print(f"❌ 段{segment_id}合成失败: {result['error']}")
+
+            if result["success"] and result["audio_bytes"] and result["complete"]:
+                remember_segment(segment_id, result["audio_bytes"])
+            # 失败片段也要登记结束，以便顺序推进
+            manager.sequencer.finish(segment_id)
+
+        cache = get_audio_cache()
+        segment_audio = {}
+
+        def remember_segment(segment_id, audio_bytes):
+            """全部片段都有音频时，把整句拼接后也存入缓存（下次整句命中，不受分段变化影响）"""
+            with audio_lock:
+                segment_audio[segment_id] = audio_bytes
+                complete = len(segments) > 1 and len(segment_audio) == len(segments)
+            if complete:
+                whole = join_wav_blocks([segment_audio[i] for i in range(len(segments))])
+                cache.put(voice_name, text, whole, voice_hash)
+
+        for i, segment in enumerate(segments):
+            # 缓存命中的片段直接排播，不占用TTS服务
+            cached = cache.get(voice_name, segment, voice_hash)
+            if cached is not None:
+                print(f"⚡ 段{i}缓存命中")
+                manager.sequencer.add_block(i, cached)
+                manager.sequencer.finish(i)
+                remember_segment(i, cached)
+                continue
+            future = scheduler.submit(synthesize_audio, segment, i, key="pipeline", first=(i == 0))
+            manager.futures.append(future)
+            future.add_done_callback(lambda f, segment_id=i: on_done(segment_id, f))
 
     # 主逻辑
     try:
         if not text.strip():
             return "文本内容为空"
 
-        # 停止当前播放
-        try:
-            pygame.mixer.music.stop()
-        except:
-            pass
+        # 停止上一次的流水线播放（共享混音器，不重建设备、不影响音乐和其他角色）
+        audio = get_audio_service()
+        audio.stop_voice("pipeline")
 
         # 文本分片
-        manager.segments = segment_text(text)
+        # 整句已缓存时不再分段，一次排播
+        if get_audio_cache().contains(voice_name, text, voice_hash):
+            manager.segments = [text]
+        else:
+            manager.segments = get_text_segmenter().segment(text)
         print(f"📝 准备播放: {text[:50]}{'...' if len(text) > 50 else ''}")
         print(f"🔪 分片策略: {len(manager.segments)}段")
 
-        # 启动合成工作线程
-        synthesis_thread = threading.Thread(target=priority_synthesis_worker, daemon=False)
-        synthesis_thread.start()
-
-        # 立即启动播放线程（无需等待）
-        player_thread = threading.Thread(target=sequential_player, daemon=False)
-        player_thread.start()
+        # 播放结束事件驱动完成回调，无需播放/清理线程
+        manager.stream = audio.open_stream("pipeline", volume=0.9, on_finished=on_playback_finished)
+        manager.playing = True
 
-        # 启动清理线程
-        cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-        cleanup_thread.start()
-
-        # 给系统一点启动时间
-        time.sleep(0.1)
+        # 提交合成任务到共享调度器
+        schedule_synthesis()
 
         return f"🚀 流水线TTS启动: {len(manager.segments)}段文本，首段优先合成中..."
 
@@ -565,12 +421,10 @@ def pipeline_tts_speak(text: str) -> str:
 def stop_pipeline_tts() -> str:
     """停止流水线TTS播放和合成"""
     try:
-        import pygame
+        from audio_service import get_audio_service
 
-        # 停止pygame播放
-        if pygame.mixer.get_init():
-            pygame.mixer.music.stop()
-            pygame.mixer.quit()
+        # 只停止流水线语音通道，不关闭混音器
+        if get_audio_service().stop_voice("pipeline"):
             print("🛑 TTS播放已停止")
 
         return "已停止流水线TTS播放"
@@ -588,66 +442,62 @@ def simple_character_tts(text: str, character: str = "纳西妲") -> str:
     Returns:
         str: 执行结果描述
     """
-    import requests
-    import os
-    import tempfile
+    import io
     import threading
     import time
     import pygame
-
-    # 验证角色音频文件
-    audio_path = f"./wavs/{character}.wav"
-    if not os.path.exists(audio_path):
-        # 尝试带方括号的格式
-        alt_path = f"./wavs/[{character}].wav"
-        if os.path.exists(alt_path):
-            audio_path = alt_path
-        else:
-            return f"角色'{character}'的音频文件不存在"
+    from tts_client import get_tts_client
+    from audio_service import get_audio_service
+    from voice_registry import get_voice_registry
+    from tts_stream import iter_wav_blocks, join_wav_blocks, open_decoder, audio_complete
+    from tts_scheduler import get_tts_scheduler
+    from audio_cache import get_audio_cache
+
+    # 角色音色表启动时已扫描校验，这里只是一次字典查找（支持别名）
+    voice = get_voice_registry().resolve(character)
+    if voice is None:
+        return f"角色'{character}'的音频文件不存在"
+    character = voice.name
+    audio_path = voice.path
+
+    cache = get_audio_cache()
+
+    def synthesize_and_play():
+        # 调用TTS服务（流式接收）
+        response = get_tts_client().post(text, [audio_path], timeout=30, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return f"TTS服务错误: {response.status_code}"
+
+        # 在共享混音器的独占通道上从内存播放，音频块边到达边排播，不打断音乐和其他角色
+        stream = get_audio_service().open_stream(character, volume=0.9)
+        blocks = []
+        decoder = open_decoder(response)
+        try:
+            for wav_block in iter_wav_blocks(response, decoder=decoder):
+                blocks.append(wav_block)
+                stream.enqueue(pygame.mixer.Sound(file=io.BytesIO(wav_block)))
+        finally:
+            stream.close()
+            response.close()
+        # 被截断的响应不缓存，否则以后每次都播放残缺的音频
+        if audio_complete(decoder, text):
+            cache.put(character, text, join_wav_blocks(blocks), voice.content_hash)
 
     def tts_and_play():
-        temp_file = None
         try:
-            # 调用TTS服务
-            url = "http://127.0.0.1:11996/tts_url"
-            data = {
-                "text": text,
-                "audio_paths": [audio_path]
-            }
-
-            response = requests.post(url, json=data, timeout=30)
-            if response.status_code != 200:
-                return f"TTS服务错误: {response.status_code}"
-
-            # 保存临时文件
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-                f.write(response.content)
-                temp_file = f.name
-
-            # 播放音频
-            pygame.mixer.quit()
-            time.sleep(0.1)
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=1024)
-            time.sleep(0.1)
-
-            pygame.mixer.music.load(temp_file)
-            pygame.mixer.music.set_volume(0.9)
-            pygame.mixer.music.play()
-
-            # 等待播放完成后清理
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.5)
+            cached = cache.get(character, text, voice.content_hash)
+            if cached is not None:
+                # 重复的台词直接从缓存播放
+                stream = get_audio_service().open_stream(character, volume=0.9)
+                stream.enqueue(pygame.mixer.Sound(file=io.BytesIO(cached)))
+                stream.close()
+                return
 
-            # 清理临时文件
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
+            # 经共享调度器合成：计入全局并发上限，作为首段优先，预合成随之让路
+            get_tts_scheduler().submit(synthesize_and_play, key=character, first=True).result()
 
         except Exception as e:
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
             print(f"TTS播放失败: {str(e)}")
 
     # 在新线程中执行
@@ -674,10 +524,12 @@ def advanced_character_tts(text: str, character: str = "纳西妲") -> str:
     """高性能流水线角色TTS（支持多角色并发播放）
 
     特性：
-    - 智能文本分片（按标点符号）
-    - 第一片段串行处理（最快首token）
-    - 其余片段并行处理（利用TTS服务并发能力）
+    - 自适应分片（首段短、后续几何增长，按实测延迟调整）
+    - 第一片段优先调度（最快首token）
+    - 其余片段由共享调度器并行合成（全局并发上限，角色间公平轮转）
     - 流水线播放（一边合成一边播放）
+    - 流式接收音频（片段边下载边播放）
+    - 合成结果缓存（重复台词不再请求TTS服务）
     - **多角色并发播放**（使用pygame.Sound而非music）
     - 独立音频通道管理
     - 严格播放顺序保证
@@ -689,117 +541,91 @@ def advanced_character_tts(text: str, character: str = "纳西妲") -> str:
     Returns:
         str: 执行结果
     """
-    import requests
-    import os
-    import tempfile
+    import io
     import threading
     import time
-    import queue
-    import re
-    from concurrent.futures import ThreadPoolExecutor, as_completed
     import pygame
     import uuid
+    from tts_client import get_tts_client
+    from tts_scheduler import get_tts_scheduler
+    from audio_service import get_audio_service
+    from voice_registry import get_voice_registry
+    from tts_stream import (iter_wav_blocks, wav_duration, join_wav_blocks, SegmentSequencer,
+                            open_decoder, audio_complete)
+    from text_segmenter import get_text_segmenter
+    from audio_cache import get_audio_cache
 
     # 全局管理器（支持多实例）
     class ConcurrentTTSManager:
         def __init__(self, instance_id: str):
             self.instance_id = instance_id
             self.segments = []
-            self.audio_queue = queue.Queue()
             self.playing = False
-            self.stop_flag = False
-            self.temp_files = []
-            self.sound_objects = []  # 存储Sound对象以防止垃圾回收
+            self.futures = []  # 已提交到调度器的合成任务
+            self.stream = None  # 本角色独立通道上的顺序声音流
+            self.sequencer = None  # 按片段顺序把音频块送入声音流
 
         def cleanup(self):
-            """清理临时文件和音频资源"""
-            # 停止所有音频
-            for sound_obj in self.sound_objects:
-                try:
-                    sound_obj.stop()
-                except:
-                    pass
-
-            # 清理临时文件
-            for temp_file in self.temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.unlink(temp_file)
-                except:
-                    pass
+            """取消未开始的合成，停止并释放音频资源"""
+            for future in self.futures:
+                future.cancel()
+            if self.stream is not None:
+                self.stream.stop()
+
+    # 查找角色音色（内存字典，支持别名）
+    voice = get_voice_registry().resolve(character)
+    if voice is None:
+        return f"❌ {character}不在场"
+    character = voice.name
+    audio_path = voice.path
+    voice_hash = voice.content_hash
 
     # 创建唯一实例ID
     instance_id = f"{character}_{uuid.uuid4().hex[:8]}"
     manager = ConcurrentTTSManager(instance_id)
 
-    # 检查角色音频文件
-    audio_path = f"./wavs/{character}.wav"
-    alt_paths = [f"./wavs/[{character}].wav", f"./wavs/{character}音色.wav"]
-    for path in [audio_path] + alt_paths:
-        if os.path.exists(path):
-            audio_path = path
-            break
-    else:
-        return f"❌ {character}不在场"
-
-    def smart_text_segmentation(text: str) -> list:
-        """智能文本分片"""
-        # 按中英文标点符号分割
-        separators = r'[。！？；：,.!?;:]'
-        segments = re.split(f'({separators})', text)
-
-        # 重新组合保留标点
-        result = []
-        current_segment = ""
-        for part in segments:
-            if part.strip():
-                current_segment += part
-                if re.match(separators, part) or len(current_segment) > 80:
-                    if current_segment.strip():
-                        result.append(current_segment.strip())
-                        current_segment = ""
-
-        if current_segment.strip():
-            result.append(current_segment.strip())
-
-        # 合并过短的片段
-        final_result = []
-        temp_segment = ""
-        for segment in result:
-            temp_segment += segment
-            if len(temp_segment) >= 25 or segment == result[-1]:
-                final_result.append(temp_segment)
-                temp_segment = ""
-
-        return final_result if final_result else [text]
-
     def synthesize_segment(segment_text: str, segment_id: int) -> dict:
-        """合成单个文本片段"""
+        """流式合成单个文本片段：边下载边把音频块交给排序器"""
         try:
-            url = "http://127.0.0.1:11996/tts_url"
-            data = {
-                "text": segment_text,
-                "audio_paths": [audio_path]
-            }
-
             start_time = time.time()
-            response = requests.post(url, json=data, timeout=25)
+            response = get_tts_client().post(segment_text, [audio_path], timeout=25, stream=True)
 
             if response.status_code != 200:
+                response.close()
                 return {"success": False, "error": f"HTTP {response.status_code}"}
 
-            # 保存临时文件
-            with tempfile.NamedTemporaryFile(suffix=f'_{instance_id}_seg_{segment_id}.wav', delete=False) as f:
-                f.write(response.content)
-                temp_file = f.name
-
-            manager.temp_files.append(temp_file)
+            first_audio_time = None
+            audio_seconds = 0.0
+            blocks = []
+            decoder = open_decoder(response)
+            try:
+                for wav_block in iter_wav_blocks(response, decoder=decoder):
+                    if manager.stream.finished:
+                        # 播放已被停止，不再占用TTS连接
+                        return {"success": False, "error": "播放已停止"}
+                    if first_audio_time is None:
+                        first_audio_time = time.time() - start_time
+                    audio_seconds += wav_duration(wav_block)
+                    blocks.append(wav_block)
+                    manager.sequencer.add_block(segment_id, wav_block)
+            finally:
+                # 解析出错、读取超时或中途停止时都要归还连接，否则连接池名额永久丢失
+                response.close()
 
             synthesis_time = time.time() - start_time
+            audio_bytes = join_wav_blocks(blocks) if blocks else None
+            # 被截断的响应照常播放，但不写入缓存，也不作为分段器的测量
+            complete = audio_complete(decoder, segment_text)
+            if complete:
+                # 实测耗时反馈给分段器，调整后续的首段长度与增长上限
+                get_text_segmenter().observe(segment_text, first_audio_time, synthesis_time, audio_seconds)
+                get_audio_cache().put(character, segment_text, audio_bytes, voice_hash)
             return {
                 "success": True,
                 "segment_id": segment_id,
-                "file_path": temp_file,
+                "audio_bytes": audio_bytes,
+                "complete": complete,
+                "first_audio_time": first_audio_time or synthesis_time,
                 "synthesis_time": synthesis_time,
                 "text_preview": segment_text[:20] + "..." if len(segment_text) > 20 else segment_text
             }
@@ -807,169 +633,97 @@ def advanced_character_tts(text: str, character: str = "纳西妲") -> str:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def priority_synthesis_worker():
-        """优先级合成工作线程"""
-        try:
-            segments = manager.segments
-            if not segments:
-                return
-
-            print(f"📄 {character}文本分片: {len(segments)}段")
-
-            # 第一段：串行处理（首token优化）
-            print(f"⚡ {character}优先合成首段...")
-            first_result = synthesize_segment(segments[0], 0)
-
-            if first_result["success"]:
-                manager.audio_queue.put((0, first_result))
-                print(f"✅ {character}首段完成: {first_result['synthesis_time']:.2f}s")
+    def on_playback_finished():
+        """最后一段播放结束时由播放计时线程回调，立即释放资源"""
+        manager.playing = False
+        print(f"🏁 {character}播放完成")
+
+    def schedule_synthesis():
+        """将全部片段提交到共享调度器（首段优先、角色间公平轮转），音频块由排序器按顺序送入声音流"""
+        segments = manager.segments
+        if not segments:
+            return
+
+        print(f"📄 {character}文本分片: {len(segments)}段")
+        scheduler = get_tts_scheduler()
+        audio_lock = threading.Lock()
+        manager.sequencer = SegmentSequencer(
+            manager.stream, len(segments),
+            make_sound=lambda wav_bytes: pygame.mixer.Sound(file=io.BytesIO(wav_bytes)),
+            on_played=lambda segment_id: print(f"🎵 {character}开始播放段{segment_id}: {segments[segment_id][:20]}")
+        )
+
+        def on_done(segment_id, future):
+            if future.cancelled():
+                result = {"success": False, "error": "已取消"}
             else:
-                print(f"❌ {character}首段失败: {first_result['error']}")
-                return
-
-            # 其余段：并行处理（并发数=3）
-            if len(segments) > 1:
-                print(f"🚄 {character}并行合成剩余{len(segments)-1}段...")
-
-                with ThreadPoolExecutor(max_workers=3) as executor:
-                    # 提交并行任务
-                    future_to_id = {
-                        executor.submit(synthesize_segment, segments[i], i): i
-                        for i in range(1, len(segments))
-                    }
-
-                    # 收集结果
-                    for future in as_completed(future_to_id):
-                        if manager.stop_flag:
-                            break
-
-                        segment_id = future_to_id[future]
-                        result = future.result()
-
-                        if result["success"]:
-                            manager.audio_queue.put((segment_id, result))
-                            print(f"✅ {character}段{segment_id}: {result['synthesis_time']:.2f}s")
-                        else:
-                            print(f"❌ {character}段{segment_id}: {result['error']}")
-
-            # 标记合成完成
-            manager.audio_queue.put((999999, {"finished": True}))
-
-        except Exception as e:
-            print(f"❌ {character}合成线程异常: {e}")
-
-    def concurrent_player():
-        """并发播放工作线程（支持多角色同时播放）"""
-        try:
-            # 初始化pygame mixer（如果还没初始化）
-            if not pygame.mixer.get_init():
-                pygame.mixer.quit()  # 确保完全重置
-                time.sleep(0.05)
-                # 增加同时播放的音频数量
-                pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-                pygame.mixer.set_num_channels(16)  # 支持最多16个同时播放的音频
-                time.sleep(0.05)
-
-            manager.playing = True
-            next_segment_id = 0
-            ready_segments = {}  # 缓存乱序到达的片段
-
-            print(f"🔊 {character}开始播放...")
-
-            while manager.playing and not manager.stop_flag:
                 try:
-                    # 获取合成完成的音频（超时2秒）
-                    segment_id, result = manager.audio_queue.get(timeout=2)
-
-                    # 检查结束标记
-                    if result.get("finished"):
-                        break
-
-                    if not result["success"]:
-                        continue
-
-                    # 缓存乱序到达的片段
-                    ready_segments[segment_id] = result
-
-                    # 按顺序播放
-                    while next_segment_id in ready_segments:
-                        segment_result = ready_segments.pop(next_segment_id)
-
-                        try:
-                            # **关键修改：使用Sound对象而不是music**
-                            sound = pygame.mixer.Sound(segment_result["file_path"])
-                            manager.sound_objects.append(sound)
-
-                            # 播放音频（不会打断其他角色）
-                            channel = sound.play()
-
-                            if channel:
-                                print(f"🎵 {character}播放段{next_segment_id}: {segment_result['text_preview']}")
-
-                                # 等待此段播放完成（但不影响其他角色）
-                                while channel.get_busy() and not manager.stop_flag:
-                                    time.sleep(0.08)
-                            else:
-                                print(f"⚠️ {character}段{next_segment_id}播放失败：没有可用音频通道")
-
-                            next_segment_id += 1
-
-                        except Exception as e:
-                            print(f"❌ {character}播放段{next_segment_id}失败: {e}")
-                            next_segment_id += 1
-                            continue
-
-                except queue.Empty:
-                    # 超时检查
-                    if not ready_segments and next_segment_id >= len(manager.segments):
-                        break
-                    continue
-
+                    result = future.result()
                 except Exception as e:
-                    print(f"❌ {character}播放线程异常: {e}")
-                    break
+                    result = {"success": False, "error": str(e)}
 
-            manager.playing = False
-            print(f"🏁 {character}播放完成")
-
-        except Exception as e:
-            print(f"❌ {character}播放器异常: {e}")
-            manager.playing = False
-
-    def delayed_cleanup():
-        """延迟清理工作线程"""
-        time.sleep(3)  # 等待播放完成
-        while manager.playing:
-            time.sleep(0.5)
-        time.sleep(1)  # 额外等待
-        manager.cleanup()
-        print(f"🗑️ {character}临时文件已清理")
+            label = "首段" if segment_id == 0 else f"段{segment_id}"
+            if result["success"]:
+                print(f"✅ {character}{label}: 首块{result['first_audio_time']:.2f}s / 全部{result['synthesis_time']:.2f}s")
+            else:
+                print(f"❌ {character}{label}: {result['error']}")
+
+            if result["success"] and result["audio_bytes"] and result["complete"]:
+                remember_segment(segment_id, result["audio_bytes"])
+            # 失败片段也要登记结束，以便顺序推进（不会打断其他角色）
+            manager.sequencer.finish(segment_id)
+
+        cache = get_audio_cache()
+        segment_audio = {}
+
+        def remember_segment(segment_id, audio_bytes):
+            """全部片段都有音频时，把整句拼接后也存入缓存（下次整句命中，不受分段变化影响）"""
+            with audio_lock:
+                segment_audio[segment_id] = audio_bytes
+                complete = len(segments) > 1 and len(segment_audio) == len(segments)
+            if complete:
+                whole = join_wav_blocks([segment_audio[i] for i in range(len(segments))])
+                cache.put(character, text, whole, voice_hash)
+
+        for i, segment in enumerate(segments):
+            # 缓存命中的片段直接排播，不占用TTS服务
+            cached = cache.get(character, segment, voice_hash)
+            if cached is not None:
+                print(f"⚡ {character}段{i}缓存命中")
+                manager.sequencer.add_block(i, cached)
+                manager.sequencer.finish(i)
+                remember_segment(i, cached)
+                continue
+            future = scheduler.submit(synthesize_segment, segment, i, key=character, first=(i == 0))
+            manager.futures.append(future)
+            future.add_done_callback(lambda f, segment_id=i: on_done(segment_id, f))
 
     # 主处理逻辑
     try:
         if not text.strip():
             return "文本为空"
 
+        # 共享混音器（只初始化一次，固定格式，通道不足时自动扩充）
+        audio = get_audio_service()
+        audio.ensure_init()
+
         # **重要修改：不再停止其他角色的播放**
         # 文本分片
-        manager.segments = smart_text_segmentation(text)
+        # 整句已缓存时不再分段，一次排播
+        if get_audio_cache().contains(character, text, voice_hash):
+            manager.segments = [text]
+        else:
+            manager.segments = get_text_segmenter().segment(text)
 
         print(f"📝 {character}准备朗读: {text[:40]}{'...' if len(text) > 40 else ''}")
 
-        # 启动合成线程
-        synthesis_thread = threading.Thread(target=priority_synthesis_worker, daemon=False)
-        synthesis_thread.start()
-
-        # 立即启动播放线程
-        player_thread = threading.Thread(target=concurrent_player, daemon=False)
-        player_thread.start()
-
-        # 启动清理线程
-        cleanup_thread = threading.Thread(target=delayed_cleanup, daemon=True)
-        cleanup_thread.start()
+        # 每个实例独占一个通道，段间由混音器无缝衔接，播放结束即回调
+        manager.stream = audio.open_stream(character, volume=1.0, on_finished=on_playback_finished)
+        manager.playing = True
+        print(f"🔊 {character}开始播放...")
 
-        # 给系统启动时间
-        time.sleep(0.08)
+        # 提交合成任务到共享调度器
+        schedule_synthesis()
 
         return f"🚀 {character}并发播放启动: {len(manager.segments)}段文本 [实例:{instance_id[:8]}]"
 
@@ -980,11 +734,10 @@ def advanced_character_tts(text: str, character: str = "纳西妲") -> str:
 def stop_all_advanced_tts() -> str:
     """停止所有高性能TTS播放"""
     try:
-        import pygame
+        from audio_service import get_audio_service
 
-        if pygame.mixer.get_init():
-            # 停止所有声音
-            pygame.mixer.stop()
+        # 停止所有语音通道（背景音乐不受影响）
+        if get_audio_service().stop_all_voices():
             print("🛑 已停止所有TTS播放")
             return "已停止所有流水线TTS播放"
 
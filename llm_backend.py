@@ -0,0 +1,354 @@
+import asyncio
+import json
+import re
+from typing import Callable, List, Optional, Union
+
+import httpx
+import ollama
+from ollama import Message
+
+
+def _last_user_text(messages: List[dict]) -> str:
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def make_tool_call(name: str, arguments: dict):
+    """构造与 ollama 返回结构一致的工具调用对象"""
+    return Message.ToolCall(function=Message.ToolCall.Function(name=name, arguments=arguments))
+
+
+def _call_parts(call):
+    """工具调用（ollama 对象或字典）的 (名称, 参数字典)"""
+    function = call.get("function") if isinstance(call, dict) else call.function
+    if isinstance(function, dict):
+        name, arguments = function.get("name"), function.get("arguments")
+    else:
+        name, arguments = function.name, function.arguments
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except json.JSONDecodeError:
+            arguments = {}
+    return name, dict(arguments or {})
+
+
+class LLMBackend:
+    """模型后端接口，调用方式与返回结构同 ollama.AsyncClient.chat
+
+    chat(model, messages, tools, stream, **kwargs)：
+    - stream=False 返回 {"message": {"role", "content", "tool_calls"?}, "done": True, "prompt_eval_count", ...}
+    - stream=True 返回异步迭代器，逐块产出相同结构；工具调用以完整的 tool_calls 块下发，最后一块 done=True
+    工具调用对象与 ollama 相同（call.function.name，call.function.arguments 为字典）。
+    prompt_eval_count 为本轮实际计算的提示词token数（命中前缀缓存的部分不计）。
+    """
+
+    async def chat(self, model: str = "", messages: Optional[List[dict]] = None, tools: Optional[List[dict]] = None,
+                   stream: bool = False, **kwargs):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class OllamaBackend(LLMBackend):
+    """Ollama（ollama.AsyncClient），支持 keep_alive 与 options.num_ctx"""
+
+    def __init__(self, base_url: Optional[str] = None):
+        """
+        Args:
+            base_url: Ollama 地址，None 为默认（OLLAMA_HOST 或 127.0.0.1:11434）
+        """
+        self._client = ollama.AsyncClient(host=base_url)
+
+    async def chat(self, model: str = "", messages: Optional[List[dict]] = None, tools: Optional[List[dict]] = None,
+                   stream: bool = False, **kwargs):
+        return await self._client.chat(model=model, messages=messages, tools=tools, stream=stream, **kwargs)
+
+    async def aclose(self):
+        await self._client.close()
+
+
+# ollama options 到 OpenAI 请求参数的映射（num_ctx、keep_alive 由服务端启动参数决定，忽略）
+_OPENAI_OPTIONS = {"temperature": "temperature", "top_p": "top_p", "num_predict": "max_tokens", "seed": "seed",
+                   "stop": "stop"}
+# 没有对应结果的工具调用补上的占位结果
+OMITTED_TOOL_RESULT = "（工具结果已省略）"
+
+
+def to_openai_messages(messages: List[dict]) -> List[dict]:
+    """ollama 格式的消息转为 OpenAI 格式
+
+    工具调用补上 id（按消息位置生成，同一历史每次转换结果相同，不破坏服务端前缀缓存），
+    role: tool 的结果按 tool_name 对应到前一条助手消息中的调用。
+    OpenAI 接口要求每个调用后都有对应的工具结果，否则返回400：上下文压缩裁掉的结果、
+    超时或参数错误而没有结果的调用，补一条占位的工具结果。
+    """
+    converted = []
+    open_calls = []  # 前一条助手消息中尚未对应结果的 (id, 工具名)
+
+    def close_open_calls():
+        for call_id, _ in open_calls:
+            converted.append({"role": "tool", "tool_call_id": call_id, "content": OMITTED_TOOL_RESULT})
+        open_calls.clear()
+
+    for position, message in enumerate(messages or []):
+        role = message.get("role")
+        if role != "tool":
+            close_open_calls()
+        if role == "assistant" and message.get("tool_calls"):
+            calls = []
+            for index, call in enumerate(message["tool_calls"]):
+                name, arguments = _call_parts(call)
+                calls.append({"id": f"call_{position}_{index}", "type": "function",
+                              "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}})
+            open_calls[:] = [(call["id"], call["function"]["name"]) for call in calls]
+            converted.append({"role": "assistant", "content": message.get("content") or "", "tool_calls": calls})
+        elif role == "tool":
+            match = next((item for item in open_calls if item[1] == message.get("tool_name")),
+                         open_calls[0] if open_calls else None)
+            if match:
+                open_calls.remove(match)
+            converted.append({"role": "tool", "tool_call_id": match[0] if match else f"call_{position}",
+                              "content": message.get("content") or ""})
+        else:
+            converted.append({"role": role, "content": message.get("content") or ""})
+    close_open_calls()
+    return converted
+
+
+def _from_openai_calls(calls: Optional[List[dict]]) -> list:
+    result = []
+    for call in calls or []:
+        name, arguments = _call_parts(call)
+        result.append(make_tool_call(name, arguments))
+    return result
+
+
+def _usage_counts(usage: Optional[dict]) -> dict:
+    if not usage:
+        return {}
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return {"prompt_eval_count": max(0, (usage.get("prompt_tokens") or 0) - cached),
+            "eval_count": usage.get("completion_tokens")}
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """OpenAI 兼容的 /chat/completions 接口（vLLM、llama.cpp server、SGLang 等），基于 httpx
+
+    请求与响应在 ollama 与 OpenAI 格式之间转换；流式响应中分片到达的工具调用参数
+    拼接完整后才作为 tool_calls 块下发。
+    """
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None, model: Optional[str] = None,
+                 timeout: float = 120.0, max_connections: int = 16):
+        """
+        Args:
+            base_url: 接口地址（含 /v1），None 为 http://127.0.0.1:8000/v1（vLLM 默认端口）
+            api_key: 服务端要求鉴权时的密钥
+            model: 覆盖请求中的模型名（vLLM 以 --served-model-name 为准）
+            timeout: 读取超时（秒）
+            max_connections: 连接池大小（同时进行的请求数）
+        """
+        self.base_url = (base_url or "http://127.0.0.1:8000/v1").rstrip("/")
+        self.model = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url, headers=headers,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def _body(self, model, messages, tools, stream, options) -> dict:
+        body = {"model": self.model or model, "messages": to_openai_messages(messages), "stream": stream}
+        if tools:
+            body["tools"] = tools
+        for key, target in _OPENAI_OPTIONS.items():
+            if (options or {}).get(key) is not None:
+                body[target] = options[key]
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    async def chat(self, model: str = "", messages: Optional[List[dict]] = None, tools: Optional[List[dict]] = None,
+                   stream: bool = False, options: Optional[dict] = None, **kwargs):
+        body = self._body(model, messages, tools, stream, options)
+        if not stream:
+            response = await self._client.post("/chat/completions", json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            data = response.json()
+            choice = (data.get("choices") or [{}])[0].get("message") or {}
+            message = {"role": "assistant", "content": choice.get("content") or ""}
+            if choice.get("tool_calls"):
+                message["tool_calls"] = _from_openai_calls(choice["tool_calls"])
+            return {"message": message, "done": True, **_usage_counts(data.get("usage"))}
+        return self._stream(body)
+
+    async def _stream(self, body: dict):
+        async with self._client.stream("POST", "/chat/completions", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+            partial = {}  # 下标 → {"name", "arguments": [片段]}
+            usage = None
+
+            def flush():
+                calls = []
+                for index in sorted(partial):
+                    text = "".join(partial[index]["arguments"]) or "{}"
+                    try:
+                        arguments = json.loads(text)
+                    except json.JSONDecodeError:
+                        print(f"⚠️ 工具调用参数不是合法JSON: {text[:80]}")
+                        arguments = {}
+                    calls.append(make_tool_call(partial[index]["name"], arguments))
+                partial.clear()
+                return {"message": {"role": "assistant", "content": "", "tool_calls": calls}, "done": False}
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("content"):
+                        yield {"message": {"role": "assistant", "content": delta["content"]}, "done": False}
+                    for part in delta.get("tool_calls") or []:
+                        entry = partial.setdefault(part.get("index", 0), {"name": "", "arguments": []})
+                        function = part.get("function") or {}
+                        if function.get("name"):
+                            entry["name"] = function["name"]
+                        if function.get("arguments"):
+                            entry["arguments"].append(function["arguments"])
+                    if choice.get("finish_reason") and partial:
+                        yield flush()
+            if partial:
+                yield flush()
+            yield {"message": {"role": "assistant", "content": ""}, "done": True, **_usage_counts(usage)}
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+ToolScript = Union[List[dict], Callable[[str, List[str]], List[dict]]]
+
+
+class ScriptedBackend(LLMBackend):
+    """确定性的模拟模型，用于本地测试与压测（与模型无关地测量编排开销）
+
+    默认回复“收到：<用户输入>”，用户输入中出现角色名（含别名）时调用语音工具让该角色复述。
+    reply / tool_calls 可固定每轮的输出，例如：
+        ScriptedBackend(reply="好的", tool_calls=[{"name": "list_available_music", "arguments": {}}],
+                        first_token_delay=0, token_delay=0)
+    tool_calls 中字符串参数可含 {user}（用户输入）与 {character}（提到的角色）占位符；
+    也可传入函数 tool_calls(用户输入, 本轮工具名列表) -> [{"name", "arguments"}]。
+    """
+
+    def __init__(self, first_token_delay: float = 0.1, token_delay: float = 0.02, reply: str = "收到：{user}",
+                 tool_calls: Optional[ToolScript] = None, speech_tool: str = "advanced_character_tts",
+                 chunk_chars: int = 1, only_offered: bool = True):
+        """
+        Args:
+            first_token_delay: 首个token前的延迟（秒，模拟提示词处理）
+            token_delay: 每个流式块的间隔（秒）
+            reply: 回复模板，{user} 替换为用户输入
+            tool_calls: 每轮的工具调用（None 为默认：提到角色时调用语音工具）
+            speech_tool: 默认脚本中使用的语音工具
+            chunk_chars: 每个流式块的字符数
+            only_offered: 只调用本轮请求中提供的工具（与真实模型一致）
+        """
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.reply = reply
+        self.tool_calls = tool_calls
+        self.speech_tool = speech_tool
+        self.chunk_chars = max(1, chunk_chars)
+        self.only_offered = only_offered
+        self.requests = 0
+        self.tool_calls_emitted = 0
+
+    def _character(self, text: str) -> Optional[str]:
+        from voice_registry import get_voice_registry
+
+        for voice in get_voice_registry().voices():
+            for name in [voice.name, *voice.aliases]:
+                if name and re.search(re.escape(name), text, re.I):
+                    return voice.name
+        return None
+
+    def _script(self, messages: List[dict], tools: Optional[List[dict]]):
+        """本轮的回复文本与工具调用"""
+        user_text = _last_user_text(messages)
+        tool_names = [tool["function"]["name"] for tool in tools or []]
+        character = self._character(user_text)
+
+        if self.tool_calls is None:
+            planned = []
+            if character:
+                planned.append({"name": self.speech_tool,
+                                "arguments": {"text": "你好，我是{character}。", "character": "{character}"}})
+        elif callable(self.tool_calls):
+            planned = self.tool_calls(user_text, tool_names)
+        else:
+            planned = self.tool_calls
+
+        values = {"user": user_text, "character": character or ""}
+        calls = []
+        for item in planned or []:
+            if self.only_offered and item["name"] not in tool_names:
+                continue
+            arguments = {key: value.format(**values) if isinstance(value, str) else value
+                         for key, value in (item.get("arguments") or {}).items()}
+            calls.append(make_tool_call(item["name"], arguments))
+        self.tool_calls_emitted += len(calls)
+        return self.reply.format(**values), calls
+
+    async def chat(self, model: str = "", messages: Optional[List[dict]] = None, tools: Optional[List[dict]] = None,
+                   stream: bool = False, **kwargs):
+        self.requests += 1
+        content, tool_calls = self._script(messages, tools)
+        prompt_tokens = sum(len(message.get("content") or "") for message in messages or [])
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+
+        if not stream:
+            await asyncio.sleep(self.first_token_delay + self.token_delay * len(chunks))
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return {"message": message, "done": True, "prompt_eval_count": prompt_tokens, "eval_count": len(content)}
+
+        async def generate():
+            await asyncio.sleep(self.first_token_delay)
+            for chunk in chunks:
+                yield {"message": {"role": "assistant", "content": chunk}, "done": False}
+                await asyncio.sleep(self.token_delay)
+            if tool_calls:
+                yield {"message": {"role": "assistant", "content": "", "tool_calls": tool_calls}, "done": False}
+            yield {"message": {"role": "assistant", "content": ""}, "done": True,
+                   "prompt_eval_count": prompt_tokens, "eval_count": len(content)}
+
+        return generate()
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "openai": OpenAICompatibleBackend,
+    "stub": ScriptedBackend,
+}
+
+
+def create_backend(kind: str = "ollama", base_url: Optional[str] = None, **kwargs) -> LLMBackend:
+    """按名称创建模型后端（"ollama" / "openai" / "stub"；stub 不使用 base_url）"""
+    if kind not in BACKENDS:
+        raise ValueError(f"未知模型后端: {kind}（可选: {', '.join(BACKENDS)}）")
+    if base_url and kind != "stub":
+        kwargs["base_url"] = base_url
+    return BACKENDS[kind](**kwargs)
@@ -0,0 +1,171 @@
+import atexit
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class BatchedLogWriter:
+    """后台批量日志写入器
+
+    调用方只把事件放入有界队列，由单独的写线程批量序列化后追加到分段文件
+    （每行一个事件），分段文件超过大小上限后自动轮转。队列满时按 put_timeout
+    等待，仍满则丢弃事件并计数，保证主线程不会被日志I/O阻塞。
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_dir: str, prefix: str = "events", max_queue: int = 10000,
+                 batch_size: int = 256, flush_interval: float = 0.5,
+                 segment_max_bytes: int = 8 * 1024 * 1024, put_timeout: float = 0.0):
+        """
+        Args:
+            log_dir: 日志目录
+            prefix: 分段文件名前缀
+            max_queue: 队列中最多缓存的事件数（内存上限）
+            batch_size: 单次写入的最大事件数
+            flush_interval: 无新事件时的最长等待时间（秒），到时写出已攒的批次
+            segment_max_bytes: 单个分段文件的大小上限，超过后轮转
+            put_timeout: 队列满时提交方最多等待的时间（秒），0表示立即丢弃
+        """
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._segment_index = 0
+        self._segment_file = None
+        self._segment_bytes = 0
+        self._closed = False
+
+        self.written_count = 0
+        self.dropped_count = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"{prefix}_writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, event_data: Dict[str, Any], log_type: str = "general") -> bool:
+        """提交事件（非阻塞），队列已满时返回False"""
+        if self._closed:
+            return False
+
+        item = {"log_type": log_type, "logged_at": datetime.now().isoformat(), "event": event_data}
+        try:
+            if self.put_timeout > 0:
+                self._queue.put(item, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            if self.dropped_count == 1 or self.dropped_count % 1000 == 0:
+                print(f"⚠️ 日志队列已满，已丢弃 {self.dropped_count} 条事件")
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待提交到此刻为止的事件全部写出"""
+        if not self._thread.is_alive():
+            return False
+
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写出剩余事件并停止写线程（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        # 每个会话一个写入器，关闭后解除注册，避免长期运行的服务端累积引用
+        atexit.unregister(self.close)
+
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            print("⚠️ 日志队列关闭超时，部分事件可能未写出")
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """写入统计"""
+        return {
+            "written": self.written_count,
+            "dropped": self.dropped_count,
+            "pending": self._queue.qsize(),
+            "segments": self._segment_index
+        }
+
+    def _run(self):
+        """写线程主循环：攒批 -> 写出 -> 按需轮转"""
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiters = []
+            for item in batch:
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    try:
+                        lines.append(json.dumps(item, ensure_ascii=False, default=str))
+                    except Exception as e:
+                        print(f"⚠️ 日志序列化失败: {e}")
+
+            if lines:
+                self._write_lines(lines)
+            for waiter in waiters:
+                waiter.set()
+
+        self._close_segment()
+
+    def _write_lines(self, lines):
+        """追加一批事件到当前分段文件"""
+        try:
+            if self._segment_file is None or self._segment_bytes >= self.segment_max_bytes:
+                self._open_next_segment()
+
+            data = "\n".join(lines) + "\n"
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            self._segment_bytes += len(data.encode('utf-8'))
+            self.written_count += len(lines)
+        except Exception as e:
+            print(f"⚠️ 日志写入失败: {e}")
+
+    def _open_next_segment(self):
+        """关闭当前分段并打开下一个"""
+        self._close_segment()
+        self._segment_index += 1
+        filename = os.path.join(self.log_dir, f"{self.prefix}_{self._segment_index:04d}.jsonl")
+        self._segment_file = open(filename, 'a', encoding='utf-8')
+        self._segment_bytes = self._segment_file.tell()
+
+    def _close_segment(self):
+        """关闭当前分段文件"""
+        if self._segment_file is not None:
+            try:
+                self._segment_file.close()
+            except Exception:
+                pass
+            self._segment_file = None
@@ -0,0 +1,351 @@
+import argparse
+import io
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 估算朗读时长：中文约每字0.22秒，其他字符约每个0.07秒
+SECONDS_PER_CJK_CHAR = 0.22
+SECONDS_PER_OTHER_CHAR = 0.07
+
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+
+
+def estimate_audio_seconds(text: str) -> float:
+    """按文本长度估算合成音频时长"""
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text.strip()) - cjk
+    return max(0.2, cjk * SECONDS_PER_CJK_CHAR + other * SECONDS_PER_OTHER_CHAR)
+
+
+def synth_wav(seconds: float, sample_rate: int = 22050, tone: float = 0.0) -> bytes:
+    """生成指定时长的WAV（16bit单声道），tone>0时为该频率的正弦音，否则为静音"""
+    frames = int(sample_rate * seconds)
+    if tone > 0:
+        step = 2 * math.pi * tone / sample_rate
+        samples = b"".join(int(3000 * math.sin(i * step)).to_bytes(2, "little", signed=True)
+                           for i in range(frames))
+    else:
+        samples = b"\0\0" * frames
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples)
+    return buffer.getvalue()
+
+
+class LatencyModel:
+    """模拟合成耗时：固定开销 + 按字数线性增长 + 随机抖动"""
+
+    def __init__(self, base: float = 0.2, per_char: float = 0.0, jitter: float = 0.0, seed=None):
+        """
+        Args:
+            base: 每个请求的固定开销（秒）
+            per_char: 每个字符增加的耗时（秒）
+            jitter: 抖动幅度，耗时乘以 (1 ± jitter) 之间的随机系数
+            seed: 随机种子，固定后抖动序列可复现
+        """
+        self.base = base
+        self.per_char = per_char
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, text: str) -> float:
+        latency = self.base + self.per_char * len(text)
+        if self.jitter:
+            with self._lock:
+                latency *= 1.0 + self._rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, latency)
+
+
+class _TTSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive，与真实服务一致
+
+    def do_POST(self):
+        server = self.server.mock
+        if self.path.rstrip("/") != "/tts_url":
+            self._reply(404, b"not found", "text/plain")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            text = payload["text"]
+            audio_paths = payload.get("audio_paths") or []
+        except (ValueError, KeyError) as e:
+            self._reply(400, f"bad request: {e}".encode("utf-8"), "text/plain")
+            return
+
+        if server.check_paths:
+            missing = [path for path in audio_paths if not os.path.exists(path)]
+            if missing:
+                self._reply(400, f"audio path not found: {missing[0]}".encode("utf-8"), "text/plain")
+                return
+
+        status, chunks = server.handle(text)
+        try:
+            if status == 200 and server.stream:
+                self._reply_chunked(chunks)
+            else:
+                self._reply(status, b"".join(chunks), "audio/wav" if status == 200 else "text/plain")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # 客户端提前断开（如播放被停止）
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_chunked(self, chunks):
+        """以分块传输编码边生成边发送"""
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if chunk:
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockTTSServer:
+    """本地模拟 index-TTS 服务
+
+    实现与真实服务相同的 POST /tts_url 协议（{"text", "audio_paths"} -> WAV），
+    按文本长度返回合理时长的音频，用于无GPU环境下的测试与基准：
+    - 延迟模型：固定开销 + 每字耗时 + 抖动
+    - 并发上限：超出的请求排队等待，或直接返回503
+    - 故障注入：按概率返回500、超时不响应或返回截断的音频
+    - 流式模式：分块传输，模拟边合成边输出的服务
+    每个请求的到达、开始、结束时间记录在 requests_log 中，便于检查调度顺序。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, base_latency: float = 0.2,
+                 per_char_latency: float = 0.0, jitter: float = 0.0, max_concurrency: int = 0,
+                 reject_when_busy: bool = False, error_rate: float = 0.0, timeout_rate: float = 0.0,
+                 timeout_seconds: float = 60.0, truncate_rate: float = 0.0, sample_rate: int = 22050,
+                 tone: float = 0.0, check_paths: bool = False, stream: bool = False,
+                 stream_chunk_seconds: float = 0.2, seed=None):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            base_latency: 每个请求的固定处理延迟（秒）
+            per_char_latency: 每个字符增加的处理延迟（秒）
+            jitter: 延迟抖动幅度（0.2 表示 ±20%）
+            max_concurrency: 同时合成的请求数上限，0表示不限
+            reject_when_busy: 达到并发上限时直接返回503，而不是排队
+            error_rate: 返回500的概率
+            timeout_rate: 挂起 timeout_seconds 后才响应的概率（模拟服务卡死）
+            timeout_seconds: 挂起时长
+            truncate_rate: 返回截断WAV的概率
+            sample_rate: 返回音频的采样率
+            tone: 正弦音频率（Hz），0表示静音
+            check_paths: 校验 audio_paths 在本机存在，不存在返回400
+            stream: 模拟增量合成：分块传输，WAV头先到，音频按块陆续到达
+            stream_chunk_seconds: 流式模式下每块的音频时长
+            seed: 随机种子（抖动与故障注入）
+        """
+        self.latency = LatencyModel(base_latency, per_char_latency, jitter, seed=seed)
+        self.max_concurrency = max_concurrency
+        self.reject_when_busy = reject_when_busy
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.truncate_rate = truncate_rate
+        self.sample_rate = sample_rate
+        self.tone = tone
+        self.check_paths = check_paths
+        self.stream = stream
+        self.stream_chunk_seconds = stream_chunk_seconds
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self._in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_log = []  # {"text", "arrived", "started", "finished", "status"}
+
+        self.httpd = ThreadingHTTPServer((host, port), _TTSHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/tts_url"
+
+    def handle(self, text: str):
+        """模拟一次合成，返回 (状态码, 响应体分块的迭代器)"""
+        entry = {"text": text, "arrived": time.monotonic(), "started": None, "finished": None, "status": None}
+        with self._lock:
+            self.requests_log.append(entry)
+
+        if self._slots is not None and not self._slots.acquire(blocking=not self.reject_when_busy):
+            entry["status"] = 503
+            entry["finished"] = time.monotonic()
+            return 503, iter([b"server busy"])
+
+        with self._lock:
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            fault = self._rng.random()
+        entry["started"] = time.monotonic()
+
+        hung = fault < self.timeout_rate
+        latency = self.timeout_seconds if hung else self.latency.sample(text)
+        fault -= self.timeout_rate
+        if 0 <= fault < self.error_rate:
+            time.sleep(latency)
+            self._release(entry, 500)
+            return 500, iter([b"injected failure"])
+
+        truncate = 0 <= fault - self.error_rate < self.truncate_rate
+        return 200, self._audio_chunks(text, latency, hung, truncate, entry)
+
+    def _audio_chunks(self, text: str, latency: float, hung: bool, truncate: bool, entry: dict):
+        """按延迟模型产出音频；流式模式下先发WAV头，其余耗时均摊到各PCM块"""
+        try:
+            wav = synth_wav(estimate_audio_seconds(text), self.sample_rate, self.tone)
+            if not self.stream:
+                time.sleep(latency)
+                yield wav[:len(wav) // 3] if truncate else wav
+                return
+
+            # 边合成边输出：头中的长度字段写占位值，与增量合成的服务一致
+            header, pcm = wav[:44], wav[44:]
+            header = header[:4] + b"\xff\xff\xff\xff" + header[8:40] + b"\xff\xff\xff\xff"
+            chunk_bytes = max(2, int(self.sample_rate * self.stream_chunk_seconds) * 2)
+            pieces = [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)] or [b""]
+            if truncate:
+                pieces = pieces[:max(1, len(pieces) // 3)]
+
+            first_wait = latency if hung else min(latency, self.latency.base)
+            per_piece = (latency - first_wait) / len(pieces)
+            time.sleep(first_wait)
+            yield header
+            for piece in pieces:
+                time.sleep(per_piece)
+                yield piece
+        finally:
+            self._release(entry, 200)
+
+    def _release(self, entry: dict, status: int):
+        """请求结束：归还并发名额并记录结果"""
+        with self._lock:
+            self._in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+        entry["status"] = status
+        entry["finished"] = time.monotonic()
+
+    def stats(self) -> dict:
+        """请求统计"""
+        with self._lock:
+            log = list(self.requests_log)
+        statuses = {}
+        for entry in log:
+            statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+        return {"requests": len(log), "statuses": statuses, "peak_in_flight": self.peak_in_flight}
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests_log = []
+            self.peak_in_flight = self._in_flight
+
+    def start(self) -> "MockTTSServer":
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock_tts_server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser, prefix: str = ""):
+    """注册模拟服务的命令行参数（tts_serve.py 的 --stub-* 参数复用此函数）"""
+    parser.add_argument(f"--{prefix}latency", type=float, default=0.2, help="每个请求的固定延迟（秒）")
+    parser.add_argument(f"--{prefix}per-char", type=float, default=0.0, help="每个字符增加的延迟（秒）")
+    parser.add_argument(f"--{prefix}jitter", type=float, default=0.0, help="延迟抖动幅度（0.2 表示 ±20%%）")
+    parser.add_argument(f"--{prefix}concurrency", type=int, default=0, help="并发合成上限，0表示不限")
+    parser.add_argument(f"--{prefix}reject-busy", action="store_true", help="达到并发上限时返回503而不是排队")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument(f"--{prefix}timeout-rate", type=float, default=0.0, help="挂起不响应的概率")
+    parser.add_argument(f"--{prefix}truncate-rate", type=float, default=0.0, help="返回截断音频的概率")
+    parser.add_argument(f"--{prefix}stream", action="store_true", help="分块传输，模拟边合成边输出")
+    parser.add_argument(f"--{prefix}seed", type=int, default=None, help="随机种子")
+
+
+def server_from_args(args, prefix: str = "", **kwargs) -> MockTTSServer:
+    """按 add_server_arguments 注册的参数创建服务"""
+    def get(name):
+        return getattr(args, (prefix + name).replace("-", "_"))
+
+    return MockTTSServer(
+        base_latency=get("latency"),
+        per_char_latency=get("per-char"),
+        jitter=get("jitter"),
+        max_concurrency=get("concurrency"),
+        reject_when_busy=get("reject-busy"),
+        error_rate=get("error-rate"),
+        timeout_rate=get("timeout-rate"),
+        truncate_rate=get("truncate-rate"),
+        stream=get("stream"),
+        seed=get("seed"),
+        **kwargs
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 index-TTS 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11996)
+    parser.add_argument("--tone", type=float, default=0.0, help="返回该频率的正弦音（Hz），默认静音")
+    parser.add_argument("--check-paths", action="store_true", help="校验 audio_paths 存在")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, host=args.host, port=args.port, tone=args.tone, check_paths=args.check_paths)
+    print(f"模拟TTS服务已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"请求统计: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
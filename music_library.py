@@ -0,0 +1,201 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from music_matcher import TrackMatcher, normalize
+
+
+MUSIC_DIR = "./musics"
+# list_available_music 展示的格式
+MUSIC_EXTENSIONS = ('.mp3', '.wav', '.flac', '.aac', '.ogg', '.m4a', '.mp4', '.wma')
+# pygame.mixer.music 能播放的格式
+PLAYABLE_EXTENSIONS = ('.mp3', '.wav', '.ogg')
+# 目录变化时增量更新模糊匹配索引的上限，新增曲目或失效条目更多时改为后台重建；
+# 曲目数不超过该值时首次扫描即同步建立索引，更大的曲库在后台建立
+INCREMENTAL_LIMIT = 2000
+
+
+class MusicLibrary:
+    """常驻内存的音乐索引
+
+    一次 scandir 建立 曲名->路径 映射，之后每次查询只 stat 一次目录：
+    目录 mtime 未变（没有增删改名）时直接命中内存索引，变化时才重新扫描。
+    模糊匹配索引在扫描目录时建立（大曲库在后台线程建立，完成前按子串匹配），
+    目录变化后增量加入新曲目（已删除的曲目在结果中过滤掉）；
+    变化过大时在后台线程重建，重建完成前继续使用旧索引。
+    """
+
+    def __init__(self, music_dir: str = MUSIC_DIR):
+        self.music_dir = music_dir
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._tracks: Dict[str, str] = {}  # 文件名 -> 路径，按文件名排序
+        self._by_name: Dict[str, str] = {}  # 小写曲名（不含扩展名） -> 文件名
+        self._matcher: Optional[TrackMatcher] = None  # 模糊匹配索引，扫描目录时建立
+        self._matcher_stems = set()  # 已入索引的曲名（含已删除的）
+        self._matcher_generation = 0  # 后台重建的代数，过期的重建结果被丢弃
+        self._matcher_building = False  # 首次建立索引的后台线程是否在运行
+        self._stem_files: Dict[str, List[str]] = {}  # 曲名 -> 文件名列表
+
+    def refresh(self, force: bool = False) -> bool:
+        """目录有变化时重建索引，返回目录是否存在"""
+        try:
+            mtime = os.stat(self.music_dir).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._dir_mtime = None
+                self._tracks = {}
+                self._by_name = {}
+                self._stem_files = {}
+            return False
+
+        if not force and mtime == self._dir_mtime:
+            return True
+
+        tracks = {}
+        with os.scandir(self.music_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in MUSIC_EXTENSIONS:
+                    tracks[entry.name] = entry.path
+
+        tracks = dict(sorted(tracks.items()))
+        by_name = {}
+        stem_files = {}
+        for filename in tracks:
+            stem = os.path.splitext(filename)[0]
+            by_name.setdefault(stem.lower(), filename)
+            stem_files.setdefault(stem, []).append(filename)
+
+        with self._lock:
+            self._tracks = tracks
+            self._by_name = by_name
+            self._stem_files = stem_files
+            self._dir_mtime = mtime
+            self._update_matcher_locked()
+        return True
+
+    def _update_matcher_locked(self):
+        """目录变化后更新模糊匹配索引（调用方持有锁）"""
+        if self._matcher is None:
+            if len(self._stem_files) <= INCREMENTAL_LIMIT:
+                self._matcher = TrackMatcher(self._stem_files)
+                self._matcher_stems = set(self._stem_files)
+            elif not self._matcher_building:
+                # 后台建立期间新增的曲目由建立线程补入
+                self._matcher_building = True
+                self._rebuild_matcher_locked()
+            return
+
+        added = [stem for stem in self._stem_files if stem not in self._matcher_stems]
+        stale = len(self._matcher_stems) - (len(self._stem_files) - len(added))
+        if len(added) <= INCREMENTAL_LIMIT and stale <= max(INCREMENTAL_LIMIT, len(self._matcher_stems) // 2):
+            for stem in added:
+                self._matcher.add(stem)
+                self._matcher_stems.add(stem)
+            return
+        self._rebuild_matcher_locked()
+
+    def _rebuild_matcher_locked(self):
+        """在后台线程按当前曲目重建索引，完成后替换（调用方持有锁）"""
+        self._matcher_generation += 1
+        generation = self._matcher_generation
+        stems = list(self._stem_files)
+
+        def rebuild():
+            matcher = TrackMatcher(stems)
+            with self._lock:
+                if generation != self._matcher_generation:
+                    return
+                # 重建期间新增的曲目补入
+                built = set(stems)
+                for stem in self._stem_files:
+                    if stem not in built:
+                        matcher.add(stem)
+                        built.add(stem)
+                self._matcher = matcher
+                self._matcher_stems = built
+                self._matcher_building = False
+
+        threading.Thread(target=rebuild, daemon=True, name="music_matcher_rebuild").start()
+
+    def filenames(self, playable_only: bool = False) -> List[str]:
+        """曲目文件名列表（已排序）"""
+        self.refresh()
+        return self._filenames(playable_only)
+
+    def _filenames(self, playable_only: bool) -> List[str]:
+        if not playable_only:
+            return list(self._tracks)
+        return [name for name in self._tracks if name.lower().endswith(PLAYABLE_EXTENSIONS)]
+
+    def names(self, playable_only: bool = False) -> List[str]:
+        """曲名列表（不含扩展名）"""
+        return [os.path.splitext(name)[0] for name in self.filenames(playable_only)]
+
+    def find(self, music_name: str, playable_only: bool = True) -> Optional[str]:
+        """按曲名查找文件路径：精确匹配 -> n-gram 模糊匹配"""
+        if not self.refresh():
+            return None
+
+        tracks = self._tracks
+        query = music_name.lower()
+
+        filename = self._by_name.get(query)
+        if filename and (not playable_only or filename.lower().endswith(PLAYABLE_EXTENSIONS)):
+            return tracks[filename]
+
+        results = self._search(music_name, top_k=1, playable_only=playable_only)
+        return tracks[results[0][0]] if results else None
+
+    def search(self, music_name: str, top_k: int = 5, playable_only: bool = False) -> List[Tuple[str, float]]:
+        """模糊搜索，返回 [(文件名, 得分)]（支持中文、拼音全拼与首字母）"""
+        if not self.refresh():
+            return []
+        return self._search(music_name, top_k, playable_only)
+
+    def _search(self, music_name: str, top_k: int, playable_only: bool) -> List[Tuple[str, float]]:
+        matcher = self._matcher
+        stem_files = self._stem_files
+
+        def pick(stem: str) -> Optional[str]:
+            """曲名对应的文件（已删除或没有可播放格式时为None）"""
+            for filename in stem_files.get(stem, ()):
+                if not playable_only or filename.lower().endswith(PLAYABLE_EXTENSIONS):
+                    return filename
+            return None
+
+        if matcher is None:
+            # 大曲库的索引还在后台建立
+            results = self._substring_search(music_name, stem_files, top_k, pick)
+        else:
+            # 在匹配器内过滤，排名靠前的曲目被删除或不可播放时不会挤掉后面的有效结果
+            results = matcher.search(music_name, top_k=top_k, keep=pick)
+        return [(pick(stem), score) for stem, score in results]
+
+    @staticmethod
+    def _substring_search(music_name: str, stems, top_k: int, keep) -> List[Tuple[str, float]]:
+        """索引建立完成前的退路：规范化后的子串匹配，得分与索引的加分规则一致"""
+        key = normalize(music_name)
+        if not key:
+            return []
+        results = []
+        for stem in stems:
+            target = normalize(stem)
+            if key in target and keep(stem):
+                results.append((stem, len(key) / len(target) + TrackMatcher._bonus(key, target)))
+        results.sort(key=lambda item: -item[1])
+        return results[:top_k]
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_music_library() -> MusicLibrary:
+    """获取共享的音乐索引"""
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                _library = MusicLibrary()
+    return _library
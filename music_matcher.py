@@ -0,0 +1,198 @@
+import heapq
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from itertools import chain
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装时只做字面匹配
+    lazy_pinyin = None
+    Style = None
+
+
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+_STRIP_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+# 各类匹配形式：曲名本身、拼音音节、拼音首字母
+_NAME, _SYLLABLES, _INITIALS = "n", "s", "i"
+
+
+def normalize(text: str) -> str:
+    """统一全半角、大小写，去掉空白与标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _STRIP_RE.sub("", text)
+
+
+def _grams(text: str) -> set:
+    """中文按二元组、拉丁字母按三元组切分（过短则整体作为一个gram）"""
+    n = 2 if _CJK_RE.search(text) else 3
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _syllable_grams(text: str) -> set:
+    """拼音按相邻音节二元组切分（音节以空格分隔），同音字可互相命中"""
+    syllables = text.split()
+    if len(syllables) <= 1:
+        return set(syllables)
+    return {f"{a} {b}" for a, b in zip(syllables, syllables[1:])}
+
+
+_GRAMS = {_NAME: _grams, _SYLLABLES: _syllable_grams, _INITIALS: _grams}
+
+
+def _pinyin_forms(text: str) -> Tuple[List[str], str]:
+    """返回 (拼音音节列表, 首字母串)，无中文或未安装 pypinyin 时为空"""
+    if lazy_pinyin is None or not _CJK_RE.search(text):
+        return [], ""
+    syllables = [normalize(s) for s in lazy_pinyin(text)]
+    initials = "".join(lazy_pinyin(text, style=Style.FIRST_LETTER))
+    return [s for s in syllables if s], normalize(initials)
+
+
+class TrackMatcher:
+    """曲名模糊匹配的倒排索引
+
+    每首曲目以三种形式入索引：规范化曲名（中文二元组/拉丁三元组）、
+    拼音音节二元组、拼音首字母（后两者需要 pypinyin）。查询时只对与查询共享
+    gram 的候选计算 Dice 相似度，再对完全/前缀/子串命中加分，返回排序后的 top-k，
+    不再对全库逐个做 difflib 比较。罗马字查询（如 haiyuan）按已知音节切分后
+    走音节索引，首字母查询（如 hy）走首字母索引。比 gram 还短的查询（如单个汉字）
+    在索引里只能命中同样短的曲名，另做一次子串扫描补全。
+    """
+
+    def __init__(self, names: Sequence[str] = ()):
+        self.names: List[str] = []
+        self._variants: List[Dict[str, str]] = []  # 曲目 -> {形式: 文本}
+        self._gram_sizes: List[Dict[str, int]] = []  # 曲目 -> {形式: gram数}
+        self._index: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        self._known_syllables = set()  # 曲库中出现过的拼音音节，用于切分罗马字查询
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> int:
+        """加入一首曲目，返回其编号"""
+        track_id = len(self.names)
+        key = normalize(name)
+        syllables, initials = _pinyin_forms(key)
+        variants = {_NAME: key}
+        if syllables:
+            variants[_SYLLABLES] = " ".join(syllables)
+            variants[_INITIALS] = initials
+            self._known_syllables.update(syllables)
+
+        grams = {form: _GRAMS[form](text) for form, text in variants.items()}
+        # 先登记曲目再写倒排表：索引可能在其他线程查询时增量加入曲目
+        self.names.append(name)
+        self._variants.append(variants)
+        self._gram_sizes.append({form: len(form_grams) for form, form_grams in grams.items()})
+        for form, form_grams in grams.items():
+            for gram in form_grams:
+                self._index[(form, gram)].append(track_id)
+        return track_id
+
+    def search(self, query: str, top_k: int = 5, cutoff: float = 0.3,
+               keep: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """返回 [(曲名, 得分)]，按得分从高到低；keep 给出时只返回 keep(曲名) 为真的曲目"""
+        key = normalize(query)
+        if not key:
+            return []
+
+        # 中文查询先按字面匹配，没有结果再按拼音音节匹配（同音字/错别字）；
+        # 拉丁字母查询同时匹配曲名、首字母，能切分成拼音时再匹配音节
+        if _CJK_RE.search(key):
+            best = self._score({_NAME: key}, cutoff)
+            if len(key) < 2:
+                self._merge(best, self._scan({_NAME: key}, cutoff))
+            if not best:
+                syllables, _ = _pinyin_forms(key)
+                if syllables:
+                    best = self._score({_SYLLABLES: " ".join(syllables)}, cutoff)
+        else:
+            forms = {_NAME: key, _INITIALS: key}
+            syllables = self._split_syllables(key)
+            if syllables:
+                forms[_SYLLABLES] = " ".join(syllables)
+            best = self._score(forms, cutoff)
+            if len(key) < 3:
+                self._merge(best, self._scan({_NAME: key, _INITIALS: key}, cutoff))
+
+        candidates = ((-score, track_id) for track_id, score in best.items()
+                      if keep is None or keep(self.names[track_id]))
+        ranked = heapq.nsmallest(top_k, candidates)
+        return [(self.names[track_id], -neg_score) for neg_score, track_id in ranked]
+
+    def _split_syllables(self, text: str) -> List[str]:
+        """按曲库已知音节做最长匹配切分，无法完整切分时返回空列表"""
+        if not self._known_syllables or not text.isalpha():
+            return []
+        syllables = []
+        pos = 0
+        while pos < len(text):
+            for size in range(min(6, len(text) - pos), 0, -1):
+                if text[pos:pos + size] in self._known_syllables:
+                    syllables.append(text[pos:pos + size])
+                    pos += size
+                    break
+            else:
+                return []
+        return syllables
+
+    @staticmethod
+    def _bonus(text: str, target: str) -> float:
+        """完全/前缀/子串命中的加分"""
+        if text == target:
+            return 2.0
+        if target.startswith(text):
+            return 1.0
+        if text in target:
+            return 0.5
+        return 0.0
+
+    @staticmethod
+    def _merge(best: Dict[int, float], extra: Dict[int, float]):
+        for track_id, score in extra.items():
+            if score > best.get(track_id, 0.0):
+                best[track_id] = score
+
+    def _scan(self, forms: Dict[str, str], cutoff: float) -> Dict[int, float]:
+        """短查询的子串扫描（逐个曲目比较，只用于比 gram 还短的查询）"""
+        best: Dict[int, float] = {}
+        for form, text in forms.items():
+            for track_id, variants in enumerate(self._variants):
+                target = variants.get(form)
+                if not target or text not in target:
+                    continue
+                if form == _INITIALS and not target.startswith(text):
+                    continue  # 首字母只认开头（单个字母几乎出现在任何首字母串中）
+                score = len(text) / len(target) + self._bonus(text, target)
+                if score >= cutoff and score > best.get(track_id, 0.0):
+                    best[track_id] = score
+        return best
+
+    def _score(self, forms: Dict[str, str], cutoff: float) -> Dict[int, float]:
+        """对与查询共享gram的候选打分，返回 {曲目编号: 最高得分}"""
+        best: Dict[int, float] = {}
+        for form, text in forms.items():
+            query_grams = _GRAMS[form](text)
+            overlap = Counter(chain.from_iterable(
+                self._index.get((form, gram), ()) for gram in query_grams
+            ))
+
+            query_size = len(query_grams)
+            for track_id, shared in overlap.items():
+                target = self._variants[track_id][form]
+                score = 2.0 * shared / (query_size + self._gram_sizes[track_id][form])
+                score += self._bonus(text, target)
+                if score >= cutoff and score > best.get(track_id, 0.0):
+                    best[track_id] = score
+
+        return best
+
+    def best(self, query: str, cutoff: float = 0.3) -> Optional[str]:
+        """最佳匹配曲名，没有则返回None"""
+        results = self.search(query, top_k=1, cutoff=cutoff)
+        return results[0][0] if results else None
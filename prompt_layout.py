@@ -0,0 +1,143 @@
+import copy
+import json
+from typing import List, Optional
+
+from context_window import ContextWindow, estimate_tokens
+from tool_router import ToolRouter
+
+
+# 模型常驻时长：对话间隙不卸载，避免重新加载权重与丢失KV缓存
+KEEP_ALIVE = "30m"
+# 上下文长度：每次请求都显式传同一值（值变化会导致模型重新加载）
+NUM_CTX = 8192
+# 单条工具结果写入上下文的最大字符数
+TOOL_RESULT_CHARS = 200
+
+
+def freeze_tools(tools: List[dict]) -> List[dict]:
+    """生成字节稳定的工具定义副本
+
+    深拷贝并按键排序，之后 ToolManager 中的定义被修改也不影响已发送的前缀；
+    同一组工具每次序列化结果完全一致。
+    """
+    return json.loads(json.dumps(copy.deepcopy(tools), ensure_ascii=False, sort_keys=True))
+
+
+def tool_result_messages(tool_executions: List[dict]) -> List[dict]:
+    """把工具执行结果转成 role: tool 消息（按调用顺序，紧跟在助手消息之后）"""
+    messages = []
+    for execution in tool_executions or []:
+        func_name = execution.get("function_name", "unknown")
+        result = execution.get("result")
+        if execution.get("success", False):
+            content = str(result) if result is not None else "执行成功"
+        else:
+            content = execution.get("message") or "执行失败"
+        if len(content) > TOOL_RESULT_CHARS:
+            content = content[:TOOL_RESULT_CHARS] + "…"
+        messages.append({"role": "tool", "content": content, "tool_name": func_name})
+    return messages
+
+
+class PromptAssembler:
+    """组装每轮的模型请求，保持提示词前缀稳定以复用 Ollama 的KV缓存
+
+    请求由三部分组成：系统提示词 + 工具定义（固定前缀，启动后不再变化）、
+    上下文窗口中的历史（两次压缩之间只追加）、本轮用户输入。
+    工具结果以 role: tool 消息追加在对应助手消息之后，不再在历史中间插入 system 消息。
+    每次请求显式设置 keep_alive 与 num_ctx，让模型常驻且上下文长度不变。
+    配置了工具路由时只发送与本轮输入相关的工具（路由器尽量沿用上一轮的集合）。
+    """
+
+    def __init__(self, context: ContextWindow, tools: List[dict], model: str,
+                 keep_alive: str = KEEP_ALIVE, num_ctx: int = NUM_CTX, router: Optional[ToolRouter] = None):
+        """
+        Args:
+            context: 对话上下文窗口（持有固定的系统提示词）
+            tools: 工具定义，组装时冻结
+            model: 模型名
+            keep_alive: 模型常驻时长
+            num_ctx: 上下文长度（token）
+            router: 工具路由，None表示每轮发送全部工具
+        """
+        self.context = context
+        self.tools = freeze_tools(tools)
+        self.router = router
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+
+        self.tools_tokens = estimate_tokens(json.dumps(self.tools, ensure_ascii=False, sort_keys=True))
+        self._last_messages: List[str] = []  # 上次请求各消息的序列化结果
+        self._last_tools: Optional[List[dict]] = None
+        self.requests = 0
+        self.prefix_breaks = 0  # 已发送的消息被改动（压缩）的次数
+        self.prompt_tokens = 0  # 已发送提示词的估算token数（有模型统计的轮次）
+        self.evaluated_tokens = 0  # 模型报告实际重新计算的token数
+        self.last_reused_messages = 0
+
+    def request(self, **kwargs) -> dict:
+        """本轮 ollama.chat 的参数"""
+        messages = self.context.messages()
+        tools = self.tools
+        if self.router is not None:
+            user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+            tools = self.router.select(user_text)
+
+        serialized = [json.dumps(message, ensure_ascii=False, sort_keys=True, default=str) for message in messages]
+        reused = 0
+        if self._last_tools is None or tools == self._last_tools:
+            for previous, current in zip(self._last_messages, serialized):
+                if previous != current:
+                    break
+                reused += 1
+        if self._last_tools is not None and reused < len(self._last_messages):
+            self.prefix_breaks += 1
+        self._last_tools = tools
+        self.last_reused_messages = reused
+        self._last_messages = serialized
+        self.requests += 1
+
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "tools": tools,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx},
+        }
+        request.update(kwargs)
+        return request
+
+    def record_response(self, response) -> Optional[int]:
+        """记录模型返回的提示词计算量（最终响应块中的 prompt_eval_count），返回本轮重新计算的token数
+
+        Ollama 命中前缀缓存时 prompt_eval_count 只包含新增部分。
+        """
+        evaluated = response.get("prompt_eval_count") if response is not None else None
+        if evaluated is None:
+            return None
+        self.evaluated_tokens += evaluated
+        self.prompt_tokens += self.context.last_prompt_tokens + estimate_tokens(
+            json.dumps(self._last_tools or [], ensure_ascii=False, sort_keys=True))
+        return evaluated
+
+    def add_turn_result(self, assistant_message, tool_executions: List[dict]):
+        """把本轮助手消息与工具结果追加到上下文"""
+        self.context.add(assistant_message)
+        for message in tool_result_messages(tool_executions):
+            self.context.add(message)
+        if self.router is not None:
+            self.router.record_used(execution.get("function_name") for execution in tool_executions or [])
+
+    def stats(self) -> dict:
+        stats = {
+            "requests": self.requests,
+            "prefix_breaks": self.prefix_breaks,
+            "tools_tokens": self.tools_tokens,
+            "prompt_tokens_est": self.prompt_tokens,
+            "evaluated_tokens": self.evaluated_tokens,
+            "reuse_ratio": max(0.0, 1 - self.evaluated_tokens / self.prompt_tokens) if self.prompt_tokens else None,
+        }
+        if self.router is not None:
+            stats["router"] = self.router.stats()
+        return stats
@@ -0,0 +1,71 @@
+import pytest
+
+from text_segmenter import AdaptiveSegmenter, speech_units, split_clauses
+
+
+MIXED_TEXTS = [
+    "好的，舰长！",
+    "Hello traveler, nice to meet you! 今天天气真不错，我们一起出去走走吧。",
+    "The price is 3.14 dollars. 一共1,000件，折后价是2,499.50元。",
+    "  开头和结尾有空白。Trailing spaces here.  ",
+    "第一行。\n\n第二行，带 English words 和数字 42。\n",
+    "姐姐说今天要一起去看星星，舰长也一起来吧？" * 6,
+    "No punctuation at all just a long run of English words " * 8,
+    "没有标点的一长串中文文字" * 20,
+]
+
+
+def test_split_clauses_keeps_decimals_and_thousands_separators():
+    assert split_clauses("价格是3.14元，共1,000件。") == [("价格是3.14元，", False), ("共1,000件。", True)]
+
+
+def test_split_clauses_english_punctuation():
+    assert split_clauses("Hello, world. How are you? Fine!") == [
+        ("Hello,", False), ("world.", True), ("How are you?", True), ("Fine!", True)]
+
+
+def test_split_clauses_period_without_following_space_does_not_split():
+    assert split_clauses("v2.0 is out. e.g.this") == [("v2.0 is out.", True), ("e.g.this", True)]
+
+
+def test_split_clauses_mixed_cjk_and_english():
+    assert split_clauses("今天天气不错，let's go!好的。") == [
+        ("今天天气不错，", False), ("let's go!", True), ("好的。", True)]
+
+
+@pytest.mark.parametrize("text", MIXED_TEXTS)
+def test_segment_is_lossless(text):
+    segments = AdaptiveSegmenter().segment(text)
+    assert "".join(segments) == text
+    assert all(segment.strip() for segment in segments)
+
+
+def test_segment_blank_text():
+    assert AdaptiveSegmenter().segment("  \n ") == []
+
+
+def test_first_chunk_short_then_bounded_growth():
+    segmenter = AdaptiveSegmenter()
+    text = "知识就像一棵大树，根扎得越深，枝叶就越茂盛。Hello traveler, nice to meet you! " * 10
+    segments = segmenter.segment(text)
+    units = [speech_units(segment) for segment in segments]
+    targets = segmenter.chunk_targets(len(segments))
+
+    assert len(segments) > 2
+    assert units[0] <= segmenter.max_first_units * 1.5
+    assert units[0] < max(units[1:])
+    for previous, current in zip(targets, targets[1:]):
+        assert current <= previous * segmenter.growth + 1e-9
+        assert current <= segmenter.max_units
+    # 单个短句最多超出目标50%，过短的尾巴可能并入最后一段
+    for index, size in enumerate(units):
+        allowance = segmenter.min_first_units if index == len(units) - 1 else 0
+        assert size <= targets[index] * 1.5 + allowance
+
+
+def test_slow_service_keeps_first_chunk_short():
+    segmenter = AdaptiveSegmenter()
+    for _ in range(20):
+        segmenter.observe("这是一段十个字的文本。", 1.0, 3.0, 2.2)
+    first = segmenter.segment("这个问题有点难，让我想一想再回答你。" * 5)[0]
+    assert speech_units(first) <= segmenter.min_first_units * 1.5
@@ -0,0 +1,284 @@
+import re
+import threading
+from typing import List, Optional, Tuple
+
+
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+# 句末标点（优先断开）与句中停顿标点
+_STRONG_PUNCT = set("。！？；…!?;\n")
+_WEAK_PUNCT = set("，、：,:")
+# 拉丁字母约为中文字符朗读时长的三分之一
+_LATIN_UNIT = 0.35
+
+
+def speech_units(text: str) -> float:
+    """文本的朗读量：中文每字计1，其余可见字符按约1/3计"""
+    units = 0.0
+    for char in text:
+        if _CJK_RE.match(char):
+            units += 1.0
+        elif not char.isspace():
+            units += _LATIN_UNIT
+    return units
+
+
+def _clause_spans(text: str) -> List[Tuple[str, bool]]:
+    """按标点切成短句，返回 [(短句, 是否句末)]
+
+    标点及其后的空白留在句尾，开头的空白并入第一句，各短句依次拼接即为原文。
+    小数点、千分位逗号（两侧都是数字）不切分。
+    """
+    clauses = []
+    start = 0
+    length = len(text)
+    i = 0
+    while i < length:
+        char = text[i]
+        i += 1
+        if char in ".,":
+            between_digits = 1 < i < length and text[i - 2].isdigit() and text[i].isdigit()
+            if between_digits or (char == "." and i < length and not text[i].isspace()):
+                continue
+        if char in _STRONG_PUNCT or char == "." or char in _WEAK_PUNCT:
+            while i < length and text[i].isspace():
+                i += 1
+            piece = text[start:i]
+            if not piece.strip():
+                continue  # 只有空白（如开头的换行），并入下一句
+            clauses.append((piece, char in _STRONG_PUNCT or char == "."))
+            start = i
+
+    tail = text[start:]
+    if tail.strip() or not clauses:
+        if tail:
+            clauses.append((tail, True))
+    else:
+        clauses[-1] = (clauses[-1][0] + tail, clauses[-1][1])
+    return clauses
+
+
+def split_clauses(text: str) -> List[Tuple[str, bool]]:
+    """按标点切成短句（标点保留在句尾，去掉两端空白），返回 [(短句, 是否句末)]
+
+    小数点、千分位逗号（两侧都是数字）不切分。
+    """
+    return [(clause.strip(), strong) for clause, strong in _clause_spans(text) if clause.strip()]
+
+
+def _split_long(clause: str, target: float) -> List[str]:
+    """把超长短句按目标朗读量硬切（中文任意字间，英文只在空格处），各片依次拼接即为原句"""
+    pieces = []
+    current = ""
+    units = 0.0
+    for token in re.findall(r'[A-Za-z0-9\'\-]+\s*|\s+|.', clause, re.S):
+        token_units = speech_units(token)
+        if current.strip() and units + token_units > target:
+            pieces.append(current)
+            current, units = "", 0.0
+        current += token
+        units += token_units
+    if current.strip() or not pieces:
+        pieces.append(current)
+    else:
+        pieces[-1] += current
+    return pieces
+
+
+class _LinearFit:
+    """带指数遗忘的在线一元线性回归：y ≈ intercept + slope * x"""
+
+    def __init__(self, intercept: float, slope: float, decay: float = 0.95, prior_weight: float = 2.0):
+        """
+        Args:
+            intercept / slope: 先验值（样本不足时使用）
+            decay: 每个新样本使旧样本权重乘以该系数
+            prior_weight: 先验相当于多少个样本
+        """
+        self.decay = decay
+        # 以两个虚拟样本（x=5, x=40）表示先验，避免少量样本时斜率失真
+        self._w = self._sx = self._sy = self._sxx = self._sxy = 0.0
+        for x in (5.0, 40.0):
+            self._add(x, intercept + slope * x, prior_weight / 2)
+
+    def _add(self, x: float, y: float, weight: float = 1.0):
+        self._w += weight
+        self._sx += weight * x
+        self._sy += weight * y
+        self._sxx += weight * x * x
+        self._sxy += weight * x * y
+
+    def observe(self, x: float, y: float):
+        for name in ("_w", "_sx", "_sy", "_sxx", "_sxy"):
+            setattr(self, name, getattr(self, name) * self.decay)
+        self._add(x, y)
+
+    def params(self) -> Tuple[float, float]:
+        variance = self._w * self._sxx - self._sx * self._sx
+        if variance <= 1e-9:
+            return self._sy / self._w, 0.0
+        slope = (self._w * self._sxy - self._sx * self._sy) / variance
+        slope = max(0.0, slope)
+        intercept = max(0.0, (self._sy - slope * self._sx) / self._w)
+        return intercept, slope
+
+    def predict(self, x: float) -> float:
+        intercept, slope = self.params()
+        return intercept + slope * x
+
+
+class AdaptiveSegmenter:
+    """面向首音延迟的自适应文本分段
+
+    首段刻意取短，让第一声尽快出来；之后各段按几何级数增长，减少请求次数与段间开销。
+    段长上限由实测的服务延迟与实时率（RTF）决定：下一段的合成时间不超过上一段的
+    播放时长，保证后续片段不断流。测量值来自每次合成的首块耗时、总耗时与音频时长，
+    用带遗忘的线性回归在线拟合（固定开销 + 每字耗时）。
+    """
+
+    def __init__(self, target_first_latency: float = 0.6, min_first_units: float = 4,
+                 max_first_units: float = 24, growth: float = 2.0, max_units: float = 120):
+        """
+        Args:
+            target_first_latency: 首段期望的首音延迟（秒）
+            min_first_units / max_first_units: 首段朗读量范围（中文字数）
+            growth: 相邻片段的最大增长倍数
+            max_units: 单段朗读量上限
+        """
+        self.target_first_latency = target_first_latency
+        self.min_first_units = min_first_units
+        self.max_first_units = max_first_units
+        self.growth = growth
+        self.max_units = max_units
+
+        self._lock = threading.Lock()
+        # 先验：约0.3s固定开销，每字30ms；首块（流式）与总耗时先验相同；每字约0.22秒音频
+        self._first_audio = _LinearFit(0.3, 0.03)
+        self._synthesis = _LinearFit(0.3, 0.03)
+        self._audio = _LinearFit(0.0, 0.22)
+        self.observations = 0
+
+    def observe(self, text: str, first_audio_s: Optional[float], synthesis_s: float,
+                audio_s: Optional[float] = None):
+        """记录一次合成的实测耗时，用于调整后续分段"""
+        units = speech_units(text)
+        if units <= 0:
+            return
+        with self._lock:
+            self._synthesis.observe(units, synthesis_s)
+            self._first_audio.observe(units, first_audio_s if first_audio_s is not None else synthesis_s)
+            if audio_s:
+                self._audio.observe(units, audio_s)
+            self.observations += 1
+
+    def profile(self) -> dict:
+        """当前拟合的服务特性"""
+        with self._lock:
+            first_overhead, first_per_unit = self._first_audio.params()
+            overhead, per_unit = self._synthesis.params()
+            _, audio_per_unit = self._audio.params()
+        return {
+            "first_audio_overhead_s": first_overhead,
+            "first_audio_per_unit_s": first_per_unit,
+            "synthesis_overhead_s": overhead,
+            "synthesis_per_unit_s": per_unit,
+            "audio_per_unit_s": audio_per_unit,
+            "rtf": per_unit / audio_per_unit if audio_per_unit else None,
+            "observations": self.observations,
+        }
+
+    def chunk_targets(self, count: int) -> List[float]:
+        """前 count 段的目标朗读量"""
+        profile = self.profile()
+
+        # 首段：满足首音延迟目标的最大长度
+        per_unit = profile["first_audio_per_unit_s"]
+        if per_unit > 0:
+            first = (self.target_first_latency - profile["first_audio_overhead_s"]) / per_unit
+        else:
+            first = self.max_first_units
+        first = max(self.min_first_units, min(self.max_first_units, first))
+
+        targets = [first]
+        overhead = profile["synthesis_overhead_s"]
+        per_unit = profile["synthesis_per_unit_s"]
+        audio_per_unit = profile["audio_per_unit_s"]
+        # 按时间线推算：合成按顺序进行（最坏情况，调度器被其他角色占满），播放紧随其后
+        synthesized = overhead + per_unit * first
+        play_end = profile["first_audio_overhead_s"] + profile["first_audio_per_unit_s"] * first + audio_per_unit * first
+        while len(targets) < count:
+            previous = targets[-1]
+            size = previous * self.growth
+            if per_unit > 0:
+                # 不断流：下一段在已排播音频放完前合成完毕
+                fit = (play_end - synthesized - overhead) / per_unit
+                if fit >= previous:
+                    size = min(size, fit)
+                # 放不下时（服务慢于实时）仍按倍数增长，用更长的段摊薄固定开销
+            size = min(self.max_units, size)
+            targets.append(size)
+            synthesized += overhead + per_unit * size
+            play_end = max(play_end, synthesized) + audio_per_unit * size
+        return targets
+
+    def segment(self, text: str) -> List[str]:
+        """把文本切分为朗读片段（原文的连续切片，依次拼接即为原文）"""
+        if not text.strip():
+            return []
+
+        clauses = _clause_spans(text)
+        targets = self.chunk_targets(max(1, len(clauses) * 2))
+        segments = []
+        current, current_units, current_ends = "", 0.0, False
+
+        def target():
+            return targets[min(len(segments), len(targets) - 1)]
+
+        queue = list(clauses)
+        while queue:
+            clause, strong = queue.pop(0)
+            units = speech_units(clause)
+
+            # 单个短句远超当前目标：硬切，前一块单独成段
+            if not current and units > target() * 1.5:
+                pieces = _split_long(clause, target())
+                queue[:0] = [(piece, strong and i == len(pieces) - 1) for i, piece in enumerate(pieces)]
+                clause, strong = queue.pop(0)
+                units = speech_units(clause)
+
+            if current and current_units + units > target() * 1.2:
+                segments.append(current)
+                current, current_units = "", 0.0
+                queue.insert(0, (clause, strong))
+                continue
+
+            current += clause
+            current_units += units
+            current_ends = strong
+            # 达到目标且在句末（或已明显超过目标）时断开
+            if current_units >= target() and (current_ends or current_units >= target() * 1.2):
+                segments.append(current)
+                current, current_units = "", 0.0
+
+        if current:
+            # 过短的尾巴并入上一段
+            if segments and current_units < self.min_first_units and \
+                    speech_units(segments[-1]) + current_units <= self.max_units:
+                segments[-1] += current
+            else:
+                segments.append(current)
+
+        return segments
+
+
+_segmenter = None
+_segmenter_lock = threading.Lock()
+
+
+def get_text_segmenter() -> AdaptiveSegmenter:
+    """获取共享的分段器（所有角色共用一份服务延迟测量）"""
+    global _segmenter
+    if _segmenter is None:
+        with _segmenter_lock:
+            if _segmenter is None:
+                _segmenter = AdaptiveSegmenter()
+    return _segmenter
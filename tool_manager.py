@@ -18,6 +18,8 @@ class ToolManager:
         self.tools_file = tools_file
         self.functions_file = functions_file
         self.tools = self._load_tools()
+        self._validators = None
+        self._build_validator_index()
 
         if functions_module is None:
             try:
@@ -41,6 +43,67 @@ class ToolManager:
             print(f"JSON解析错误: {e}")
             return []
 
+    def reload_tools(self) -> List[Dict]:
+        """重新从JSON文件加载工具定义并重建参数校验器索引"""
+        self.tools = self._load_tools()
+        self._build_validator_index()
+        return self.get_tools()
+
+    def _build_validator_index(self) -> Dict[str, Any]:
+        """为每个工具预编译JSON Schema校验器，建立 函数名->校验器 索引"""
+        try:
+            from jsonschema.validators import validator_for
+        except ImportError:
+            print("警告: 未安装jsonschema，参数校验不可用")
+            self._validators = {}
+            return self._validators
+
+        validators = {}
+        for tool in self.tools:
+            function = tool.get('function', {})
+            name = function.get('name')
+            if not name:
+                continue
+            schema = function.get('parameters') or {"type": "object"}
+            try:
+                validator_cls = validator_for(schema)
+                validator_cls.check_schema(schema)
+                validators[name] = validator_cls(schema)
+            except Exception as e:
+                print(f"警告: 工具 {name} 的参数Schema无效: {e}")
+
+        self._validators = validators
+        return validators
+
+    def _invalidate_validators(self):
+        """工具定义变化后使校验器索引失效，下次校验时重建"""
+        self._validators = None
+
+    def get_validator(self, function_name: str) -> Optional[Any]:
+        """获取预编译的参数校验器"""
+        if self._validators is None:
+            self._build_validator_index()
+        return self._validators.get(function_name)
+
+    def validate_params(self, function_name: str, params: Dict) -> tuple:
+        """使用预编译校验器验证工具参数，返回 (是否通过, 说明)"""
+        validator = self.get_validator(function_name)
+        if validator is None:
+            return False, "未找到对应的工具定义"
+
+        try:
+            from jsonschema import ValidationError
+        except ImportError:
+            return False, "参数验证异常: 未安装jsonschema"
+
+        try:
+            validator.validate(params)
+            return True, "参数格式正确"
+        except ValidationError as e:
+            return False, f"参数验证错误: {str(e)[:100]}..."
+        except Exception as e:
+            return False, f"参数验证异常: {str(e)[:100]}..."
+
     def _save_tools(self) -> bool:
         """保存工具定义到JSON文件"""
         try:
@@ -212,6 +275,7 @@ function_router = {
 
         # 添加到工具配置
         self.tools.append(tool)
+        self._invalidate_validators()
 
         if save:
             success = self._save_tools()
@@ -238,6 +302,7 @@ function_router = {
         # 从JSON配置中删除
         original_length = len(self.tools)
         self.tools = [tool for tool in self.tools if tool['function']['name'] != function_name]
+        self._invalidate_validators()
 
         if len(self.tools) == original_length:
             print(f"警告: 未找到工具 {function_name}")
@@ -279,6 +344,7 @@ function_router = {
             if tool['function']['name'] == function_name:
                 self.tools[i] = new_tool
                 break
+        self._invalidate_validators()
 
         # 如果提供了新的函数代码，更新函数
         if new_function_code:
@@ -0,0 +1,145 @@
+import json
+import math
+import re
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional
+
+from context_window import estimate_tokens
+
+
+# 工具描述中不会出现的口语说法，按描述里的关键词补充
+KEYWORD_HINTS = {
+    "音量": ["大声", "小声", "声音", "静音", "吵", "听不清", "volume"],
+    "音乐": ["歌", "曲", "放首", "来首", "听听", "旋律", "music", "song"],
+    "停止": ["停", "别放", "关掉", "安静", "闭嘴", "stop"],
+    "角色": ["说话", "讲", "聊", "叫", "来", "陪", "唱"],
+    "TTS": ["语音", "别说", "念"],
+}
+
+_WORD_RE = re.compile(r'[A-Za-z]+|\d+')
+_CJK_RUN_RE = re.compile(r'[㐀-鿿豈-﫿]+')
+
+
+def keyword_terms(text: str) -> List[str]:
+    """切分检索词：中文取单字与相邻二字组，英文取小写单词"""
+    terms = [word.lower() for word in _WORD_RE.findall(text)]
+    for run in _CJK_RUN_RE.findall(text):
+        terms.extend(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _tool_text(tool: dict) -> str:
+    """工具名、描述与参数描述拼成的检索文本"""
+    function = tool.get("function", {})
+    parts = [function.get("name", "").replace("_", " "), function.get("description", "")]
+    for name, schema in (function.get("parameters", {}).get("properties") or {}).items():
+        parts.append(name)
+        parts.append(schema.get("description", ""))
+    return " ".join(parts)
+
+
+def _tool_tokens(tools: List[dict]) -> int:
+    return estimate_tokens(json.dumps(tools, ensure_ascii=False, sort_keys=True))
+
+
+class ToolRouter:
+    """按用户输入挑选相关工具，每轮只把少量工具定义送入模型
+
+    用工具名、描述与参数描述建立关键词索引（TF-IDF），口语说法由 KEYWORD_HINTS 补充，
+    带 character 参数的工具额外以角色名与别名为关键词。每轮发送：
+    - 常驻工具（always）
+    - 最近几轮调用过的工具（便于“再来一次”“换一首”之类的追问）
+    - 得分最高的若干工具
+    工具集合会影响提示词前缀（模板把工具定义放在系统提示词中），因此当前集合已覆盖
+    本轮相关工具时沿用不变，只在缺少相关工具时才重新选择。
+    """
+
+    def __init__(self, tools: List[dict], top_k: int = 3, always: Iterable[str] = (),
+                 min_score: float = 1.0, recent_turns: int = 2, aliases: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            tools: 全部工具定义
+            top_k: 每轮按得分选择的工具数
+            always: 每轮都发送的工具名
+            min_score: 视为相关的最低得分
+            recent_turns: 最近几轮调用过的工具继续保留
+            aliases: 额外关键词 {工具名: [关键词]}（如角色名）
+        """
+        self.tools = list(tools)
+        self.top_k = top_k
+        self.always = set(always)
+        self.min_score = min_score
+        self.recent = deque(maxlen=recent_turns)
+        self._names = [tool["function"]["name"] for tool in self.tools]
+
+        self._terms: Dict[str, Counter] = {}
+        for tool in self.tools:
+            text = _tool_text(tool)
+            for key, hints in KEYWORD_HINTS.items():
+                if key in text:
+                    text += " " + " ".join(hints)
+            text += " " + " ".join((aliases or {}).get(tool["function"]["name"], []))
+            self._terms[tool["function"]["name"]] = Counter(keyword_terms(text))
+
+        document_freq = Counter()
+        for terms in self._terms.values():
+            document_freq.update(set(terms))
+        count = len(self.tools)
+        self._idf = {term: math.log(1 + count / freq) for term, freq in document_freq.items()}
+
+        self.active: Optional[List[str]] = None  # 当前发送的工具名（按原始顺序）
+        self.full_tokens = _tool_tokens(self.tools)
+        self.turns = 0
+        self.switches = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """各工具与输入的相关度"""
+        query = Counter(keyword_terms(text))
+        result = {}
+        for name, terms in self._terms.items():
+            score = 0.0
+            for term, freq in query.items():
+                if term in terms:
+                    # 二字组比单字更可信
+                    score += self._idf[term] * (2.0 if len(term) > 1 else 0.5) * min(freq, 2)
+            result[name] = score
+        return result
+
+    def record_used(self, names: Iterable[str]):
+        """记录本轮实际调用的工具"""
+        self.recent.append(set(names))
+
+    def select(self, text: str) -> List[dict]:
+        """本轮发送的工具定义（保持 tools.json 中的顺序）"""
+        scores = self.scores(text)
+        relevant = {name for name, score in scores.items() if score >= self.min_score}
+        ranked = sorted(relevant, key=lambda name: scores[name], reverse=True)
+        wanted = set(self.always).union(*self.recent) if self.recent else set(self.always)
+
+        if self.active is None or not (relevant | wanted) <= set(self.active):
+            chosen = wanted | set(ranked[:self.top_k])
+            active = [name for name in self._names if name in chosen]
+            if active != self.active:
+                self.switches += self.active is not None
+                self.active = active
+
+        selected = [tool for tool in self.tools if tool["function"]["name"] in self.active]
+        sent = _tool_tokens(selected)
+        self.turns += 1
+        self.tokens_sent += sent
+        self.tokens_saved += self.full_tokens - sent
+        return selected
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "active": list(self.active or []),
+            "switches": self.switches,
+            "full_tokens": self.full_tokens,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "saved_ratio": self.tokens_saved / (self.full_tokens * self.turns) if self.turns else 0.0,
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+from tts_client import get_tts_client
+from tts_scheduler import get_tts_scheduler
+from tts_stream import aiter_wav_blocks, audio_complete, join_wav_blocks, open_decoder, wav_duration
+
+
+class AsyncTTSClient:
+    """index-TTS 异步HTTP客户端（httpx），供 asyncio 会话使用
+
+    与同步客户端指向同一服务。每个请求先向共享的 TTSScheduler 申请名额，
+    与同步路径一起计入全局并发上限、首段优先，预合成据此让路；等待名额时不阻塞事件循环。
+    """
+
+    def __init__(self, url: str, max_concurrency: int = 4, connect_timeout: float = 3.0,
+                 read_timeout: float = 30.0):
+        """
+        Args:
+            url: TTS服务地址
+            max_concurrency: 连接池大小（请求并发由共享的 TTSScheduler 限制）
+            connect_timeout: 建连超时（秒）
+            read_timeout: 读取超时（秒）
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    @asynccontextmanager
+    async def stream(self, text: str, audio_paths: List[str], key: str = "default", first: bool = False):
+        """提交合成请求，产出流式响应（由调用方检查状态码并逐块读取）
+
+        key / first 同 TTSScheduler.submit（角色名 / 是否为一句话的首段）。
+        """
+        slot = get_tts_scheduler().acquire(key=key, first=first)
+        try:
+            await asyncio.wrap_future(slot.granted)
+            async with self._client.stream("POST", self.url, json={"text": text, "audio_paths": audio_paths}) as response:
+                yield response
+        finally:
+            slot.release()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+# httpx.AsyncClient 绑定创建它的事件循环，每个事件循环一个客户端
+_async_clients = weakref.WeakKeyDictionary()
+_retired_clients = weakref.WeakKeyDictionary()  # 服务地址更换后停用的客户端，随事件循环一起关闭
+
+
+def get_async_tts_client() -> AsyncTTSClient:
+    """获取当前事件循环共享的异步TTS客户端（配置跟随同步客户端；只在事件循环线程中调用）
+
+    事件循环结束前应调用 close_async_tts_client() 归还连接。
+    """
+    loop = asyncio.get_running_loop()
+    sync_client = get_tts_client()
+    client = _async_clients.get(loop)
+    if client is None or client.url != sync_client.url:
+        if client is not None:
+            # 服务地址已更换：旧客户端上可能还有进行中的请求，不立即关闭
+            _retired_clients.setdefault(loop, []).append(client)
+        client = AsyncTTSClient(sync_client.url, max_concurrency=sync_client.pool_size,
+                                connect_timeout=sync_client.connect_timeout,
+                                read_timeout=sync_client.read_timeout)
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_tts_client():
+    """关闭当前事件循环的异步TTS客户端（服务或命令行退出时调用，可重复调用）"""
+    loop = asyncio.get_running_loop()
+    clients = _retired_clients.pop(loop, [])
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        clients.append(client)
+    for client in clients:
+        await client.aclose()
+
+
+AudioSink = Callable[[str, int, bytes], Awaitable[None]]
+
+
+async def speak(character: str, text: str, sink: AudioSink, lookahead: int = 1) -> dict:
+    """异步合成一段台词，按片段顺序把音频块交给 sink(角色, 片段编号, WAV字节)
+
+    与 advanced_character_tts 相同的分段、缓存与延迟测量，但不在本机播放，
+    适合把音频流式发回客户端。当前片段边下载边送出，同时最多预先合成 lookahead 个后续片段。
+
+    Returns:
+        {"success", "character", "segments", "first_audio_time", "cached"}
+    """
+    from audio_cache import get_audio_cache
+    from text_segmenter import get_text_segmenter
+    from voice_registry import get_voice_registry
+
+    voice = get_voice_registry().resolve(character)
+    if voice is None:
+        return {"success": False, "character": character, "error": f"{character}不在场"}
+
+    cache = get_audio_cache()
+    segmenter = get_text_segmenter()
+    start = time.perf_counter()
+
+    # 缓存读写可能落到磁盘，放到线程中执行，不阻塞事件循环上的其他会话
+    whole = await asyncio.to_thread(cache.get, voice.name, text, voice.content_hash)
+    if whole is not None:
+        await sink(voice.name, 0, whole)
+        return {"success": True, "character": voice.name, "segments": 1,
+                "first_audio_time": time.perf_counter() - start, "cached": True}
+
+    segments = segmenter.segment(text)
+    queues = [asyncio.Queue() for _ in segments]
+    results: List[Optional[List[bytes]]] = [None] * len(segments)
+    complete = [False] * len(segments)  # 片段音频是否完整（被截断的不缓存）
+    client = get_async_tts_client()
+
+    async def produce(index: int, segment_text: str):
+        queue = queues[index]
+        try:
+            cached = await asyncio.to_thread(cache.get, voice.name, segment_text, voice.content_hash)
+            if cached is not None:
+                results[index] = [cached]
+                complete[index] = True
+                await queue.put(cached)
+                return
+
+            begin = time.perf_counter()
+            first_audio = None
+            blocks = []
+            async with client.stream(segment_text, [voice.path], key=voice.name, first=(index == 0)) as response:
+                if response.status_code != 200:
+                    print(f"❌ 段{index}合成失败: HTTP {response.status_code}")
+                    return
+                decoder = open_decoder(response)
+                async for block in aiter_wav_blocks(response, decoder=decoder):
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - begin
+                    blocks.append(block)
+                    await queue.put(block)
+            if blocks:
+                results[index] = blocks
+            if blocks and audio_complete(decoder, segment_text):
+                complete[index] = True
+                await asyncio.to_thread(cache.put, voice.name, segment_text, join_wav_blocks(blocks),
+                                        voice.content_hash)
+                segmenter.observe(segment_text, first_audio, time.perf_counter() - begin,
+                                  sum(wav_duration(b) for b in blocks))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ 段{index}合成异常: {str(e)[:80]}")
+        finally:
+            queue.put_nowait(None)
+
+    tasks = []
+    first_audio_time = None
+    try:
+        for index in range(len(segments)):
+            while len(tasks) < min(len(segments), index + 1 + lookahead):
+                tasks.append(asyncio.ensure_future(produce(len(tasks), segments[len(tasks)])))
+            while True:
+                block = await queues[index].get()
+                if block is None:
+                    break
+                if first_audio_time is None:
+                    first_audio_time = time.perf_counter() - start
+                await sink(voice.name, index, block)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    success = all(blocks for blocks in results)
+    if all(complete) and len(segments) > 1:
+        await asyncio.to_thread(cache.put, voice.name, text, join_wav_blocks([b for blocks in results for b in blocks]),
+                                voice.content_hash)
+    return {"success": success, "character": voice.name, "segments": len(segments),
+            "first_audio_time": first_audio_time, "cached": False}
@@ -0,0 +1,97 @@
+import os
+import threading
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# index-TTS 服务地址，可通过环境变量覆盖（如指向本地模拟服务）
+TTS_URL = os.environ.get("INDEX_TTS_URL", "http://127.0.0.1:11996/tts_url")
+
+
+class TTSClient:
+    """index-TTS HTTP客户端
+
+    所有TTS调用共用一个 requests.Session，连接池大小与服务端并发能力一致，
+    片段之间复用keep-alive连接，省去每次建立TCP连接的开销。
+    地址、超时与重试策略在此集中配置。
+    """
+
+    def __init__(self, url: str = TTS_URL, pool_size: int = 4, connect_timeout: float = 3.0,
+                 read_timeout: float = 30.0, retries: int = 2, backoff_factor: float = 0.3):
+        """
+        Args:
+            url: TTS服务地址
+            pool_size: 连接池大小，建议与TTS服务并发数一致
+            connect_timeout: 建连超时（秒）
+            read_timeout: 读取超时（秒）
+            retries: 连接失败或5xx时的重试次数
+            backoff_factor: 重试退避系数
+        """
+        self.url = url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,  # 读超时说明服务在合成，不重复提交
+            backoff_factor=backoff_factor,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, text: str, audio_paths: List[str], timeout: Optional[float] = None,
+             stream: bool = False) -> requests.Response:
+        """提交合成请求，返回原始响应（由调用方检查状态码）
+
+        stream=True 时只读取响应头即返回，响应体由调用方逐块读取
+        """
+        data = {
+            "text": text,
+            "audio_paths": audio_paths
+        }
+        return self.session.post(
+            self.url,
+            json=data,
+            timeout=(self.connect_timeout, timeout or self.read_timeout),
+            stream=stream
+        )
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_tts_client() -> TTSClient:
+    """获取进程内共享的TTS客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TTSClient()
+    return _client
+
+
+def configure_tts_client(**kwargs) -> TTSClient:
+    """以新配置替换共享的TTS客户端（参数同 TTSClient）"""
+    global _client
+    with _client_lock:
+        old_client = _client
+        _client = TTSClient(**kwargs)
+    if old_client is not None:
+        old_client.close()
+    return _client
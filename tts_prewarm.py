@@ -0,0 +1,322 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+
+# 会产生语音的工具及其默认角色（pipeline_tts_speak 固定为纳西妲）
+TTS_TOOLS = {
+    "advanced_character_tts": "纳西妲",
+    "simple_character_tts": "纳西妲",
+    "pipeline_tts_speak": "纳西妲",
+}
+
+
+def _parse_time(value) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    """逐行读取JSONL，跳过损坏的行（进程崩溃时最后一行可能不完整）"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except OSError:
+        return
+
+
+def _session_turns(snapshot: Optional[str], journal: Optional[str]) -> Iterator[dict]:
+    """快照中的回合 + 追加日志中快照之后的回合（跳过压缩时未及清空的重复回合）"""
+    snapshot_turns = 0
+    if snapshot:
+        try:
+            with open(snapshot, "r", encoding="utf-8") as f:
+                history = json.load(f).get("conversation_history", [])
+        except (OSError, ValueError):
+            history = []
+        snapshot_turns = len(history)
+        yield from history
+    if journal:
+        for turn in _read_jsonl(journal):
+            if (turn.get("metadata") or {}).get("turn_number", snapshot_turns + 1) > snapshot_turns:
+                yield turn
+
+
+def speech_from_execution(execution: dict) -> Optional[Tuple[str, str]]:
+    """从一次工具执行记录中取出 (角色, 文本)，不是语音工具时返回None"""
+    name = execution.get("function_name")
+    if name not in TTS_TOOLS:
+        return None
+    params = execution.get("parameters") or {}
+    if isinstance(params, str):
+        try:
+            params = json.loads(params)
+        except json.JSONDecodeError:
+            return None
+    text = params.get("text") if isinstance(params, dict) else None
+    if not text or not isinstance(text, str):
+        return None
+    character = TTS_TOOLS[name]
+    if name != "pipeline_tts_speak":
+        character = params.get("character") or character
+    return character, text.strip()
+
+
+def iter_logged_speech(log_dir: str, max_sessions: int = 50) -> Iterator[Tuple[str, str, Optional[float]]]:
+    """遍历 UniversalLLMLogger 日志中的语音工具调用，产出 (角色, 文本, 时间戳)
+
+    会话日志为快照（session_*.json）加追加日志（session_*.jsonl，快照之后的回合），两者合并读取；
+    都没有时（如写会话日志前崩溃）才读事件日志中的 tool_execution 记录，避免重复计数。
+    只读取最近的 max_sessions 个会话。
+    """
+    sessions = {}
+    for path in glob.glob(os.path.join(log_dir, "session_*.json*")):
+        base = os.path.basename(path)
+        if base.endswith(".jsonl"):
+            sessions.setdefault(base[:-6], {})["journal"] = path
+        elif base.endswith(".json"):
+            sessions.setdefault(base[:-5], {})["snapshot"] = path
+    for path in glob.glob(os.path.join(log_dir, "events_session_*.jsonl")):
+        session_id = os.path.basename(path)[len("events_"):].rsplit("_", 1)[0]
+        sessions.setdefault(session_id, {}).setdefault("events", []).append(path)
+
+    # 会话ID含启动时间（session_YYYYmmdd_HHMMSS），按名称排序即按时间排序
+    for session_id in sorted(sessions)[-max_sessions:]:
+        sources = sessions[session_id]
+        if "journal" in sources or "snapshot" in sources:
+            for turn in _session_turns(sources.get("snapshot"), sources.get("journal")):
+                timestamp = _parse_time(turn.get("timestamp"))
+                for execution in turn.get("tool_executions") or []:
+                    speech = speech_from_execution(execution)
+                    if speech:
+                        yield speech[0], speech[1], timestamp
+        else:
+            for path in sorted(sources.get("events", [])):
+                for record in _read_jsonl(path):
+                    if record.get("log_type") != "tool_execution":
+                        continue
+                    event = record.get("event") or {}
+                    speech = speech_from_execution(event)
+                    if speech:
+                        yield speech[0], speech[1], _parse_time(event.get("timestamp"))
+
+
+class PhrasePrewarmer:
+    """空闲时预合成常用台词，写入音频缓存
+
+    从对话日志中统计每个角色说过的话：
+    - 重复出现的整句回复（问候、应答等模板化台词）
+    - 回复的开头片段（按当前分段器切出的首段，命中后第一声无需等待合成）
+    按出现次数加权（越近期权重越高）排序，跳过已缓存的条目。
+
+    预合成以后台任务提交到共享调度器，只在没有真实合成任务时执行；
+    合成途中一旦有前台任务到来，立即断开请求让路，该条目稍后重试。
+    """
+
+    def __init__(self, log_dir: Optional[str] = "./Log", idle_after: float = 3.0, max_phrases: int = 40,
+                 min_count: int = 2, half_life_days: float = 7.0, max_sessions: int = 50,
+                 max_units: float = 60, rescan_interval: float = 300.0):
+        """
+        Args:
+            log_dir: UniversalLLMLogger 的日志目录
+            idle_after: 前台空闲多久（秒）后开始预合成
+            max_phrases: 每轮最多预合成的条目数
+            min_count: 至少出现几次才预合成
+            half_life_days: 出现次数的时间衰减半衰期（天）
+            max_sessions: 统计最近多少个会话
+            max_units: 超过该朗读量的整句不预合成（长回复几乎不会原样重复）
+            rescan_interval: 重新统计日志的最短间隔（秒）
+        """
+        self.log_dir = log_dir
+        self.idle_after = idle_after
+        self.max_phrases = max_phrases
+        self.min_count = min_count
+        self.half_life_days = half_life_days
+        self.max_sessions = max_sessions
+        self.max_units = max_units
+        self.rescan_interval = rescan_interval
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._queue: List[Tuple[str, str]] = []
+        self._last_scan = None
+        self._attempts = defaultdict(int)
+
+        self.synthesized = 0
+        self.yielded = 0
+        self.failed = 0
+
+    def collect_phrases(self, now: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        """统计日志，返回按权重降序的 [(角色, 文本, 权重)]（含已缓存的条目）"""
+        from text_segmenter import get_text_segmenter, speech_units
+        from voice_registry import get_voice_registry
+
+        if not self.log_dir or not os.path.isdir(self.log_dir):
+            return []
+
+        now = now or time.time()
+        registry = get_voice_registry()
+        segmenter = get_text_segmenter()
+        weights = defaultdict(float)
+        counts = defaultdict(int)
+
+        for character, text, timestamp in iter_logged_speech(self.log_dir, self.max_sessions):
+            voice = registry.resolve(character)
+            if voice is None or not text:
+                continue
+            age_days = max(0.0, now - timestamp) / 86400 if timestamp else 0.0
+            weight = math.pow(0.5, age_days / self.half_life_days)
+
+            candidates = set()
+            if speech_units(text) <= self.max_units:
+                candidates.add(text)
+            segments = segmenter.segment(text)
+            if len(segments) > 1:
+                candidates.add(segments[0])
+            for phrase in candidates:
+                key = (voice.name, phrase)
+                weights[key] += weight
+                counts[key] += 1
+
+        ranked = [(name, phrase, weight) for (name, phrase), weight in weights.items()
+                  if counts[(name, phrase)] >= self.min_count]
+        ranked.sort(key=lambda item: item[2], reverse=True)
+        return ranked
+
+    def refresh(self) -> int:
+        """重新统计日志，生成待预合成队列，返回队列长度"""
+        from audio_cache import get_audio_cache
+        from voice_registry import get_voice_registry
+
+        cache = get_audio_cache()
+        registry = get_voice_registry()
+        queue = []
+        for character, text, _ in self.collect_phrases():
+            voice = registry.resolve(character)
+            if voice is None or cache.contains(voice.name, text, voice.content_hash):
+                continue
+            if self._attempts[(voice.name, text)] >= 3:
+                continue  # 多次失败的条目不再尝试
+            queue.append((voice.name, text))
+            if len(queue) >= self.max_phrases:
+                break
+
+        self._queue = queue
+        self._last_scan = time.monotonic()
+        return len(queue)
+
+    def synthesize(self, character: str, text: str) -> str:
+        """流式合成一条台词并写入缓存（在调度器工作线程中执行）
+
+        Returns:
+            "done" / "yielded"（让路给前台任务） / "failed"
+        """
+        from audio_cache import get_audio_cache
+        from tts_client import get_tts_client
+        from tts_scheduler import get_tts_scheduler
+        from tts_stream import audio_complete, iter_wav_blocks, join_wav_blocks, open_decoder
+        from voice_registry import get_voice_registry
+
+        voice = get_voice_registry().resolve(character)
+        if voice is None:
+            return "failed"
+        scheduler = get_tts_scheduler()
+        if scheduler.foreground_active():
+            return "yielded"
+
+        response = get_tts_client().post(text, [voice.path], stream=True)
+        try:
+            if response.status_code != 200:
+                return "failed"
+            blocks = []
+            decoder = open_decoder(response)
+            for block in iter_wav_blocks(response, decoder=decoder):
+                if scheduler.foreground_active():
+                    return "yielded"
+                blocks.append(block)
+        finally:
+            response.close()
+
+        if not blocks or not audio_complete(decoder, text):
+            return "failed"  # 被截断的响应不缓存，之后再遇到这句台词时重新合成
+        get_audio_cache().put(voice.name, text, join_wav_blocks(blocks), voice.content_hash)
+        return "done"
+
+    def start(self):
+        """启动后台预合成线程"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="tts_prewarm")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _wait_for_idle(self) -> bool:
+        """等待前台空闲满 idle_after 秒，停止时返回False"""
+        from tts_scheduler import get_tts_scheduler
+
+        scheduler = get_tts_scheduler()
+        while not self._stop.is_set():
+            remaining = self.idle_after - scheduler.idle_for()
+            if remaining <= 0:
+                return True
+            # 前台忙时 idle_for 为0，按 idle_after 间隔复查
+            self._stop.wait(remaining)
+        return False
+
+    def _run(self):
+        from tts_scheduler import get_tts_scheduler
+
+        scheduler = get_tts_scheduler()
+        while self._wait_for_idle():
+            if not self._queue:
+                if self._last_scan is not None and time.monotonic() - self._last_scan < self.rescan_interval:
+                    self._stop.wait(self.rescan_interval - (time.monotonic() - self._last_scan))
+                    continue
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"⚠️ 预合成统计失败: {e}")
+                    self._last_scan = time.monotonic()
+                continue
+
+            character, text = self._queue.pop(0)
+            try:
+                outcome = scheduler.submit(self.synthesize, character, text, key="prewarm",
+                                           background=True).result()
+            except Exception:
+                outcome = "failed"
+
+            if outcome == "done":
+                self.synthesized += 1
+            elif outcome == "yielded":
+                self.yielded += 1
+                self._queue.insert(0, (character, text))
+            else:
+                self.failed += 1
+                self._attempts[(character, text)] += 1
+
+    def stats(self) -> dict:
+        return {
+            "synthesized": self.synthesized,
+            "yielded": self.yielded,
+            "failed": self.failed,
+            "queued": len(self._queue),
+        }
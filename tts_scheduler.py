@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Optional
+
+
+class TTSScheduler:
+    """进程内共享的TTS合成调度器
+
+    所有角色、所有调用的合成任务都提交到这里，由固定数量的常驻工作线程执行，
+    总并发不超过TTS服务的承载能力。调度规则：
+    - 每句话的首段优先（尽快出第一声）
+    - 其余片段按角色轮转取任务，多个角色同时说话时公平交错
+    - 后台任务（预合成）只在没有其他任务时执行，且同时最多 max_background 个
+    """
+
+    def __init__(self, max_concurrency: int = 3, max_background: int = 1):
+        """
+        Args:
+            max_concurrency: 同时进行的合成请求数，应与TTS服务并发数一致
+            max_background: 同时执行的后台任务数上限
+        """
+        self.max_concurrency = max_concurrency
+        self.max_background = max_background
+        self._cond = threading.Condition()
+        self._first_jobs = deque()  # 各句首段，先到先服务
+        self._jobs_by_key = OrderedDict()  # 角色 -> 待合成片段，按轮转顺序排列
+        self._background_jobs = deque()  # 空闲时才执行的后台任务
+        self._foreground_running = 0
+        self._background_running = 0
+        self._last_foreground = time.monotonic()  # 最近一次前台任务提交或结束的时间
+        self._workers = []
+        self._shutdown = False
+
+        self.completed_count = 0
+        self.cancelled_count = 0
+
+    def submit(self, fn: Callable, *args, key: str = "default", first: bool = False,
+               background: bool = False, **kwargs) -> Future:
+        """提交合成任务，返回Future
+
+        Args:
+            fn: 合成函数
+            key: 公平调度的分组键（一般为角色名）
+            first: 是否为一句话的首段（优先调度）
+            background: 后台任务，只在没有前台任务时执行
+        """
+        future = Future()
+        job = (future, fn, args, kwargs, background)
+
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("TTS调度器已关闭")
+            if background:
+                self._background_jobs.append(job)
+            elif first:
+                self._first_jobs.append(job)
+            else:
+                self._jobs_by_key.setdefault(key, deque()).append(job)
+            if not background:
+                self._last_foreground = time.monotonic()
+            self._ensure_workers()
+            self._cond.notify()
+
+        return future
+
+    def acquire(self, key: str = "default", first: bool = False) -> "SchedulerSlot":
+        """申请一个合成名额，请求由调用方自己发送（如异步客户端）
+
+        名额与 submit 的任务同样排队、计入并发上限（轮到时占用一个工作线程直到释放）。
+        slot.granted 在轮到时完成；用完或放弃时必须调用 slot.release()。
+        """
+        slot = SchedulerSlot()
+        slot._job = self.submit(slot._hold, key=key, first=first)
+        return slot
+
+    def pending_count(self) -> int:
+        """排队中的前台任务数"""
+        with self._cond:
+            return self._foreground_pending_locked()
+
+    def _foreground_pending_locked(self) -> int:
+        return len(self._first_jobs) + sum(len(jobs) for jobs in self._jobs_by_key.values())
+
+    def foreground_active(self) -> bool:
+        """是否有前台任务在排队或执行（后台任务据此让路）"""
+        with self._cond:
+            return self._foreground_running > 0 or self._foreground_pending_locked() > 0
+
+    def idle_for(self) -> float:
+        """前台空闲了多久（秒），有前台任务时为0"""
+        with self._cond:
+            if self._foreground_running or self._foreground_pending_locked():
+                return 0.0
+            return time.monotonic() - self._last_foreground
+
+    def shutdown(self, cancel_pending: bool = True):
+        """停止调度器，可选取消所有排队任务"""
+        with self._cond:
+            self._shutdown = True
+            if cancel_pending:
+                for job in self._drain_locked():
+                    job[0].cancel()
+            self._cond.notify_all()
+
+    def _ensure_workers(self):
+        """按需启动常驻工作线程（需持有锁）"""
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"tts_worker_{len(self._workers)}",
+                daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_job(self):
+        """取下一个任务：首段优先，其余按角色轮转，最后才是后台任务（需持有锁）"""
+        if self._first_jobs:
+            return self._first_jobs.popleft()
+
+        if self._jobs_by_key:
+            key, jobs = next(iter(self._jobs_by_key.items()))
+            job = jobs.popleft()
+            if jobs:
+                self._jobs_by_key.move_to_end(key)
+            else:
+                del self._jobs_by_key[key]
+            return job
+
+        if self._background_jobs and self._background_running < self.max_background:
+            return self._background_jobs.popleft()
+
+        return None
+
+    def _drain_locked(self):
+        """取出全部排队任务（需持有锁）"""
+        jobs = list(self._first_jobs)
+        self._first_jobs.clear()
+        for key_jobs in self._jobs_by_key.values():
+            jobs.extend(key_jobs)
+        self._jobs_by_key.clear()
+        jobs.extend(self._background_jobs)
+        self._background_jobs.clear()
+        return jobs
+
+    def _worker_loop(self):
+        """工作线程：取任务 -> 执行 -> 回填Future"""
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+
+                future, fn, args, kwargs, background = job
+                if not future.set_running_or_notify_cancel():
+                    self.cancelled_count += 1
+                    continue
+                if background:
+                    self._background_running += 1
+                else:
+                    self._foreground_running += 1
+
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+            with self._cond:
+                if background:
+                    self._background_running -= 1
+                else:
+                    self._foreground_running -= 1
+                    self._last_foreground = time.monotonic()
+                self.completed_count += 1
+                # 后台名额释放后可能有排队的后台任务可以执行
+                self._cond.notify()
+
+
+class SchedulerSlot:
+    """TTSScheduler.acquire 返回的名额"""
+
+    def __init__(self):
+        self.granted = Future()  # 轮到时完成（asyncio 中可用 asyncio.wrap_future 等待）
+        self._released = threading.Event()
+        self._job = None
+
+    def _hold(self):
+        """在工作线程中执行：通知调用方，占住名额直到释放"""
+        try:
+            self.granted.set_result(True)
+        except InvalidStateError:
+            return  # 调用方已放弃等待
+        self._released.wait()
+
+    def release(self):
+        """归还名额（可重复调用；尚未轮到时撤销排队）"""
+        self._released.set()
+        self.granted.cancel()
+        if self._job is not None:
+            self._job.cancel()
+
+
+_scheduler: Optional[TTSScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_tts_scheduler() -> TTSScheduler:
+    """获取共享的TTS调度器，并发上限与TTS客户端连接池一致"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from tts_client import get_tts_client
+                _scheduler = TTSScheduler(max_concurrency=get_tts_client().pool_size)
+    return _scheduler
@@ -1,125 +1,311 @@
-import requests
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import threading
 import time
-import concurrent.futures
+import wave
 from concurrent.futures import ThreadPoolExecutor
 
+from mock_tts_server import add_server_arguments, server_from_args
+from tts_client import TTS_URL, TTSClient
 
-def single_tts_request(request_id):
-    """单次TTS请求"""
-    url = "http://127.0.0.1:11996/tts_url"
-    data = {
-        "text": f"还是会想你，还是想登你。请求{request_id}",
-        "audio_paths": [
-            "./wavs/[纳西妲]好吧，我的想法是..wav",
-        ]
-    }
 
-    start_time = time.time()
+# 文本长度分布（字数范围）
+TEXT_PROFILES = {
+    "short": (4, 12),     # 应答、问候
+    "medium": (15, 40),   # 一般回复的单个分段
+    "long": (50, 120),    # 整段回复
+}
+TEXT_MIXES = {
+    "mixed": {"short": 0.5, "medium": 0.35, "long": 0.15},
+}
+
+# 用于截取测试文本的语料
+CORPUS = (
+    "还是会想你，还是想登你。旅行者，今天想听什么故事呢？舰长，快来陪我玩嘛！"
+    "博士，今天的任务已经整理好了。知识就像一棵大树，根扎得越深，枝叶就越茂盛。"
+    "外面在下雨，记得带伞哦。姐姐说今天要一起去看星星，舰长也一起来吧？"
+    "好的，我这就去办。这个问题有点难，让我想一想再回答你。"
+    "Hello, this is a mixed language test sentence. 我们明天见，Good night!"
+)
+
+DEFAULT_VOICE = "./wavs/纳西妲.wav"
+
+
+def parse_text_mix(spec: str) -> dict:
+    """解析文本分布：预设名（short/medium/long/mixed）或 short=0.5,long=0.5"""
+    if spec in TEXT_PROFILES:
+        return {spec: 1.0}
+    if spec in TEXT_MIXES:
+        return dict(TEXT_MIXES[spec])
+
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in TEXT_PROFILES:
+            raise ValueError(f"未知文本分布: {name}")
+        mix[name] = float(weight or 1.0)
+    return mix
+
+
+def make_texts(count: int, mix: dict, seed: int = 0) -> list:
+    """按分布生成测试文本（从语料中随机截取，以句号结尾）"""
+    rng = random.Random(seed)
+    profiles = list(mix)
+    weights = [mix[name] for name in profiles]
+    corpus = CORPUS * 4
+
+    texts = []
+    for _ in range(count):
+        low, high = TEXT_PROFILES[rng.choices(profiles, weights)[0]]
+        length = rng.randint(low, high)
+        start = rng.randrange(len(CORPUS))
+        texts.append(corpus[start:start + length].strip() + "。")
+    return texts
+
+
+def wav_seconds(audio: bytes):
+    """按实际收到的采样计算WAV时长（截断的音频按实际长度计），无法解析时返回None"""
     try:
-        response = requests.post(url, json=data)
-        end_time = time.time()
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            frame_bytes = wav.getsampwidth() * wav.getnchannels()
+            frames = len(wav.readframes(wav.getnframes())) // frame_bytes
+            return frames / float(wav.getframerate())
+    except (wave.Error, EOFError):
+        return None
 
-        # 保存音频文件
-        with open(f"output_{request_id}.wav", "wb") as f:
-            f.write(response.content)
 
-        return {
-            'request_id': request_id,
-            'duration': end_time - start_time,
-            'status_code': response.status_code,
-            'success': True
-        }
+def percentile(sorted_values: list, q: float):
+    """最近秩百分位数（输入需已排序）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_request(client: TTSClient, text: str, voice: str, scheduled: float) -> dict:
+    """执行一次合成请求并记录各阶段耗时
+
+    时间均相对计划发出时刻计算：开环压测下请求排队的时间也计入延迟，
+    避免协调遗漏（coordinated omission）把慢请求藏起来。
+    """
+    start = time.perf_counter()
+    result = {"chars": len(text), "queue_s": start - scheduled}
+    try:
+        response = client.post(text, [voice], stream=True)
+        first_byte = None
+        chunks = []
+        for chunk in response.iter_content(chunk_size=8192):
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            chunks.append(chunk)
+        end = time.perf_counter()
+        audio = b"".join(chunks)
+
+        result.update({
+            "status": response.status_code,
+            "success": response.status_code == 200,
+            "latency_s": end - scheduled,
+            "service_s": end - start,
+            "ttfb_s": (first_byte or end) - scheduled,
+            "bytes": len(audio),
+        })
+        if result["success"]:
+            audio_s = wav_seconds(audio)
+            result["audio_s"] = audio_s
+            result["rtf"] = (end - start) / audio_s if audio_s else None
+        else:
+            result["error"] = f"HTTP {response.status_code}"
     except Exception as e:
-        end_time = time.time()
-        return {
-            'request_id': request_id,
-            'duration': end_time - start_time,
-            'error': str(e),
-            'success': False
-        }
+        end = time.perf_counter()
+        result.update({"status": None, "success": False, "latency_s": end - scheduled,
+                       "service_s": end - start, "error": str(e)[:200]})
+    return result
+
+
+def run_open_loop(client: TTSClient, texts: list, voice: str, rate: float, max_inflight: int, seed: int = 0):
+    """开环压测：按泊松过程以固定平均速率发出请求，不等待前一个请求完成"""
+    rng = random.Random(seed)
+    results = [None] * len(texts)
+    executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="tts_load")
 
+    def record(index, future):
+        results[index] = future.result()
 
-def parallel_test(concurrent_count):
-    """并行测试函数"""
-    print(f"\n=== 并行数: {concurrent_count} ===")
+    begin = time.perf_counter()
+    scheduled = begin
+    for i, text in enumerate(texts):
+        scheduled += rng.expovariate(rate)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        future = executor.submit(run_request, client, text, voice, scheduled)
+        future.add_done_callback(lambda f, index=i: record(index, f))
 
-    start_time = time.time()
+    executor.shutdown(wait=True)
+    return results, time.perf_counter() - begin
 
-    # 使用ThreadPoolExecutor进行并行请求
-    with ThreadPoolExecutor(max_workers=concurrent_count) as executor:
-        # 提交任务
-        futures = [executor.submit(single_tts_request, i) for i in range(concurrent_count)]
 
-        # 等待所有任务完成并获取结果
-        results = [future.result() for future in concurrent.futures.as_completed(futures)]
+def run_closed_loop(client: TTSClient, texts: list, voice: str, concurrency: int):
+    """闭环压测：固定并发数，每个工作线程完成一个请求后立即发下一个"""
+    lock = threading.Lock()
+    queue = list(enumerate(texts))
+    results = [None] * len(texts)
 
-    end_time = time.time()
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                index, text = queue.pop(0)
+            results[index] = run_request(client, text, voice, time.perf_counter())
 
-    # 统计结果
-    total_time = end_time - start_time
-    successful_requests = [r for r in results if r['success']]
-    failed_requests = [r for r in results if not r['success']]
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - begin
 
-    if successful_requests:
-        individual_times = [r['duration'] for r in successful_requests]
-        avg_individual_time = sum(individual_times) / len(individual_times)
-        max_individual_time = max(individual_times)
-        min_individual_time = min(individual_times)
-    else:
-        avg_individual_time = max_individual_time = min_individual_time = 0
 
-    # 打印结果
-    print(f"总耗时: {total_time:.2f}s")
-    print(f"成功请求数: {len(successful_requests)}/{concurrent_count}")
-    print(f"失败请求数: {len(failed_requests)}")
-    print(f"平均单次耗时: {avg_individual_time:.2f}s")
-    print(f"最长单次耗时: {max_individual_time:.2f}s")
-    print(f"最短单次耗时: {min_individual_time:.2f}s")
+def summarize(results: list, wall_s: float) -> dict:
+    """汇总延迟分位数、首字节时间、实时率与吞吐"""
+    ok = [r for r in results if r["success"]]
 
-    if failed_requests:
-        print(f"失败请求详情:")
-        for req in failed_requests:
-            print(f"  请求{req['request_id']}: {req.get('error', 'Unknown error')}")
+    def stats(key):
+        values = sorted(r[key] for r in ok if r.get(key) is not None)
+        if not values:
+            return None
+        return {
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        }
 
+    audio_total = sum(r.get("audio_s") or 0.0 for r in ok)
     return {
-        'concurrent_count': concurrent_count,
-        'total_time': total_time,
-        'avg_individual_time': avg_individual_time,
-        'successful_count': len(successful_requests),
-        'failed_count': len(failed_requests)
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "wall_s": wall_s,
+        "throughput_rps": len(ok) / wall_s if wall_s else 0.0,
+        "latency_s": stats("latency_s"),
+        "ttfb_s": stats("ttfb_s"),
+        "service_s": stats("service_s"),
+        "rtf": stats("rtf"),
+        "audio_s_total": audio_total,
+        "audio_s_per_wall_s": audio_total / wall_s if wall_s else 0.0,
+        "errors": sorted({r["error"] for r in results if not r["success"]})[:10],
     }
 
 
+def print_summary(label: str, summary: dict):
+    print(f"\n=== {label} ===")
+    print(f"请求: {summary['succeeded']}/{summary['requests']} 成功, 错误率 {summary['error_rate']:.1%}, "
+          f"耗时 {summary['wall_s']:.2f}s, 吞吐 {summary['throughput_rps']:.2f} req/s")
+    print(f"{'指标':<12} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for key, name in (("latency_s", "延迟(s)"), ("ttfb_s", "首字节(s)"), ("service_s", "服务耗时(s)"), ("rtf", "RTF")):
+        row = summary[key]
+        if row:
+            print(f"{name:<12} {row['mean']:>8.3f} {row['p50']:>8.3f} {row['p95']:>8.3f} "
+                  f"{row['p99']:>8.3f} {row['max']:>8.3f}")
+    print(f"音频秒/墙钟秒: {summary['audio_s_per_wall_s']:.2f} (共 {summary['audio_s_total']:.1f}s 音频)")
+    for error in summary["errors"]:
+        print(f"  错误: {error}")
+
+
 def main():
-    """主函数"""
-    print("TTS服务并行请求测试开始...")
-
-    concurrent_levels = [2, 3, 4, 5]
-    all_results = []
-
-    for i, concurrent_count in enumerate(concurrent_levels):
-        # 执行测试
-        result = parallel_test(concurrent_count)
-        all_results.append(result)
-
-        # 测试间隔（最后一次测试后不需要等待）
-        if i < len(concurrent_levels) - 1:
-            print(f"\n等待2秒后进行下一轮测试...")
-            time.sleep(2)
-
-    # 汇总结果
-    print("\n" + "=" * 50)
-    print("测试结果汇总:")
-    print("=" * 50)
-    print(f"{'并行数':<8} {'总耗时(s)':<12} {'平均耗时(s)':<12} {'成功数':<8} {'失败数':<8}")
-    print("-" * 50)
-
-    for result in all_results:
-        print(f"{result['concurrent_count']:<8} "
-              f"{result['total_time']:<12.2f} "
-              f"{result['avg_individual_time']:<12.2f} "
-              f"{result['successful_count']:<8} "
-              f"{result['failed_count']:<8}")
+    parser = argparse.ArgumentParser(description="index-TTS 负载与延迟基准")
+    parser.add_argument("--url", default=TTS_URL, help="TTS服务地址")
+    parser.add_argument("--voice", default=DEFAULT_VOICE, help="参考音频路径（服务端路径）")
+    parser.add_argument("--texts", default="mixed", help="文本长度分布: short/medium/long/mixed 或 short=0.5,long=0.5")
+    parser.add_argument("--requests", type=int, default=50, help="每轮测量请求数")
+    parser.add_argument("--warmup", type=int, default=3, help="正式测量前的预热请求数（不计入结果）")
+    parser.add_argument("--rate", type=float, nargs="*", default=[],
+                        help="开环模式的平均到达率（req/s），可给多个")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[],
+                        help="闭环模式的并发数，可给多个（未指定 --rate 时默认 2 3 4 5）")
+    parser.add_argument("--max-inflight", type=int, default=32, help="开环模式的最大在途请求数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="结果写入JSON文件（- 表示标准输出）")
+    parser.add_argument("--raw", action="store_true", help="JSON中包含逐请求明细")
+    parser.add_argument("--stub", action="store_true", help="在进程内启动模拟TTS服务并对其压测")
+    add_server_arguments(parser.add_argument_group("模拟服务（--stub）"), prefix="stub-")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_text_mix(args.texts)
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.rate and not args.concurrency:
+        args.concurrency = [2, 3, 4, 5]
+
+    stub = None
+    url = args.url
+    if args.stub:
+        stub = server_from_args(args, prefix="stub-").start()
+        url = stub.url
+
+    pool_size = max([args.max_inflight if args.rate else 0] + args.concurrency)
+    client = TTSClient(url=url, pool_size=pool_size, retries=0)
+    # JSON输出到标准输出时，进度信息写到标准错误
+    out = sys.stderr if args.json == "-" else sys.stdout
+
+    report = {
+        "config": {"url": url, "voice": args.voice, "texts": mix, "requests": args.requests,
+                   "warmup": args.warmup, "seed": args.seed, "stub": args.stub},
+        "runs": [],
+    }
+
+    try:
+        print(f"TTS负载测试: {url}", file=out)
+        for text in make_texts(args.warmup, mix, seed=args.seed + 1):
+            run_request(client, text, args.voice, time.perf_counter())
+
+        runs = [("open", rate) for rate in args.rate] + [("closed", level) for level in args.concurrency]
+        for i, (mode, value) in enumerate(runs):
+            texts = make_texts(args.requests, mix, seed=args.seed + 100 + i)
+            if mode == "open":
+                label = f"开环 {value:g} req/s"
+                results, wall_s = run_open_loop(client, texts, args.voice, value, args.max_inflight, seed=args.seed + i)
+            else:
+                label = f"闭环 并发{value}"
+                results, wall_s = run_closed_loop(client, texts, args.voice, value)
+
+            summary = summarize(results, wall_s)
+            if stub is not None:
+                summary["stub"] = stub.stats()
+                stub.reset_stats()
+            if out is sys.stdout:
+                print_summary(label, summary)
+            else:
+                print(f"{label}: 完成", file=out)
+
+            run = {"mode": mode, "rate" if mode == "open" else "concurrency": value, "summary": summary}
+            if args.raw:
+                run["results"] = results
+            report["runs"].append(run)
+    finally:
+        client.close()
+        if stub is not None:
+            stub.stop()
+
+    if args.json:
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.json == "-":
+            print(data)
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(data)
+            print(f"\n结果已写入: {args.json}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import io
+import struct
+import threading
+import wave
+from typing import Callable, Dict, List, Optional
+
+from text_segmenter import get_text_segmenter, speech_units
+
+
+# 流式播放的分块时长：首块尽快出声，之后用较大的块减少排队对象
+FIRST_BLOCK_SECONDS = 0.25
+BLOCK_SECONDS = 1.0
+# 判断截断：音频时长不足按文本估计时长的该比例时视为不完整，不写入缓存
+MIN_AUDIO_RATIO = 0.5
+# 估计时长低于该值（秒）的短句不按时长判断（语速波动相对更大）
+MIN_CHECKED_SECONDS = 1.0
+
+
+class WavStreamDecoder:
+    """增量解析WAV响应流
+
+    按到达顺序喂入字节，解析出RIFF头中的格式信息后，只输出整帧的PCM数据。
+    不信任头中的数据长度（边合成边输出的服务会写占位值），读到哪里算哪里；
+    长度不是占位值时记在 data_bytes 中，用于事后判断响应是否被截断。
+    响应不是WAV（如服务直接返回裸PCM）时，按构造时给出的默认格式处理。
+    """
+
+    def __init__(self, raw_pcm: bool = False, channels: int = 1, sampwidth: int = 2, framerate: int = 22050):
+        """
+        Args:
+            raw_pcm: 响应体为裸PCM（无WAV头）
+            channels / sampwidth / framerate: 裸PCM的格式
+        """
+        self._buffer = bytearray()
+        self.header_done = raw_pcm
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.framerate = framerate
+        self.frames_decoded = 0
+        self.data_bytes: Optional[int] = None  # 头中声明的PCM长度（占位值时为None）
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.sampwidth
+
+    @property
+    def pcm_bytes(self) -> int:
+        return self.frames_decoded * self.frame_bytes
+
+    def feed(self, data: bytes) -> bytes:
+        """喂入数据，返回本次可用的整帧PCM（可能为空）"""
+        self._buffer.extend(data)
+        if not self.header_done and not self._parse_header():
+            return b""
+
+        usable = len(self._buffer) - len(self._buffer) % self.frame_bytes
+        if not usable:
+            return b""
+        pcm = bytes(self._buffer[:usable])
+        del self._buffer[:usable]
+        self.frames_decoded += usable // self.frame_bytes
+        return pcm
+
+    def _parse_header(self) -> bool:
+        """解析RIFF头直到 data 块开始，数据不足时返回False"""
+        buffer = self._buffer
+        if len(buffer) < 12:
+            return False
+        if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+            raise ValueError("响应不是WAV格式")
+
+        pos = 12
+        while True:
+            if len(buffer) < pos + 8:
+                return False
+            chunk_id = bytes(buffer[pos:pos + 4])
+            chunk_size = struct.unpack("<I", buffer[pos + 4:pos + 8])[0]
+            if chunk_id == b"data":
+                if chunk_size not in (0, 0xFFFFFFFF):
+                    self.data_bytes = chunk_size
+                del buffer[:pos + 8]
+                self.header_done = True
+                return True
+            if len(buffer) < pos + 8 + chunk_size:
+                return False
+            if chunk_id == b"fmt ":
+                fmt = buffer[pos + 8:pos + 8 + 16]
+                _, self.channels, self.framerate, _, _, bits = struct.unpack("<HHIIHH", fmt)
+                self.sampwidth = bits // 8
+            pos += 8 + chunk_size + (chunk_size & 1)
+
+    def to_wav(self, pcm: bytes) -> bytes:
+        """把一段PCM包装成独立的WAV（交给 pygame 做格式转换）"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(self.sampwidth)
+            wav.setframerate(self.framerate)
+            wav.writeframes(pcm)
+        return buffer.getvalue()
+
+    def seconds(self, pcm_bytes: int) -> float:
+        return pcm_bytes / float(self.frame_bytes * self.framerate)
+
+
+def open_decoder(response) -> WavStreamDecoder:
+    """按响应的 Content-Type 创建解码器（裸PCM或WAV）"""
+    content_type = response.headers.get("Content-Type", "")
+    return WavStreamDecoder(raw_pcm=content_type.startswith(("audio/pcm", "audio/l16", "audio/L16")))
+
+
+def audio_complete(decoder: WavStreamDecoder, text: str, audio_per_unit: Optional[float] = None) -> bool:
+    """一次流式合成的音频是否完整（完整才写入缓存）
+
+    头中写明了数据长度时，解码出的PCM必须达到该长度；长度为占位值时，
+    音频时长不能明显短于按文本估计的时长（每字时长取分段器的实测拟合）。
+    被截断但正常结束的响应仍可播放，只是不缓存、不计入分段器的测量。
+    """
+    if not decoder.header_done or not decoder.frames_decoded:
+        return False
+    if decoder.data_bytes is not None:
+        return decoder.pcm_bytes >= decoder.data_bytes
+    if audio_per_unit is None:
+        audio_per_unit = get_text_segmenter().profile()["audio_per_unit_s"]
+    expected = speech_units(text) * audio_per_unit
+    return expected < MIN_CHECKED_SECONDS or decoder.seconds(decoder.pcm_bytes) >= expected * MIN_AUDIO_RATIO
+
+
+def iter_wav_blocks(response, first_block: float = FIRST_BLOCK_SECONDS, block: float = BLOCK_SECONDS,
+                    chunk_size: int = 4096, decoder: Optional[WavStreamDecoder] = None):
+    """边下载边切块：每积累到足够时长的PCM就产出一个独立的WAV块
+
+    首块只需 first_block 秒即产出，让播放尽早开始；之后每块 block 秒。
+    传入 decoder（open_decoder 创建）时，结束后可用 audio_complete 检查是否被截断。
+    """
+    decoder = decoder or open_decoder(response)
+    pending = bytearray()
+    target = first_block
+
+    for data in response.iter_content(chunk_size=chunk_size):
+        pending.extend(decoder.feed(data))
+        if decoder.header_done and decoder.seconds(len(pending)) >= target:
+            yield decoder.to_wav(bytes(pending))
+            pending.clear()
+            target = block
+
+    if pending:
+        yield decoder.to_wav(bytes(pending))
+
+
+async def aiter_wav_blocks(response, first_block: float = FIRST_BLOCK_SECONDS, block: float = BLOCK_SECONDS,
+                           decoder: Optional[WavStreamDecoder] = None):
+    """iter_wav_blocks 的异步版本（httpx 异步流式响应）"""
+    decoder = decoder or open_decoder(response)
+    pending = bytearray()
+    target = first_block
+
+    async for data in response.aiter_bytes():
+        pending.extend(decoder.feed(data))
+        if decoder.header_done and decoder.seconds(len(pending)) >= target:
+            yield decoder.to_wav(bytes(pending))
+            pending.clear()
+            target = block
+
+    if pending:
+        yield decoder.to_wav(bytes(pending))
+
+
+def wav_duration(wav_bytes: bytes) -> float:
+    """WAV块的音频时长（秒）"""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
+
+
+def join_wav_blocks(blocks: List[bytes]) -> bytes:
+    """把同一格式的多个WAV块拼接成一个完整的WAV"""
+    if len(blocks) == 1:
+        return blocks[0]
+    pcm = []
+    params = None
+    for block in blocks:
+        with wave.open(io.BytesIO(block), "rb") as wav:
+            params = params or wav.getparams()
+            pcm.append(wav.readframes(wav.getnframes()))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(params.nchannels)
+        wav.setsampwidth(params.sampwidth)
+        wav.setframerate(params.framerate)
+        wav.writeframes(b"".join(pcm))
+    return buffer.getvalue()
+
+
+class SegmentSequencer:
+    """按片段顺序把（流式到达的）音频块送入声音流
+
+    各片段并发合成、乱序到达；当前片段的音频块到达即播放，
+    后续片段的块先缓存，等前面的片段全部结束后再按序送出。
+    失败的片段直接跳过，全部片段结束后关闭声音流。
+    """
+
+    def __init__(self, stream, total: int, make_sound: Callable[[bytes], object],
+                 on_played: Optional[Callable[[int], None]] = None):
+        """
+        Args:
+            stream: 目标 SoundStream
+            total: 片段总数
+            make_sound: 把WAV字节转换成可排播的声音对象
+            on_played: 某片段第一个音频块送入声音流时的回调（参数为片段编号）
+        """
+        self.stream = stream
+        self.total = total
+        self.make_sound = make_sound
+        self.on_played = on_played
+
+        self._lock = threading.Lock()
+        self._next = 0  # 正在送出的片段
+        self._blocks: Dict[int, List[bytes]] = {}  # 片段 -> 尚未送出的音频块
+        self._done = set()  # 已结束（成功或失败）的片段
+        self._started = set()  # 已开始送出的片段
+
+    def add_block(self, segment_id: int, wav_bytes: bytes):
+        """片段的一个音频块到达"""
+        with self._lock:
+            self._blocks.setdefault(segment_id, []).append(wav_bytes)
+            self._drain()
+
+    def finish(self, segment_id: int):
+        """片段合成结束（成功或失败都需调用）"""
+        with self._lock:
+            self._done.add(segment_id)
+            self._drain()
+
+    def _drain(self):
+        """送出当前片段已到达的块，当前片段结束则推进到下一个（需持有锁）"""
+        while self._next < self.total:
+            for wav_bytes in self._blocks.pop(self._next, []):
+                try:
+                    self.stream.enqueue(self.make_sound(wav_bytes))
+                except Exception as e:
+                    print(f"❌ 段{self._next}音频块解码失败: {e}")
+                    continue
+                if self._next not in self._started:
+                    self._started.add(self._next)
+                    if self.on_played:
+                        self.on_played(self._next)
+            if self._next not in self._done:
+                return
+            self._next += 1
+
+        self.stream.close()
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import threading
+import wave
+from typing import Dict, List, Optional
+
+
+VOICE_DIR = "./wavs"
+# 角色元数据（别名、介绍），可选
+VOICE_META_FILE = "voices.json"
+
+# 参考音频校验范围
+MIN_DURATION = 1.0
+MAX_DURATION = 30.0
+MIN_SAMPLE_RATE = 16000
+
+
+def _character_from_filename(filename: str) -> str:
+    """由文件名得到角色名：兼容 [角色].wav、角色音色.wav 两种旧命名"""
+    stem = os.path.splitext(filename)[0].strip()
+    if stem.startswith("[") and stem.endswith("]"):
+        stem = stem[1:-1].strip()
+    if stem.endswith("音色") and len(stem) > 2:
+        stem = stem[:-2]
+    return stem
+
+
+def _alias_key(name: str) -> str:
+    return name.strip().lower()
+
+
+class VoiceProfile:
+    """单个角色的参考音色"""
+
+    def __init__(self, name: str, path: str, aliases: Optional[List[str]] = None, description: str = ""):
+        self.name = name
+        self.path = path
+        self.aliases = aliases or []
+        self.description = description
+
+        self.duration = None
+        self.sample_rate = None
+        self.channels = None
+        self.problems: List[str] = []  # 校验不通过的原因
+        self._content_hash = None
+
+    @property
+    def content_hash(self) -> str:
+        """参考音频内容的哈希（音频缓存键的一部分，换文件后缓存自动失效）"""
+        if self._content_hash is None:
+            digest = hashlib.sha1()
+            with open(self.path, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    digest.update(block)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    @property
+    def valid(self) -> bool:
+        return not self.problems
+
+    def validate(self, min_duration: float = MIN_DURATION, max_duration: float = MAX_DURATION,
+                 min_sample_rate: int = MIN_SAMPLE_RATE):
+        """读取WAV头校验时长与采样率"""
+        self.problems = []
+        try:
+            with wave.open(self.path, "rb") as wav:
+                self.sample_rate = wav.getframerate()
+                self.channels = wav.getnchannels()
+                self.duration = wav.getnframes() / float(self.sample_rate or 1)
+        except (wave.Error, EOFError, OSError) as e:
+            self.problems.append(f"无法读取WAV: {e}")
+            return
+
+        if self.sample_rate < min_sample_rate:
+            self.problems.append(f"采样率过低: {self.sample_rate}Hz")
+        if self.duration < min_duration:
+            self.problems.append(f"时长过短: {self.duration:.2f}s")
+        elif self.duration > max_duration:
+            self.problems.append(f"时长过长: {self.duration:.2f}s")
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "aliases": self.aliases,
+            "description": self.description,
+            "duration": round(self.duration, 2) if self.duration is not None else None,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "valid": self.valid,
+            "problems": self.problems
+        }
+
+
+class VoiceRegistry:
+    """常驻内存的角色音色表
+
+    启动时扫描一次 ./wavs，读取 WAV 头校验每个参考音频（时长、采样率），
+    并合并 voices.json 中的别名与介绍。之后每次说话只是一次字典查找，
+    不再逐次 os.path.exists 试探多种文件名；校验失败的音色在启动时就会报告。
+    每次查找只 stat 一次目录，新增或删除参考音频后（目录 mtime 变化）自动重新扫描。
+    """
+
+    def __init__(self, voice_dir: str = VOICE_DIR, meta_file: str = VOICE_META_FILE):
+        self.voice_dir = voice_dir
+        self.meta_file = meta_file
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._voices: Dict[str, VoiceProfile] = {}  # 角色名 -> 音色
+        self._aliases: Dict[str, str] = {}  # 小写别名 -> 角色名
+
+    def refresh(self, force: bool = False) -> bool:
+        """目录有变化时重新扫描，返回目录是否存在"""
+        try:
+            mtime = os.stat(self.voice_dir).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._dir_mtime = None
+                self._voices = {}
+                self._aliases = {}
+            return False
+
+        if not force and mtime == self._dir_mtime:
+            return True
+
+        meta = self._load_meta()
+        voices = {}
+        with os.scandir(self.voice_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if not entry.is_file() or not entry.name.lower().endswith(".wav"):
+                    continue
+                name = _character_from_filename(entry.name)
+                # 同一角色有多个文件时，优先使用标准命名 角色.wav
+                if name in voices and entry.name != f"{name}.wav":
+                    continue
+                info = meta.get(name, {})
+                voice = VoiceProfile(name, entry.path, info.get("aliases", []), info.get("description", ""))
+                voice.validate()
+                voices[name] = voice
+
+        aliases = {}
+        for name, voice in voices.items():
+            for alias in [name] + voice.aliases:
+                aliases.setdefault(_alias_key(alias), name)
+
+        with self._lock:
+            self._voices = voices
+            self._aliases = aliases
+            self._dir_mtime = mtime
+
+        for voice in voices.values():
+            if not voice.valid:
+                print(f"⚠️ 音色 {voice.name} 校验未通过: {'；'.join(voice.problems)}")
+        return True
+
+    def _load_meta(self) -> dict:
+        """读取 voices.json：{角色名: {"aliases": [...], "description": "..."}}"""
+        path = os.path.join(self.voice_dir, self.meta_file)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 音色元数据读取失败: {e}")
+            return {}
+
+    def resolve(self, character: str) -> Optional[VoiceProfile]:
+        """按角色名或别名查找可用音色，不存在或校验未通过时返回None"""
+        self.refresh()  # 一次目录 stat，mtime 未变时不重新扫描
+        name = self._aliases.get(_alias_key(character))
+        voice = self._voices.get(name) if name else None
+        return voice if voice is not None and voice.valid else None
+
+    def voices(self, valid_only: bool = True) -> List[VoiceProfile]:
+        """全部音色（按角色名排序）"""
+        self.refresh()
+        return [voice for voice in self._voices.values() if voice.valid or not valid_only]
+
+    def names(self) -> List[str]:
+        """可用角色名列表"""
+        return [voice.name for voice in self.voices()]
+
+    def roster_prompt(self) -> str:
+        """生成系统提示词中的角色名单"""
+        lines = []
+        for i, voice in enumerate(self.voices(), 1):
+            lines.append(f"    {i}.{voice.name}：{voice.description}" if voice.description else f"    {i}.{voice.name}")
+        return "\n".join(lines)
+
+    def warm_up(self, text: str = "你好。") -> list:
+        """每个音色提交一次短合成，让TTS服务提前缓存说话人特征
+
+        通过共享调度器提交（不超过服务并发），返回各音色的Future
+        """
+        from tts_client import get_tts_client
+        from tts_scheduler import get_tts_scheduler
+
+        scheduler = get_tts_scheduler()
+        client = get_tts_client()
+
+        def on_done(name, future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None and future.result().status_code != 200:
+                error = f"HTTP {future.result().status_code}"
+            if error is not None:
+                print(f"⚠️ 音色 {name} 预热失败: {str(error)[:80]}")
+
+        futures = []
+        for voice in self.voices():
+            future = scheduler.submit(client.post, text, [voice.path], key="warmup")
+            future.add_done_callback(lambda f, name=voice.name: on_done(name, f))
+            futures.append(future)
+        return futures
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_voice_registry() -> VoiceRegistry:
+    """获取共享的角色音色表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = VoiceRegistry()
+    return _registry